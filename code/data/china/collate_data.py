@@ -5,36 +5,10 @@ import pandas as pd
 
 import geopandas as gpd
 import matplotlib.pyplot as plt
+from src import impute as cimpute
 from src import utils as cutil
 
 
-def convert_non_monotonic_to_nan(array):
-    """Converts a numpy array to a monotonically increasing one.
-
-    Args:
-        array (numpy.ndarray [N,]): input array
-
-    Returns:
-        numpy.ndarray [N,]: some values marked as missing, all non-missing
-            values should be monotonically increasing
-
-    Usage:
-        >>> convert_non_monotonic_to_nan(np.array([0, 0, 5, 3, 4, 6, 3, 7, 6, 7, 8]))
-        np.array([ 0.,  0., np.nan,  3., np.nan, np.nan,  3., np.nan,  6.,  7.,  8.])
-    """
-    keep = np.arange(0, len(array))
-    is_monotonic = False
-    while not is_monotonic:
-        is_monotonic_array = np.hstack(
-            (array[keep][1:] >= array[keep][:-1], np.array(True))
-        )
-        is_monotonic = is_monotonic_array.all()
-        keep = keep[is_monotonic_array]
-    out_array = np.full_like(array.astype(np.float), np.nan)
-    out_array[keep] = array[keep]
-    return out_array
-
-
 def log_interpolate(array):
     """Interpolates assuming log growth.
 
@@ -460,7 +434,7 @@ df.loc[:, "testing_regime"] = (
 # drop/impute non monotonic observations
 for col in ["cum_confirmed_cases", "cum_deaths", "cum_recoveries"]:
     for _, row in adm.iterrows():
-        df.loc[tuple(row), col] = convert_non_monotonic_to_nan(
+        df.loc[tuple(row), col] = cimpute.convert_non_monotonic_to_nan(
             df.loc[tuple(row), col].values
         )
         df.loc[tuple(row), col + "_imputed"] = log_interpolate(
@@ -10,6 +10,7 @@
 import numpy as np
 import pandas as pd
 
+from src import impute as cimpute
 from src import utils as cutil
 
 # Define paths
@@ -80,30 +81,6 @@ assert adm1_df["population"].isnull().sum() == 0
 
 
 # Define imputation functions
-def convert_non_monotonic_to_nan(array):
-    """Converts a numpy array to a monotonically increasing one.
-    Args:
-        array (numpy.ndarray [N,]): input array
-    Returns:
-        numpy.ndarray [N,]: some values marked as missing, all non-missing
-            values should be monotonically increasing
-    Usage:
-        >>> convert_non_monotonic_to_nan(np.array([0, 0, 5, 3, 4, 6, 3, 7, 6, 7, 8]))
-        np.array([ 0.,  0., np.nan,  3., np.nan, np.nan,  3., np.nan,  6.,  7.,  8.])
-    """
-    keep = np.arange(0, len(array))
-    is_monotonic = False
-    while not is_monotonic:
-        is_monotonic_array = np.hstack(
-            (array[keep][1:] >= array[keep][:-1], np.array(True))
-        )
-        is_monotonic = is_monotonic_array.all()
-        keep = keep[is_monotonic_array]
-    out_array = np.full_like(array.astype(np.float), np.nan)
-    out_array[keep] = array[keep]
-    return out_array
-
-
 def log_interpolate(array):
     """Interpolates assuming log growth.
     Args:
@@ -133,7 +110,7 @@ def impute_cumulative_array(array):
         np.array([0, 0, 2, 3, 4, 6, 7, 7, 8])
     """
     array = np.array(array).copy()
-    array = convert_non_monotonic_to_nan(array)
+    array = cimpute.convert_non_monotonic_to_nan(array)
     array = log_interpolate(array)
     return array
 
@@ -164,8 +141,9 @@ def impute_cumulative_df(df, src_col, dst_col, groupby_col):
 
         # Replace non-monotonic values in original `cum_confirmed_cases` column with nulls
         raw_cum_col = "cum_confirmed_cases"
-        sub.loc[sub[raw_cum_col].notnull(), raw_cum_col] = convert_non_monotonic_to_nan(
-            np.array(sub.loc[sub[raw_cum_col].notnull(), raw_cum_col])
+        is_filled = sub[raw_cum_col].notnull()
+        sub.loc[is_filled, raw_cum_col] = cimpute.convert_non_monotonic_to_nan(
+            np.array(sub.loc[is_filled, raw_cum_col])
         )
 
         df.loc[df[groupby_col] == adm_name] = sub
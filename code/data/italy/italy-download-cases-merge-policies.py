@@ -27,10 +27,17 @@ parser.add_argument(
 parser.add_argument(
     "--p", dest="p", action="store_true", help="print out print statements"
 )
+parser.add_argument(
+    "--cache-dir",
+    dest="cache_dir",
+    default=None,
+    help="reuse merged policy panels stored in this directory if inputs are unchanged",
+)
 parser.set_defaults(r=True, p=False)
 args = parser.parse_args()
 reload_raw = args.r
 print_stuff = args.p
+cache_dir = args.cache_dir
 
 # #### Define paths
 
@@ -358,10 +365,10 @@ def merge_health_and_policies(adm1_cases, adm2_cases, policies):
 
     # Assign policy indicators
     adm1_cases = cmerge.assign_policies_to_panel(
-        adm1_cases, policies, 1, get_latlons=False
+        adm1_cases, policies, 1, get_latlons=False, cache_dir=cache_dir
     )
     adm2_cases = cmerge.assign_policies_to_panel(
-        adm2_cases, policies, 2, get_latlons=False
+        adm2_cases, policies, 2, get_latlons=False, cache_dir=cache_dir
     )
 
     check_against_template(adm1_cases, adm2_cases)
@@ -11,6 +11,7 @@ from bs4 import BeautifulSoup
 
 import geopandas as gpd
 from fuzzywuzzy import fuzz, process
+from src import pop as cpop
 from src import utils as cutil
 
 idx = pd.IndexSlice
@@ -727,9 +728,15 @@ def main(download):
         out_dir = cutil.DATA_INTERIM / "adm" / fname
         out_dir.mkdir(parents=True, exist_ok=True)
         i.to_file(out_dir / f"{fname}.shp", index=True)
-        i.drop(columns="geometry").to_csv(
-            out_dir / f"{fname}.csv", index=True, float_format="%.3f"
-        )
+        adm_df = i.drop(columns="geometry")
+        adm_df.to_csv(out_dir / f"{fname}.csv", index=True, float_format="%.3f")
+
+        # Columnar copy of the CSV, which `src.pop` reads in its place, with floats rounded as
+        # they are written to the CSV
+        adm_df = adm_df.reset_index()
+        float_cols = adm_df.select_dtypes("float").columns
+        adm_df[float_cols] = adm_df[float_cols].applymap("{:.3f}".format).astype(float)
+        cpop.write_adm_pop_columnar(adm_df, out_dir / f"{fname}.npz")
 
 
 if __name__ == "__main__":
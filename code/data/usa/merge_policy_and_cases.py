@@ -1,3 +1,4 @@
+import argparse
 import os
 
 import pandas as pd
@@ -9,8 +10,16 @@ raw_data_dir = str(cutil.DATA_RAW / "usa")
 int_data_dir = str(cutil.DATA_INTERIM / "usa")
 proc_data_dir = str(cutil.DATA_PROCESSED / "adm1")
 
+parser = argparse.ArgumentParser()
+parser.add_argument(
+    "--cache-dir",
+    dest="cache_dir",
+    default=None,
+    help="reuse merged policy panels stored in this directory if inputs are unchanged",
+)
 
-def main():
+
+def main(cache_dir=None):
 
     add_testing_regime = True
     output_csv_name = "USA_processed.csv"
@@ -35,7 +44,9 @@ def main():
     policy_data.loc[:, "date_start"] = pd.to_datetime(policy_data["date_start"])
     policy_data["date_end"] = pd.to_datetime("2099-12-31")
 
-    df_merged = merge.assign_policies_to_panel(cases_data, policy_data, 1, method="USA")
+    df_merged = merge.assign_policies_to_panel(
+        cases_data, policy_data, 1, method="USA", cache_dir=cache_dir
+    )
 
     if add_testing_regime:
         testimg_regime_csv = os.path.join(
@@ -84,4 +95,5 @@ def main():
 
 
 if __name__ == "__main__":
-    main()
+    args = parser.parse_args()
+    main(cache_dir=args.cache_dir)
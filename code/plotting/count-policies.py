@@ -7,6 +7,7 @@
 
 import pandas as pd
 
+import src.hierarchy as chier
 import src.utils as cutil
 
 path_data_sources = cutil.DATA_RAW / "multi_country" / "data_sources.xlsx"
@@ -25,16 +26,6 @@ for country in countries:
     policies[country] = policies[country].rename(columns={"date": "date_start"})
 
 
-def get_policy_level(row):
-    """Assign row to a policy level by choosing the highest level of specificity of the policy within the row"""
-    for level in ["adm3", "adm2", "adm1"]:
-        level_name = level + "_name"
-        if level_name in row and row[level_name] not in ["All", "all"]:
-            return level
-
-    return "adm0"
-
-
 def get_adm_counts(policies_df):
     """Get adm-level policy counts for a country policy sheet"""
 
@@ -58,15 +49,13 @@ def get_adm_counts(policies_df):
     # Drop duplicates over groupby_cols
     policies_df = policies_df[groupby_cols].drop_duplicates()
 
-    # Replace 'all' with 'All' to work with `get_policy_level()`
-    for adm_level in adm_levels:
-        policies_df[adm_level] = policies_df[adm_level].replace({"all": "All"})
-
     # Don't count testing regime changes
     policies_df = policies_df[policies_df["policy"] != "testing_regime"]
 
     # Determine adm-level of each policy in `policies_df`
-    policies_df["policy_level"] = policies_df.apply(get_policy_level, axis=1)
+    policies_df["policy_level"] = "adm" + pd.Series(
+        chier.get_policy_levels(policies_df), index=policies_df.index
+    ).astype(str)
 
     # Return adm-level counts for this country
     return policies_df.groupby("policy_level")["policy_level"].count().to_dict()
@@ -0,0 +1,426 @@
+"""Benchmarks of the policy merge on synthetic countries, and of imputing cumulative counts
+
+Run with ``python -m src.benchmark --out benchmark.json`` from the ``code`` directory
+"""
+import argparse
+import contextlib
+import datetime
+import json
+import platform
+import tempfile
+import time
+import tracemalloc
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+import src.hierarchy as chier
+import src.impute as cimpute
+import src.merge as cmerge
+import src.utils as cutil
+
+# Country code of synthetic countries, which is not used by any real country
+SYNTHETIC_ISO = "SYN"
+
+# Sizes of synthetic countries benchmarked by default
+SCALES = {
+    "small": {"n_adm1": 4, "n_adm2": 4, "n_adm3": 3, "n_days": 60},
+    "medium": {"n_adm1": 12, "n_adm2": 6, "n_adm3": 4, "n_days": 120},
+    "large": {"n_adm1": 40, "n_adm2": 8, "n_adm3": 4, "n_days": 180},
+}
+
+# Lengths of series benchmarked by default in `benchmark_convert_non_monotonic`
+SERIES_LENGTHS = (1000, 10000)
+
+# Number of policies enacted by each adm-unit at each adm-level
+POLICIES_PER_UNIT = {0: 8, 1: 4, 2: 1, 3: 0.5}
+
+
+def make_adm_tables(n_adm1, n_adm2, n_adm3, rng):
+    """Make population tables of a synthetic country, formatted as ``adm{N}.csv``
+
+    Args:
+        n_adm1 (int): number of adm1 units in the country
+        n_adm2 (int): number of adm2 units in each adm1 unit
+        n_adm3 (int): number of adm3 units in each adm2 unit
+        rng (numpy.random.Generator): source of populations and locations
+
+    Returns:
+        dict: table of adm-units at each adm-level from 1 to 3, with columns "adm0_name",
+            "adm{N}_name" for each level down to N, "latitude", "longitude" and "population"
+    """
+    adm3 = pd.DataFrame(
+        [
+            (f"A{i}", f"A{i}B{j}", f"A{i}B{j}C{k}")
+            for i in range(n_adm1)
+            for j in range(n_adm2)
+            for k in range(n_adm3)
+        ],
+        columns=["adm1_name", "adm2_name", "adm3_name"],
+    )
+    adm3.insert(0, "adm0_name", SYNTHETIC_ISO)
+    adm3["latitude"] = rng.uniform(-60, 60, len(adm3)).round(3)
+    adm3["longitude"] = rng.uniform(-180, 180, len(adm3)).round(3)
+    adm3["population"] = rng.integers(1_000, 1_000_000, len(adm3))
+
+    adm_tables = {3: adm3}
+    for adm_level in [2, 1]:
+        adm_cols = ["adm0_name"] + [f"adm{i}_name" for i in range(1, adm_level + 1)]
+        adm_tables[adm_level] = (
+            adm3.groupby(adm_cols, sort=False)
+            .agg({"latitude": "mean", "longitude": "mean", "population": "sum"})
+            .reset_index()
+        )
+
+    return {adm_level: adm_tables[adm_level] for adm_level in [1, 2, 3]}
+
+
+def make_policies(
+    adm_tables, n_days, rng, policies_per_unit=POLICIES_PER_UNIT, p_optional=0.3
+):
+    """Make a table of policies enacted across a synthetic country
+
+    Policies are drawn from the categories of `src.merge.us_intensity_rules`, so each has both a
+    "policy_intensity" (as used by the "ITA" method) and "intensity_group" (as used by the "USA"
+    method)
+
+    Args:
+        adm_tables (dict): output of `make_adm_tables`
+        n_days (int): number of days over which policies are enacted, starting on 2020-01-01
+        rng (numpy.random.Generator): source of policies
+        policies_per_unit (dict): average number of policies enacted by each adm-unit at each
+            adm-level
+        p_optional (float): share of policies that are optional
+
+    Returns:
+        pandas.DataFrame: table of policies, formatted as ``{country_code}_policy_data_sources.csv``
+    """
+    units = {0: pd.DataFrame({"adm0_name": [SYNTHETIC_ISO]}), **adm_tables}
+    categories = list(cmerge.us_intensity_rules)
+
+    tables = []
+    for adm_level, per_unit in policies_per_unit.items():
+        n = rng.poisson(per_unit * len(units[adm_level]))
+        table = units[adm_level].iloc[rng.integers(0, len(units[adm_level]), n)]
+        tables.append(
+            table[[c for c in table.columns if c.startswith("adm")]].reset_index(
+                drop=True
+            )
+        )
+    policies = pd.concat(tables, ignore_index=True).fillna("All")
+
+    policies["date_start"] = pd.to_datetime("2020-01-01") + pd.to_timedelta(
+        rng.integers(0, n_days, len(policies)), unit="D"
+    )
+    policies["date_end"] = pd.NaT
+    policies["policy"] = rng.choice(categories, len(policies))
+    policies["policy_intensity"] = rng.choice([0.25, 0.5, 1.0], len(policies))
+    policies["optional"] = np.where(rng.random(len(policies)) < p_optional, "Y", "N")
+    policies["intensity_group"] = [
+        rng.choice(list(cmerge.us_intensity_rules[policy]["weights"]))
+        for policy in policies["policy"]
+    ]
+
+    return policies
+
+
+def make_cases(adm_tables, cases_level, n_days, rng):
+    """Make a panel of cumulative cases in each adm-unit of a synthetic country
+
+    Args:
+        adm_tables (dict): output of `make_adm_tables`
+        cases_level (int): adm-level of the panel (1, 2 or 3)
+        n_days (int): number of days in the panel, starting on 2020-01-01
+        rng (numpy.random.Generator): source of cases
+
+    Returns:
+        pandas.DataFrame: panel with columns "adm0_name", "adm{N}_name" for each level down to
+            `cases_level`, "date" and "cum_confirmed_cases"
+    """
+    units = adm_tables[cases_level].drop(
+        columns=["latitude", "longitude", "population"]
+    )
+    dates = pd.date_range("2020-01-01", periods=n_days)
+    cases = units.loc[units.index.repeat(n_days)].reset_index(drop=True)
+    cases["date"] = np.tile(dates, len(units))
+    cases["cum_confirmed_cases"] = (
+        rng.poisson(5, (len(units), n_days)).cumsum(axis=1).ravel()
+    )
+    return cases
+
+
+def make_synthetic_country(n_adm1, n_adm2, n_adm3, n_days, seed=0, **kwargs):
+    """Make all inputs of `src.merge.assign_policies_to_panel` for a synthetic country
+
+    Args:
+        n_adm1 (int): number of adm1 units in the country
+        n_adm2 (int): number of adm2 units in each adm1 unit
+        n_adm3 (int): number of adm3 units in each adm2 unit
+        n_days (int): number of days in the panel of cases
+        seed (int): seed of random inputs
+        **kwargs: passed to `make_policies`
+
+    Returns:
+        dict: population tables ("adm_tables", as in `make_adm_tables`), "policies", and
+            panels of "cases" at adm-levels 1 to 3
+    """
+    rng = np.random.default_rng(seed)
+    adm_tables = make_adm_tables(n_adm1, n_adm2, n_adm3, rng)
+    return {
+        "adm_tables": adm_tables,
+        "policies": make_policies(adm_tables, n_days, rng, **kwargs),
+        "cases": {
+            cases_level: make_cases(adm_tables, cases_level, n_days, rng)
+            for cases_level in [1, 2, 3]
+        },
+    }
+
+
+@contextlib.contextmanager
+def synthetic_data_interim(adm_tables):
+    """Point `src.utils.DATA_INTERIM` to a temporary directory holding `adm_tables` as ``adm{N}.csv``"""
+    data_interim = cutil.DATA_INTERIM
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        for adm_level, adm_table in adm_tables.items():
+            path = Path(tmp_dir) / "adm" / f"adm{adm_level}" / f"adm{adm_level}.csv"
+            path.parent.mkdir(parents=True)
+            adm_table.to_csv(path, index=False)
+        cutil.DATA_INTERIM = Path(tmp_dir)
+        try:
+            yield Path(tmp_dir)
+        finally:
+            cutil.DATA_INTERIM = data_interim
+
+
+def profile_call(func, *args, repeat=3, **kwargs):
+    """Time `func` and measure the peak memory it allocates
+
+    Args:
+        func (callable): function to profile
+        *args: passed to `func`
+        repeat (int): number of timed calls, of which the fastest is reported
+        **kwargs: passed to `func`
+
+    Returns:
+        dict: fastest time in "seconds", and "peak_mb" allocated by one more call
+    """
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func(*args, **kwargs)
+        times.append(time.perf_counter() - start)
+
+    # Trace memory in a separate call, since tracing slows allocations down
+    tracemalloc.start()
+    try:
+        func(*args, **kwargs)
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    return {"seconds": min(times), "peak_mb": peak / 2 ** 20}
+
+
+def benchmark_country(country, method, cases_level, repeat=3):
+    """Profile the stages of the policy merge on a synthetic country
+
+    Args:
+        country (dict): output of `make_synthetic_country`
+        method (str): method of calculating intensities ("ITA" or "USA")
+        cases_level (int): adm-level of the panel (1, 2 or 3)
+        repeat (int): as in `profile_call`
+
+    Returns:
+        list of dict: results of `profile_call` for "assign_policies_to_panel",
+            "apply_get_policy_level", "get_policy_levels", "get_policies_to_date_cache" and (for
+            the "USA" method) "calculate_intensities_usa"
+    """
+    cases_df = country["cases"][cases_level]
+    policies = country["policies"]
+
+    with synthetic_data_interim(country["adm_tables"]):
+        results = {
+            "assign_policies_to_panel": profile_call(
+                cmerge.assign_policies_to_panel,
+                cases_df,
+                policies,
+                cases_level,
+                get_latlons=False,
+                method=method,
+                repeat=repeat,
+            )
+        }
+
+        cases_df, policies, policy_list = cmerge.prepare_merge_inputs(
+            cases_df, policies, cases_level, get_latlons=False, method=method
+        )
+
+    # Micro-benchmark of assigning policy levels row by row and in one vectorized pass
+    results["apply_get_policy_level"] = profile_call(
+        policies.apply, chier.get_policy_level, axis=1, repeat=repeat
+    )
+    results["get_policy_levels"] = profile_call(
+        chier.get_policy_levels, policies, repeat=repeat
+    )
+
+    policy_popwts = [
+        p + "_popwt" for p in policy_list if p not in cmerge.exclude_from_popweights
+    ]
+    policy_panel = cmerge.initialize_panel(
+        cases_df, cases_level, policy_list, policy_popwts
+    )
+    results["get_policies_to_date_cache"] = profile_call(
+        cmerge.get_policies_to_date_cache,
+        policies,
+        policy_panel,
+        cases_level,
+        repeat=repeat,
+    )
+
+    if method == "USA":
+
+        def calculate_all_intensities():
+            for policy, policy_group in policies.groupby("policy"):
+                cmerge.calculate_intensities_usa(
+                    policy_group.copy(), cases_level, policy
+                )
+
+        results["calculate_intensities_usa"] = profile_call(
+            calculate_all_intensities, repeat=repeat
+        )
+
+    return [{"function": func, **result} for func, result in results.items()]
+
+
+def make_adversarial_series(length):
+    """Make a series of cumulative counts that rises for `length` - 1 values and then falls below
+    all of them, so that `src.impute.convert_non_monotonic_to_nan_iterative` drops one value per
+    pass
+    """
+    return np.append(np.arange(length - 1), -1)
+
+
+def benchmark_convert_non_monotonic(lengths=SERIES_LENGTHS, repeat=3):
+    """Profile `src.impute.convert_non_monotonic_to_nan` and the iterative implementation it
+    replaced on series from `make_adversarial_series`
+
+    Args:
+        lengths (list of int): lengths of series
+        repeat (int): as in `profile_call`
+
+    Returns:
+        list of dict: results of `profile_call`, with the "function" and "length" of each
+    """
+    records = []
+    for length in lengths:
+        array = make_adversarial_series(length)
+        for func in [
+            cimpute.convert_non_monotonic_to_nan,
+            cimpute.convert_non_monotonic_to_nan_iterative,
+        ]:
+            result = profile_call(func, array, repeat=repeat)
+            records.append({"function": func.__name__, "length": length, **result})
+
+    return records
+
+
+def run_benchmarks(
+    scales=SCALES,
+    methods=("ITA", "USA"),
+    cases_levels=(1, 2),
+    series_lengths=SERIES_LENGTHS,
+    repeat=3,
+    seed=0,
+):
+    """Profile the policy merge on synthetic countries of each size in `scales`, and the imputation
+    of cumulative counts on series of each length in `series_lengths`
+
+    Args:
+        scales (dict): sizes of synthetic countries, as keyword arguments of
+            `make_synthetic_country`
+        methods (list of str): methods of calculating intensities
+        cases_levels (list of int): adm-levels of panels
+        series_lengths (list of int): as in `benchmark_convert_non_monotonic`
+        repeat (int): as in `profile_call`
+        seed (int): seed of random inputs
+
+    Returns:
+        dict: "meta" describing the environment, one "results" record per scale, method,
+            adm-level and function profiled, and one "impute_results" record per series length and
+            function profiled
+    """
+    records = []
+    for scale, size in scales.items():
+        country = make_synthetic_country(**size, seed=seed)
+        for method in methods:
+            for cases_level in cases_levels:
+                for result in benchmark_country(country, method, cases_level, repeat):
+                    records.append(
+                        {
+                            "scale": scale,
+                            **size,
+                            "n_policies": len(country["policies"]),
+                            "method": method,
+                            "cases_level": cases_level,
+                            **result,
+                        }
+                    )
+
+    return {
+        "meta": {
+            "created": datetime.datetime.now().isoformat(timespec="seconds"),
+            "python": platform.python_version(),
+            "numpy": np.__version__,
+            "pandas": pd.__version__,
+            "machine": platform.machine(),
+            "repeat": repeat,
+            "seed": seed,
+        },
+        "results": records,
+        "impute_results": benchmark_convert_non_monotonic(series_lengths, repeat),
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument(
+        "--out", default="benchmark.json", help="path of JSON file of results"
+    )
+    parser.add_argument(
+        "--scales",
+        nargs="+",
+        choices=list(SCALES),
+        default=list(SCALES),
+        help="sizes of synthetic countries to benchmark",
+    )
+    parser.add_argument(
+        "--methods", nargs="+", choices=["ITA", "USA"], default=["ITA", "USA"]
+    )
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    benchmarks = run_benchmarks(
+        scales={scale: SCALES[scale] for scale in args.scales},
+        methods=args.methods,
+        repeat=args.repeat,
+        seed=args.seed,
+    )
+    with open(args.out, "w") as f:
+        json.dump(benchmarks, f, indent=2)
+
+    print(
+        pd.DataFrame(benchmarks["results"])
+        .set_index(["scale", "method", "cases_level", "function"])[
+            ["seconds", "peak_mb"]
+        ]
+        .round(3)
+        .to_string()
+    )
+    print(
+        pd.DataFrame(benchmarks["impute_results"])
+        .set_index(["length", "function"])[["seconds", "peak_mb"]]
+        .round(4)
+        .to_string()
+    )
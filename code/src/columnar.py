@@ -0,0 +1,207 @@
+import json
+
+import numpy as np
+import pandas as pd
+
+# Name of the array holding column names and types in each columnar file
+META_KEY = "__meta__"
+
+
+def run_length_encode(values):
+    """Encode an array as the start and value of each run of equal values
+
+    Args:
+        values (numpy.ndarray): 1-D array
+
+    Returns:
+        tuple of (numpy.ndarray, numpy.ndarray): position of the first value of each run, and the
+            value of each run
+    """
+    if len(values) == 0:
+        return np.zeros(0, dtype=np.int64), values
+    starts = np.flatnonzero(values[1:] != values[:-1]) + 1
+    starts = np.concatenate([[0], starts]).astype(np.int64)
+    return starts, values[starts]
+
+
+def run_length_decode(starts, values, length):
+    """Decode an array of `length` encoded by `run_length_encode`"""
+    return np.repeat(values, np.diff(np.append(starts, length)))
+
+
+def encode_column(ser, run_length=False):
+    """Encode a column as a dict of numpy arrays that can be stored in a ``.npz`` file
+
+    Args:
+        ser (pandas.Series): column with a numeric, boolean, datetime, categorical, string,
+            sparse, or nullable integer dtype
+        run_length (bool): whether to store a numeric or boolean column as runs of equal values,
+            which is compact for step functions such as policy variables
+
+    Returns:
+        tuple of (str, dict): kind of column, and arrays encoding it
+    """
+    if isinstance(ser.dtype, pd.SparseDtype):
+        return (
+            "sparse",
+            {
+                "indices": ser.array.sp_index.indices,
+                "values": ser.array.sp_values,
+                "fill_value": np.array(ser.dtype.fill_value, dtype=ser.dtype.subtype),
+                "length": np.array(len(ser)),
+            },
+        )
+    if run_length and ser.dtype.kind in "biuf":
+        starts, values = run_length_encode(ser.to_numpy())
+        return (
+            "run_length",
+            {"starts": starts, "values": values, "length": np.array(len(ser))},
+        )
+    if (
+        isinstance(ser.dtype, pd.api.extensions.ExtensionDtype)
+        and ser.dtype.kind in "iu"
+    ):
+        return (
+            "masked",
+            {
+                "values": ser.to_numpy(dtype=ser.dtype.numpy_dtype, na_value=0),
+                "mask": ser.isna().to_numpy(),
+            },
+        )
+    if isinstance(ser.dtype, pd.CategoricalDtype):
+        categories = ser.cat.categories.to_numpy()
+        return (
+            "category",
+            {"codes": ser.cat.codes.to_numpy(), "categories": categories.astype(str)},
+        )
+    if ser.dtype == object:
+        if not ser.dropna().map(type).eq(str).all():
+            raise TypeError(f"Column {ser.name} contains values that are not strings")
+        codes, categories = pd.factorize(ser)
+        return "string", {"codes": codes, "categories": categories.to_numpy(str)}
+    if ser.dtype.kind in "biufM":
+        return "array", {"values": ser.to_numpy()}
+
+    raise TypeError(f"Cannot store column {ser.name} of type {ser.dtype}")
+
+
+def decode_column(kind, arrays, rows=slice(None)):
+    """Decode a column encoded by `encode_column`
+
+    Args:
+        kind (str): kind of column
+        arrays (dict): arrays encoding the column
+        rows (slice or numpy.ndarray): rows to decode, as a slice or boolean mask. Strings are only
+            looked up for these rows
+
+    Returns:
+        numpy.ndarray or pandas.api.extensions.ExtensionArray: values of `rows`
+    """
+    if kind == "array":
+        return arrays["values"][rows]
+    if kind == "run_length":
+        return run_length_decode(
+            arrays["starts"], arrays["values"], int(arrays["length"])
+        )[rows]
+    if kind == "masked":
+        return pd.arrays.IntegerArray(arrays["values"][rows], arrays["mask"][rows])
+    if kind == "sparse":
+        fill_value = arrays["fill_value"]
+        dense = np.full(int(arrays["length"]), fill_value, dtype=fill_value.dtype)
+        dense[arrays["indices"]] = arrays["values"]
+        return pd.arrays.SparseArray(dense[rows], fill_value=fill_value[()])
+
+    codes = arrays["codes"][rows]
+    categories = arrays["categories"].astype(object)
+    if kind == "category":
+        return pd.Categorical.from_codes(codes, categories)
+
+    if len(categories) == 0:
+        return np.full(len(codes), np.nan, dtype=object)
+    return np.where(codes >= 0, categories[np.maximum(codes, 0)], np.nan)
+
+
+def match_column(kind, arrays, values):
+    """Find the rows of an encoded column whose values are in `values`, decoding only the unique
+    values of string and categorical columns
+    """
+    if kind in ["category", "string"]:
+        matched = np.flatnonzero(pd.Index(arrays["categories"]).isin(values))
+        return np.isin(arrays["codes"], matched)
+    if kind == "masked":
+        return np.isin(arrays["values"], values) & ~arrays["mask"]
+    return np.isin(np.asarray(decode_column(kind, arrays)), values)
+
+
+def write_columnar(df, path, run_length_cols=(), attrs=None):
+    """Write `df` to `path` as a ``.npz`` file with one or more arrays per column
+    Strings are stored as integer codes with their unique values, so they are read back quickly and
+    without parsing. Sparse columns are stored as their values that differ from the fill value. The
+    index of `df` is not stored
+
+    Args:
+        df (pandas.DataFrame): table with numeric, boolean, datetime, categorical, string,
+            sparse, or nullable integer columns
+        path (str or pathlib.Path): output path, which should end in ".npz"
+        run_length_cols (collection of str): numeric or boolean columns to store as runs of equal
+            values. These are read back as dense columns
+        attrs (dict): attributes of the table to store with it, which must be serializable as
+            JSON. These are read back by `read_columnar_meta`
+    """
+    arrays = dict()
+    meta = {"columns": [], "kinds": [], "attrs": attrs or dict()}
+    for i, col in enumerate(df.columns):
+        kind, col_arrays = encode_column(df.iloc[:, i], col in run_length_cols)
+        meta["columns"].append(col)
+        meta["kinds"].append(kind)
+        for name, arr in col_arrays.items():
+            arrays[f"{i}/{name}"] = arr
+
+    arrays[META_KEY] = np.array(json.dumps(meta))
+    with open(path, "wb") as f:
+        np.savez(f, **arrays)
+
+
+def read_columnar_meta(path):
+    """Read the names ("columns") and "kinds" of the columns of a table written by `write_columnar`,
+    and the "attrs" stored with it
+    """
+    with np.load(path) as npz:
+        return json.loads(str(npz[META_KEY]))
+
+
+def read_columnar(path, columns=None, filters=None):
+    """Read a table written by `write_columnar`, loading only the arrays of `columns`
+
+    Args:
+        path (str or pathlib.Path): path to ``.npz`` file
+        columns (list of str): columns to read. Reads all columns if not given
+        filters (dict): values (list) of columns to keep rows with, keyed on column. Rows are
+            selected before other columns are decoded
+
+    Returns:
+        pandas.DataFrame: table with a new RangeIndex
+    """
+    with np.load(path) as npz:
+        meta = json.loads(str(npz[META_KEY]))
+        if columns is None:
+            columns = meta["columns"]
+
+        def load_column(col):
+            i = meta["columns"].index(col)
+            prefix = f"{i}/"
+            arrays = {
+                key[len(prefix) :]: npz[key]
+                for key in npz.files
+                if key.startswith(prefix)
+            }
+            return meta["kinds"][i], arrays
+
+        rows = slice(None)
+        for col, values in (filters or dict()).items():
+            matched = match_column(*load_column(col), values)
+            rows = matched if isinstance(rows, slice) else rows & matched
+
+        data = {col: decode_column(*load_column(col), rows=rows) for col in columns}
+
+    return pd.DataFrame(data, columns=columns)
@@ -0,0 +1,44 @@
+import numpy as np
+
+
+def get_adm_levels(columns):
+    """List the levels of the "adm{N}_name" columns in `columns`, in increasing order
+
+    Args:
+        columns (iterable of str): column names, such as the columns of a table of policies
+
+    Returns:
+        list of int: adm-levels
+    """
+    return sorted(
+        int(col[3]) for col in columns if col.startswith("adm") and col.endswith("name")
+    )
+
+
+def get_policy_level(row):
+    """Get the level of the most specific adm-unit a policy is specified for, one row at a time
+    This is the original implementation, kept as a reference for `get_policy_levels`
+    """
+    for level in reversed(get_adm_levels(row.keys())):
+        if row[f"adm{level}_name"].lower() != "all":
+            return level
+    return 0
+
+
+def get_policy_levels(policies):
+    """Get the level of the most specific adm-unit each policy is specified for
+    A policy is specified for an adm-unit at each level where its name is not "All" (or "all")
+
+    Args:
+        policies (pandas.DataFrame): table of policies, with "adm{N}_name" columns
+
+    Returns:
+        numpy.ndarray: adm-level of each row of `policies`, or 0 for national policies
+    """
+    policy_levels = np.zeros(len(policies), dtype=int)
+    for level in get_adm_levels(policies.columns):
+        if level == 0:
+            continue
+        names = policies[f"adm{level}_name"].astype(str).str.lower().to_numpy()
+        policy_levels[names != "all"] = level
+    return policy_levels
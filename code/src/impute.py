@@ -4,6 +4,9 @@ import numpy as np
 # ### Impute values in cases where cumulative counts rise and then fall
 def convert_non_monotonic_to_nan(array):
     """Converts a numpy array to a monotonically increasing one.
+    A value is kept if no later value is smaller, which is found in one pass over
+    the minimum of all later values. Missing values are dropped, as are the values
+    just before them, which cannot be compared with them.
     Args:
         array (numpy.ndarray [N,]): input array
     Returns:
@@ -13,6 +16,31 @@ def convert_non_monotonic_to_nan(array):
         >>> convert_non_monotonic_to_nan(np.array([0, 0, 5, 3, 4, 6, 3, 7, 6, 7, 8]))
         np.array([ 0.,  0., np.nan,  3., np.nan, np.nan,  3., np.nan,  6.,  7.,  8.])
     """
+    out_array = np.full(len(array), np.nan)
+    if len(array) == 0:
+        return out_array
+
+    keep = np.arange(0, len(array))
+    is_nan = array != array
+    if is_nan[-1]:
+        # Nothing compares as no greater than a missing last value
+        return out_array
+    if is_nan.any():
+        keep = keep[np.hstack((array[1:] >= array[:-1], np.array(True)))]
+
+    kept = array[keep]
+    later_min = np.minimum.accumulate(kept[::-1])[::-1]
+    keep = keep[np.hstack((kept[:-1] <= later_min[1:], np.array(True)))]
+    out_array[keep] = array[keep]
+    return out_array
+
+
+def convert_non_monotonic_to_nan_iterative(array):
+    """Converts a numpy array to a monotonically increasing one, dropping the
+    values before each decrease until none are left. This takes one pass per
+    value dropped before a decrease, and is kept as a reference for
+    `convert_non_monotonic_to_nan`
+    """
     keep = np.arange(0, len(array))
     is_monotonic = False
     while not is_monotonic:
@@ -21,7 +49,7 @@ def convert_non_monotonic_to_nan(array):
         )
         is_monotonic = is_monotonic_array.all()
         keep = keep[is_monotonic_array]
-    out_array = np.full_like(array.astype(np.float), np.nan)
+    out_array = np.full_like(array.astype(float), np.nan)
     out_array[keep] = array[keep]
     return out_array
 
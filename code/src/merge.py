@@ -1,15 +1,26 @@
 import copy
 import datetime
-import pickle
+import hashlib
+import itertools
 import json
+import os
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
 
 import numpy as np
 import pandas as pd
 
+import src.columnar as ccol
+import src.hierarchy as chier
 import src.pop as cpop
+import src.profiling as cprof
 import src.utils as cutil
 
 popweighted_suffix = "popwt"
+
+# Increment when the output of `assign_policies_to_panel` changes, to invalidate cached panels
+merge_cache_version = 1
 exclude_from_popweights = [
     "testing_regime",
     "travel_ban_intl_in",
@@ -39,33 +50,11 @@ def count_policies_enacted(df, policy_list):
     return df
 
 
-def get_policy_level(row):
-    # Assign policy_level to distinguish policies specified at different admin-unit levels
-    adm_levels = sorted(
-        [
-            int(col[3])
-            for col in row.keys()
-            if col.startswith("adm") and col.endswith("name")
-        ],
-        reverse=True,
-    )
-    for level in adm_levels:
-        if row[f"adm{level}_name"].lower() != "all":
-            return level
-    return 0
-
-
 def get_intensities(policies, adm_level):
     if len(policies) == 0:
         return (0, 0)
 
-    adm_levels = sorted(
-        [
-            int(col[3])
-            for col in policies.columns
-            if col.startswith("adm") and col.endswith("name")
-        ]
-    )
+    adm_levels = chier.get_adm_levels(policies.columns)
     adm_lower_levels = [l for l in adm_levels if l <= adm_level]
     adm_higher_levels = [l for l in adm_levels if l > adm_level]
 
@@ -145,6 +134,138 @@ def get_intensities(policies, adm_level):
     return total_intensity, max_intensity
 
 
+def segment_sum(values, groups, n_groups):
+    """Sum `values` within each group, adding them in the same order as ``pandas.Series.sum``
+
+    Args:
+        values (numpy.ndarray): values to sum, with NaN counted as 0
+        groups (numpy.ndarray): group number of each of `values`, sorted
+        n_groups (int): number of groups
+
+    Returns:
+        numpy.ndarray: sum of each group, or 0 for groups without values
+    """
+    values = np.where(np.isnan(values), 0, values)
+    counts = np.bincount(groups, minlength=n_groups)
+    sums = np.zeros(n_groups)
+
+    # numpy adds fewer than 8 values one by one, and more in pairwise blocks
+    is_short = counts[groups] < 8
+    np.add.at(sums, groups[is_short], values[is_short])
+    starts = np.concatenate([[0], np.cumsum(counts)])
+    for group in np.flatnonzero(counts >= 8):
+        sums[group] = values[starts[group] : starts[group + 1]].sum()
+
+    return sums
+
+
+def get_intensities_batched(stacked, n_groups, is_int, adm_level):
+    """Calculate `get_intensities` for many groups of policies at once
+    Args:
+        stacked (pandas.DataFrame): policies of all groups, with the group number of each row in
+            "group", and the ratios of populations assigned by `src.pop.assign_pop_ratios`. Rows
+            are sorted by group, and otherwise in the order of each group's policies
+        n_groups (int): number of groups
+        is_int (numpy.ndarray): whether each group's "policy_intensity" has an integer type, which
+            sets the types of its results
+        adm_level (int): level of admin-unit on which policies are applied
+
+    Returns:
+        list of tuple: `get_intensities` of each group
+    """
+    adm_levels = chier.get_adm_levels(stacked.columns)
+    adm_lower_levels = [l for l in adm_levels if l <= adm_level]
+    adm_higher_levels = [l for l in adm_levels if l > adm_level]
+
+    groups = stacked["group"].to_numpy()
+    policy_level = stacked["policy_level"].to_numpy()
+    intensity = stacked["policy_intensity"].to_numpy(dtype=float, copy=True)
+
+    # Default intensity is the max intensity of units at this level and below, or 0
+    is_lower = np.isin(policy_level, adm_lower_levels)
+    default_intensity = np.zeros(n_groups)
+    np.fmax.at(default_intensity, groups[is_lower], intensity[is_lower])
+    has_lower = np.bincount(groups[is_lower], minlength=n_groups) > 0
+    row_default = default_intensity[groups]
+
+    max_intensity = np.full(n_groups, np.nan)
+    np.fmax.at(max_intensity, groups, intensity)
+
+    total_intensity = default_intensity.copy()
+    for level in adm_higher_levels:
+        if level == 3 and len(adm_higher_levels) == 2:
+            # Count adm3 policies above the max intensity of their adm2 against that intensity
+            is_level3 = policy_level == 3
+            adm2_idx = np.minimum(
+                np.searchsorted(level2_keys, adm2_keys), max(len(level2_keys) - 1, 0)
+            )
+            has_adm2_intensity = (
+                is_level3
+                & (adm2_codes >= 0)
+                & (np.append(level2_keys, -1)[adm2_idx] == adm2_keys)
+            )
+            adm2_intensity = np.where(
+                has_adm2_intensity, np.append(level2_adm_intensities, 0)[adm2_idx], 0
+            )
+            use_adm3_and_has_adm2 = has_adm2_intensity & (intensity > adm2_intensity)
+            additional_policy_intensities = (
+                (
+                    intensity[use_adm3_and_has_adm2]
+                    - adm2_intensity[use_adm3_and_has_adm2]
+                )
+                * stacked[cpop.get_pop_ratio_col(3, adm_level)].to_numpy()[
+                    use_adm3_and_has_adm2
+                ]
+            )
+            total_intensity += segment_sum(
+                additional_policy_intensities, groups[use_adm3_and_has_adm2], n_groups,
+            )
+            intensity[use_adm3_and_has_adm2] = 0
+
+        elif level == 2 and len(adm_higher_levels) == 2:
+            # Max adm2 policy intensities of each group, so that adm3 can compare. Each adm2 of
+            # each group is keyed by one integer
+            adm2_codes, adm2_names = pd.factorize(stacked["adm2_name"])
+            adm2_keys = groups.astype(np.int64) * (len(adm2_names) + 1) + adm2_codes
+            is_level2 = (policy_level == 2) & (adm2_codes >= 0)
+            level2_keys, level2_idx = np.unique(
+                adm2_keys[is_level2], return_inverse=True
+            )
+            level2_adm_intensities = np.full(len(level2_keys), np.nan)
+            np.fmax.at(level2_adm_intensities, level2_idx, intensity[is_level2])
+
+        this_adm_higher_than_adm = (policy_level == level) & (intensity > row_default)
+        additional_policy_intensities = (
+            (
+                intensity[this_adm_higher_than_adm]
+                - row_default[this_adm_higher_than_adm]
+            )
+            * stacked[cpop.get_pop_ratio_col(level, adm_level)].to_numpy()[
+                this_adm_higher_than_adm
+            ]
+        )
+        total_intensity += segment_sum(
+            additional_policy_intensities, groups[this_adm_higher_than_adm], n_groups
+        )
+
+    counts = np.bincount(groups, minlength=n_groups)
+    assert (total_intensity[counts > 0] <= 1).all(), f"{total_intensity}, {adm_level}"
+
+    # Intensities keep the type of each group's policy intensities, as in `get_intensities`
+    int_totals = is_int & has_lower & (len(adm_higher_levels) == 0)
+    return [
+        (0, 0)
+        if count == 0
+        else (
+            int(total) if int_total else float(total),
+            int(max_) if group_is_int else float(max_),
+        )
+        for count, total, max_, int_total, group_is_int in zip(
+            counts, total_intensity, max_intensity, int_totals, is_int
+        )
+    ]
+
+
 def preduce(policies, replaces):
     """Reduce a set of policies by removing all policies that are subsumed by another policy"""
     for p in set(replaces) & policies:
@@ -169,14 +290,142 @@ def pintensity(policies, weights):
     return total
 
 
+def compile_intensity_rules(rules):
+    """Compile the intensity rules of each policy into bitmasks, with one bit per intensity group
+    A final bit of each policy is reserved for intensity groups that are not in its rules
+
+    Args:
+        rules (dict): "weights" of each intensity group, and the groups that each group "replaces",
+            for each policy, as in `us_intensity_rules`
+
+    Returns:
+        dict: for each policy, a dict of
+            "groups" (list of str): name of the intensity group of each bit
+            "bits" (dict): bitmask of each intensity group
+            "replaces" (numpy.ndarray): bitmask of the groups replaced by the group of each bit
+            "weights" (numpy.ndarray): weight of the group of each bit (nan if it has no weight)
+            "int_weights" (int): bitmask of groups with integer weights
+    """
+    compiled = dict()
+    for policy, policy_rules in rules.items():
+        weights = policy_rules["weights"]
+        replaces = policy_rules["replaces"]
+
+        groups = list(weights)
+        for group, replaced in replaces.items():
+            groups += [g for g in [group] + replaced if g not in groups]
+        groups.append(None)
+        if len(groups) > 63:
+            raise ValueError(f"Too many intensity groups to compile for {policy}")
+
+        bits = {group: 1 << i for i, group in enumerate(groups)}
+        compiled[policy] = {
+            "groups": groups,
+            "bits": bits,
+            "replaces": np.array(
+                [sum(bits[g] for g in replaces.get(group, [])) for group in groups],
+                dtype=np.int64,
+            ),
+            "weights": np.array(
+                [weights.get(group, np.nan) for group in groups], dtype=float
+            ),
+            "int_weights": sum(
+                bits[g] for g, w in weights.items() if isinstance(w, int)
+            ),
+        }
+
+    return compiled
+
+
+us_intensity_bitmasks = compile_intensity_rules(us_intensity_rules)
+
+
+def get_intensity_bits(policies):
+    """Get the bitmask of the intensity groups of each policy, as compiled in `us_intensity_bitmasks`
+
+    Args:
+        policies (pandas.DataFrame): table of policies, with "intensity_group*" columns
+
+    Returns:
+        numpy.ndarray: bitmask of intensity groups of each row of `policies` (0 for policies without
+            intensity rules)
+    """
+    intensity_cols = [c for c in policies.columns if c.startswith("intensity_group")]
+
+    bits = np.zeros(len(policies), dtype=np.int64)
+    for policy, compiled in us_intensity_bitmasks.items():
+        is_policy = (policies["policy"] == policy).to_numpy()
+        unknown_bit = compiled["bits"][None]
+        for c in intensity_cols:
+            groups = policies.loc[is_policy, c].astype(str)
+            group_bits = groups.map(compiled["bits"]).fillna(unknown_bit)
+            group_bits[groups == "nan"] = 0
+            bits[is_policy] |= group_bits.to_numpy(dtype=np.int64)
+
+    return bits
+
+
+def reduce_intensity_bits(bits, compiled):
+    """Remove all groups that are replaced by another group from each bitmask in `bits`
+    This is the bitmask equivalent of `preduce`
+    """
+    replaced = np.zeros_like(bits)
+    for i, replaces in enumerate(compiled["replaces"]):
+        replaced |= np.where(bits & (1 << i), replaces, 0)
+
+    return bits & ~replaced
+
+
+def get_unknown_intensity_groups(policies, compiled):
+    """List the intensity groups of `policies` that are not in the rules compiled in `compiled`,
+    which all share its final bit
+
+    Returns:
+        list of str: names of the intensity groups, sorted
+    """
+    intensity_cols = [c for c in policies.columns if c.startswith("intensity_group")]
+    groups = set()
+    for c in intensity_cols:
+        groups.update(policies[c].astype(str))
+    return sorted(groups - set(compiled["bits"]) - {"nan"})
+
+
+def sum_intensity_bits(bits, compiled, unknown_groups=()):
+    """Get the total intensity of the groups in each bitmask in `bits`
+    This is the bitmask equivalent of `pintensity`
+
+    Args:
+        bits (numpy.ndarray): bitmasks of intensity groups
+        compiled (dict): compiled rules of the policy, as in `compile_intensity_rules`
+        unknown_groups (list of str): names of the groups not in the rules, as in
+            `get_unknown_intensity_groups`, which name the final bit in errors
+
+    Returns:
+        tuple of (numpy.ndarray, numpy.ndarray): total intensity of each bitmask, and whether it is
+            a sum of integer weights only
+    """
+    in_group = (bits[:, np.newaxis] >> np.arange(len(compiled["groups"]))) & 1
+
+    missing = in_group[:, np.isnan(compiled["weights"])].any(axis=0)
+    if missing.any():
+        group = np.array(compiled["groups"], dtype=object)[
+            np.isnan(compiled["weights"])
+        ][missing][0]
+        if group is None:
+            group = ", ".join(unknown_groups) if len(unknown_groups) > 0 else "unknown"
+        raise ValueError(f"Missing intensity group: {group}")
+
+    intensity = in_group @ np.nan_to_num(compiled["weights"])
+    is_int = (bits & ~compiled["int_weights"]) == 0
+    return intensity, is_int
+
+
 def calculate_intensities_usa(policies_to_date, adm_level, policy):
     """
     Calculate policy intensities for each adm-unit in the US, based on weights
     and rules defined in `us_intensity_rules`
     """
-
-    weights = us_intensity_rules[policy]["weights"]
-    replaces = us_intensity_rules[policy]["replaces"]
+    compiled = us_intensity_bitmasks[policy]
 
     intensity_cols = [
         c for c in policies_to_date.columns if c.startswith("intensity_group")
@@ -191,80 +440,143 @@ def calculate_intensities_usa(policies_to_date, adm_level, policy):
         "adm1_pop",
     ] + intensity_cols
 
-    # Get all policies at adm-levels 0 or 1
-    level1 = policies_to_date[policies_to_date["policy_level"].isin([0, 1])][pcols]
+    if "intensity_bits" in policies_to_date.columns:
+        bits = policies_to_date["intensity_bits"].to_numpy(dtype=np.int64)
+    else:
+        bits = get_intensity_bits(policies_to_date)
+    policy_level = policies_to_date["policy_level"].to_numpy()
 
-    level1_policies = set()
-    for c in intensity_cols:
-        level1_policies = level1_policies | set(level1[c].unique())
-    level1_policies = level1_policies - set([np.nan])
+    # Name the groups without rules, which can only be summed to raise an error
+    unknown_groups = []
+    if (bits & compiled["bits"][None]).any():
+        unknown_groups = get_unknown_intensity_groups(policies_to_date, compiled)
 
-    level1_policies = preduce(level1_policies, replaces)
-    intensity = pintensity(level1_policies, weights)
-    policies_to_date["policy_intensity"] = intensity
+    # Get all policies at adm-levels 0 or 1
+    level1_bits = reduce_intensity_bits(
+        np.bitwise_or.reduce(bits[np.isin(policy_level, [0, 1])], keepdims=True),
+        compiled,
+    )
+    intensity, is_int = sum_intensity_bits(level1_bits, compiled, unknown_groups)
+    intensities = np.full(len(policies_to_date), intensity[0])
+    all_int = is_int.all()
 
     # Get all policies at adm-level 2 (or 0 or 1)
-    level2_policies = dict()
-    for adm2 in policies_to_date[policies_to_date["policy_level"] == 2][
-        "adm2_name"
-    ].unique():
-        l2_mask = (policies_to_date["policy_level"] == 2) & (
-            policies_to_date["adm2_name"] == adm2
-        )
+    is_level2 = policy_level == 2
+    adm2_idx, adm2s = pd.factorize(policies_to_date.loc[is_level2, "adm2_name"])
+    level2_bits = np.zeros(len(adm2s), dtype=np.int64)
+    np.bitwise_or.at(level2_bits, adm2_idx, bits[is_level2])
+    level2_bits = reduce_intensity_bits(level2_bits | level1_bits, compiled)
+    intensity, is_int = sum_intensity_bits(level2_bits, compiled, unknown_groups)
+    intensities[is_level2] = intensity[adm2_idx]
+    all_int = all_int and is_int.all()
 
-        level2_adm = policies_to_date[l2_mask][pcols]
+    # Get all policies at adm-level 3 (or 0 or 1 or 2)
+    is_level3 = policy_level == 3
+    level3 = policies_to_date.loc[is_level3, ["adm2_name", "adm3_name"]]
+    adm3_idx = level3.groupby(["adm2_name", "adm3_name"], sort=False).ngroup()
+    adm3_idx = adm3_idx.to_numpy()
+    adm3_adm2s = level3["adm2_name"].to_numpy()[
+        pd.Series(adm3_idx).drop_duplicates().index
+    ]
+    level3_bits = np.zeros(len(adm3_adm2s), dtype=np.int64)
+    np.bitwise_or.at(level3_bits, adm3_idx, bits[is_level3])
+    level3_bits = level3_bits | level1_bits
+    has_level2 = adm2s.get_indexer(adm3_adm2s)
+    level3_bits[has_level2 >= 0] |= level2_bits[has_level2[has_level2 >= 0]]
+    level3_bits = reduce_intensity_bits(level3_bits, compiled)
+    intensity, is_int = sum_intensity_bits(level3_bits, compiled, unknown_groups)
+    intensities[is_level3] = intensity[adm3_idx]
+    all_int = all_int and is_int.all()
+
+    policies_to_date["policy_intensity"] = (
+        intensities.astype(int) if all_int else intensities
+    )
 
-        l2_adm_policies = set()
-        for c in intensity_cols:
-            l2_adm_policies = l2_adm_policies | set(level2_adm[c].unique())
+    policies_to_date["optional"] = 0
+    policies_to_date = policies_to_date.drop_duplicates(pcols)
+    return policies_to_date
 
-        l2_adm_policies = l2_adm_policies | level1_policies
-        l2_adm_policies = l2_adm_policies - set([np.nan])
 
-        l2_adm_policies = preduce(l2_adm_policies, replaces)
-        level2_policies[adm2] = l2_adm_policies
-        intensity = pintensity(l2_adm_policies, weights)
-        policies_to_date.loc[l2_mask, "policy_intensity"] = intensity
+def build_area_index(other, adm_levels):
+    """Index the maximum intensity of the policies in `other` by the area they cover
+    The index is a tree with one level per adm-level, where "All" and "all" are the same wildcard
+    node, and each leaf holds the maximum intensity of the policies covering exactly that area
 
-    # Get all policies at adm-level 3 (or 0 or 1 or 2)
-    level3_policies = dict()
-    for adm2, adm3 in (
-        policies_to_date[policies_to_date["policy_level"] == 3][
-            ["adm2_name", "adm3_name"]
-        ]
-        .drop_duplicates()
-        .to_numpy()
-    ):
-        l3_mask = (
-            (policies_to_date["policy_level"] == 3)
-            & (policies_to_date["adm3_name"] == adm3)
-            & (policies_to_date["adm2_name"] == adm2)
-        )
-        level3_adm = policies_to_date[l3_mask][pcols]
+    Args:
+        other (pandas.DataFrame): table of policies
+        adm_levels (list of int): adm-levels with "adm{level}_name" columns in `other`, in order
 
-        l3_adm_policies = set()
-        for c in intensity_cols:
-            l3_adm_policies = l3_adm_policies | set(level3_adm[c].unique())
-        l3_adm_policies = l3_adm_policies - set([np.nan])
+    Returns:
+        dict: nested dicts keyed by adm-unit name (or "All"), one level per adm-level
+    """
+    adm_cols = [f"adm{level}_name" for level in adm_levels]
+    areas = other[adm_cols].replace("all", "All").itertuples(index=False, name=None)
 
-        l3_adm_policies = l3_adm_policies | set(level1_policies)
+    area_index = dict()
+    for area, intensity in zip(areas, other["policy_intensity"]):
+        node = area_index
+        for name in area[:-1]:
+            node = node.setdefault(name, dict())
+        # Take maximum ignoring nulls, like ``Series.max``
+        node[area[-1]] = np.fmax(node.get(area[-1], np.nan), intensity)
 
-        if adm2 in level2_policies:
-            l3_adm_policies = l3_adm_policies | level2_policies[adm2]
+    return area_index
 
-        l3_adm_policies -= set([np.nan])
-        l3_adm_policies = preduce(l3_adm_policies, replaces)
-        intensity = pintensity(l3_adm_policies, weights)
-        policies_to_date.loc[l3_mask, "policy_intensity"] = intensity
 
-    policies_to_date["optional"] = 0
-    policies_to_date = policies_to_date.drop_duplicates(pcols)
-    return policies_to_date
+def get_covering_intensity(policies, area_index, adm_levels):
+    """Find the maximum intensity of the indexed policies that cover the area of each policy in `policies`
+    An indexed policy covers a policy if, at every adm-level, it either has the same adm-unit or is
+    set to "All". This is used so that the full optional intensity (but no more) will be accounted
+    for in the overlap between mandatory and optional policies
 
+    Args:
+        policies (pandas.DataFrame): table of policies
+        area_index (dict): output of `build_area_index`
+        adm_levels (list of int): adm-levels with "adm{level}_name" columns in `policies`, in order
 
-def calculate_intensities_adm_day_policy(
-    policies_to_date, adm_level, policy, method="ITA"
-):
+    Returns:
+        numpy.ndarray: maximum covering intensity of each row of `policies`, or 0 if none covers it
+    """
+
+    def covering_intensities(node, area):
+        # Follow both the exact adm-unit and the wildcard at each level
+        if len(area) == 0:
+            return [node]
+        intensities = []
+        for name in set([area[0], "All"]):
+            if name in node:
+                intensities += covering_intensities(node[name], area[1:])
+        return intensities
+
+    adm_cols = [f"adm{level}_name" for level in adm_levels]
+    areas = list(
+        policies[adm_cols].replace("all", "All").itertuples(index=False, name=None)
+    )
+
+    area_intensities = dict()
+    for area in set(areas):
+        intensities = covering_intensities(area_index, area)
+        area_intensities[area] = (
+            np.fmax.reduce(intensities) if len(intensities) > 0 else 0
+        )
+
+    return np.array([area_intensities[area] for area in areas])
+
+
+def split_policies_adm_day_policy(policies_to_date, adm_level, policy, method="ITA"):
+    """Split the policies in force into the tables whose intensities make up the policy variables
+    Args:
+        policies_to_date (pandas.DataFrame): policies in force for an adm-unit, date and policy category
+        adm_level (int): level of admin-unit on which policies are applied
+        policy (str): name of policy category
+        method (str): method of calculating intensities ("ITA" or "USA")
+
+    Returns:
+        tuple of (pandas.DataFrame, pandas.DataFrame, pandas.DataFrame): mandatory policies,
+            optional policies not covered by mandatory ones, and mandatory policies covered by
+            optional ones (with the optional intensity), or None if there are not both mandatory
+            and optional policies
+    """
     if method == "USA":
         if policy in us_intensity_rules:
             policies_to_date = calculate_intensities_usa(
@@ -273,88 +585,56 @@ def calculate_intensities_adm_day_policy(
         else:
             policies_to_date["policy_intensity"] = 1
 
-    adm_name = f"adm{adm_level}_name"
-    adm_intensity = f"adm{adm_level}_policy_intensity"
-    adm_levels = sorted(
-        [
-            int(col[3])
-            for col in policies_to_date.columns
-            if col.startswith("adm") and col.endswith("name")
-        ]
-    )
-    adm_lower_levels = [l for l in adm_levels if l <= adm_level]
-    adm_higher_levels = [l for l in adm_levels if l > adm_level]
-
-    def in_other(row, other):
-        """Find any rows in `other` that cover the area covered by the policy `row`, returning the maximum
-        intensity in `other` so that the full optional intensity (but no more) will be accounted for in the
-        overlap DataFrame
-        """
-        other_contains_row = np.ones_like(other["adm0_name"], dtype=bool)
-        for level in adm_levels:
-            other_contains_row = (other_contains_row) & (
-                other[f"adm{level}_name"].isin([row[f"adm{level}_name"], "all", "All"])
-            )
-
-        if other_contains_row.sum() == 0:
-            return 0
-
-        return other.loc[other_contains_row, "policy_intensity"].max()
+    adm_levels = chier.get_adm_levels(policies_to_date.columns)
 
     is_opt = policies_to_date["optional"] == 1
     policies_opt = policies_to_date[is_opt].copy()
     policies_mand = policies_to_date[~is_opt].copy()
 
-    if len(policies_opt) > 0 and len(policies_mand) > 0:
-        # Apply logic of calculating mandatory policies fully,
-        # calculating optional policies by taking the full value
-        # and subtracting the value of those policies that have
-        # overlap with mandatory policies
+    if len(policies_opt) == 0 or len(policies_mand) == 0:
+        return policies_mand, policies_opt, None
 
-        policies_opt["intensity_in_mand"] = policies_opt.apply(
-            lambda row: in_other(row, policies_mand), axis=1
-        )
-        policies_opt = policies_opt[policies_opt["intensity_in_mand"] == 0]
-        policies_mand["intensity_in_opt"] = policies_mand.apply(
-            lambda row: in_other(row, policies_opt), axis=1
-        )
+    # Apply logic of calculating mandatory policies fully,
+    # calculating optional policies by taking the full value
+    # and subtracting the value of those policies that have
+    # overlap with mandatory policies
+    policies_opt["intensity_in_mand"] = get_covering_intensity(
+        policies_opt, build_area_index(policies_mand, adm_levels), adm_levels
+    )
+    policies_opt = policies_opt[policies_opt["intensity_in_mand"] == 0]
+    policies_mand["intensity_in_opt"] = get_covering_intensity(
+        policies_mand, build_area_index(policies_opt, adm_levels), adm_levels
+    )
 
-        # Set `policies_overlap` to the mandatory policies that are found in `policies_opt`, with `policy_intensity`
-        # replaced by the intensity found in the corresponding row of `policies_opt`
-        policies_overlap = policies_mand[policies_mand["intensity_in_opt"] > 0].copy()
-        policies_overlap = policies_overlap.drop(columns=["policy_intensity"])
-        policies_overlap = policies_overlap.rename(
-            columns={"intensity_in_opt": "policy_intensity"}
-        )
+    # Set `policies_overlap` to the mandatory policies that are found in `policies_opt`, with `policy_intensity`
+    # replaced by the intensity found in the corresponding row of `policies_opt`
+    policies_overlap = policies_mand[policies_mand["intensity_in_opt"] > 0].copy()
+    policies_overlap = policies_overlap.drop(columns=["policy_intensity"])
+    policies_overlap = policies_overlap.rename(
+        columns={"intensity_in_opt": "policy_intensity"}
+    )
 
-        total_mandatory_intensity, mandatory_intensity_indicator = get_intensities(
-            policies_mand, adm_level
-        )
-        subtotal_optional_intensity, optional_intensity_indicator = get_intensities(
-            policies_opt, adm_level
-        )
-        total_overlap_intensity, overlap_intensity_indicator = get_intensities(
-            policies_overlap, adm_level
-        )
+    return policies_mand, policies_opt, policies_overlap
 
-        total_optional_intensity = subtotal_optional_intensity - total_overlap_intensity
-        assert total_optional_intensity >= 0
-    else:
-        # If there are not both mandatory and optional policies, just get the intensities of those DataFrames
-        # individually, without worrying about overlap
-        if len(policies_opt) == 0:
-            total_optional_intensity, optional_intensity_indicator = (0, 0)
-        else:
-            total_optional_intensity, optional_intensity_indicator = get_intensities(
-                policies_opt, adm_level
-            )
 
-        if len(policies_mand) == 0:
-            total_mandatory_intensity, mandatory_intensity_indicator = (0, 0)
-        else:
-            total_mandatory_intensity, mandatory_intensity_indicator = get_intensities(
-                policies_mand, adm_level
-            )
+def combine_intensities(mandatory, optional, overlap):
+    """Combine intensities of the tables of `split_policies_adm_day_policy` into policy variables
+    Args:
+        mandatory (tuple): `get_intensities` of mandatory policies
+        optional (tuple): `get_intensities` of optional policies
+        overlap (tuple): `get_intensities` of overlapping policies, or None if there are not both
+            mandatory and optional policies
+
+    Returns:
+        tuple of (float, float, float, float): mandatory pop-weighted intensity, mandatory
+            indicator, optional pop-weighted intensity, optional indicator
+    """
+    total_mandatory_intensity, mandatory_intensity_indicator = mandatory
+    total_optional_intensity, optional_intensity_indicator = optional
+
+    if overlap is not None:
+        total_optional_intensity = total_optional_intensity - overlap[0]
+        assert total_optional_intensity >= 0
 
     # For the policy indicator, ensure that not both are counted
     if optional_intensity_indicator > 0 and mandatory_intensity_indicator > 0:
@@ -369,6 +649,163 @@ def calculate_intensities_adm_day_policy(
     return result
 
 
+def calculate_intensities_adm_day_policy(
+    policies_to_date, adm_level, policy, method="ITA"
+):
+    policies_mand, policies_opt, policies_overlap = split_policies_adm_day_policy(
+        policies_to_date, adm_level, policy, method
+    )
+
+    return combine_intensities(
+        get_intensities(policies_mand, adm_level),
+        get_intensities(policies_opt, adm_level),
+        None
+        if policies_overlap is None
+        else get_intensities(policies_overlap, adm_level),
+    )
+
+
+def calculate_intensities_batched(policy_groups, adm_level, method="ITA"):
+    """Calculate `calculate_intensities_adm_day_policy` for many groups of policies at once
+    Each group is split by `split_policies_adm_day_policy`, and the intensities of the tables of all
+    groups are calculated together by `get_intensities_batched`
+
+    Args:
+        policy_groups (list of tuple): policies in force and name of policy category of each group
+        adm_level (int): level of admin-unit on which policies are applied
+        method (str): method of calculating intensities ("ITA" or "USA")
+
+    Returns:
+        list of tuple: `calculate_intensities_adm_day_policy` of each group
+    """
+    tables = [
+        table
+        for policies_to_date, policy in policy_groups
+        for table in split_policies_adm_day_policy(
+            policies_to_date.copy(), adm_level, policy, method
+        )
+    ]
+    non_empty = [table for table in tables if table is not None and len(table) > 0]
+
+    intensities = iter([])
+    if len(non_empty) > 0:
+        cols = ["policy_level", "policy_intensity"] + [
+            c
+            for c in non_empty[0].columns
+            if c.startswith("adm") and (c.endswith("_name") or c.endswith("_pop_ratio"))
+        ]
+        stacked = pd.DataFrame(
+            {
+                col: np.concatenate([table[col].to_numpy() for table in non_empty])
+                for col in cols
+            }
+        )
+        stacked["group"] = np.repeat(
+            np.arange(len(non_empty)), [len(table) for table in non_empty]
+        )
+        is_int = np.array(
+            [
+                np.issubdtype(table["policy_intensity"].dtype, np.integer)
+                for table in non_empty
+            ]
+        )
+        intensities = iter(
+            get_intensities_batched(stacked, len(non_empty), is_int, adm_level)
+        )
+
+    table_intensities = [
+        None if table is None else (0, 0) if len(table) == 0 else next(intensities)
+        for table in tables
+    ]
+    return [
+        combine_intensities(*table_intensities[i : i + 3])
+        for i in range(0, len(tables), 3)
+    ]
+
+
+def init_policy_memo():
+    """Initialize a memo of results of `calculate_intensities_adm_day_policy`
+
+    Returns:
+        dict: memo with "results" keyed on the policy category, adm-level, method and the
+            "row_hash" (as in `get_row_hashes`) of each of the policies in force, and counters of
+            memo "hits" and "misses". Results depend only on the contents of the policies in force,
+            so one memo can be shared across all adm-units, both engines and any tables of policies
+            prepared by `prepare_merge_inputs`
+    """
+    return {"results": dict(), "hits": 0, "misses": 0}
+
+
+def get_row_hashes(policies):
+    """Hash the contents of each row of `policies`, which identify the rows in the keys of a memo of
+    intensities wherever they appear
+
+    Returns:
+        numpy.ndarray: hash of each row (uint64)
+    """
+    return pd.util.hash_pandas_object(policies, index=False).to_numpy()
+
+
+def get_memo_key(policies, rows, policy, adm_level, method):
+    """Key the intensities of the `rows` (positions) of `policies` in force in a memo, as in
+    `init_policy_memo`
+    """
+    return (policy, adm_level, method, tuple(policies["row_hash"].to_numpy()[rows]))
+
+
+def calculate_intensities_memoized(
+    policies_to_date, adm_level, policy, method, policy_memo
+):
+    """Get the result of `calculate_intensities_adm_day_policy` from `policy_memo` if it has already
+    been computed for policies in force with the same contents
+    """
+    key = get_memo_key(policies_to_date, slice(None), policy, adm_level, method)
+    if key in policy_memo["results"]:
+        policy_memo["hits"] += 1
+    else:
+        policy_memo["misses"] += 1
+        policy_memo["results"][key] = calculate_intensities_adm_day_policy(
+            policies_to_date.copy(), adm_level, policy, method
+        )
+
+    return policy_memo["results"][key]
+
+
+def calculate_runs_memoized(runs, policies, adm_level, method, policy_memo):
+    """Get the result of `calculate_intensities_adm_day_policy` for each run of policies in force
+    Runs not already in `policy_memo` are calculated together by `calculate_intensities_batched`
+
+    Args:
+        runs (list of tuple): name of policy category and rows of `policies` in force of each run
+        policies (pandas.DataFrame): table of policies
+        adm_level (int): level of admin-unit on which policies are applied
+        method (str): method of calculating intensities ("ITA" or "USA")
+        policy_memo (dict): memo of intensities already computed, as in `init_policy_memo`
+
+    Returns:
+        list of tuple: results of each of `runs`
+    """
+    keys = [
+        get_memo_key(policies, rows, policy, adm_level, method) for policy, rows in runs
+    ]
+
+    new_runs = dict()
+    for key, (policy, rows) in zip(keys, runs):
+        if key in policy_memo["results"] or key in new_runs:
+            policy_memo["hits"] += 1
+        else:
+            policy_memo["misses"] += 1
+            new_runs[key] = (policies.iloc[rows], policy)
+
+    policy_memo["results"].update(
+        zip(
+            new_runs,
+            calculate_intensities_batched(list(new_runs.values()), adm_level, method),
+        )
+    )
+    return [policy_memo["results"][key] for key in keys]
+
+
 def get_policy_vals(
     policies,
     policy,
@@ -376,7 +813,7 @@ def get_policy_vals(
     adm,
     adm1,
     adm_level,
-    policy_pickle_dict,
+    policy_memo,
     policies_to_date_cache,
     method="ITA",
 ):
@@ -388,42 +825,21 @@ def get_policy_vals(
         adm (str): name of admin-unit on which policies are applied
         adm1 (str) name of adm1 unit within which policies are applied (necessary if `adm` is an adm2 unit)
         adm_level (int): level of admin-unit on which policies are applied
-        policy_pickle_dict (dict of dicts): Dictionary with keys `adm` and a pickled version of
-            `policies_to_date` (computed within this function) to get result if it has already
-            been computed. Though messy, this saves a lot of time
+        policy_memo (dict): memo of intensities already computed, as in `init_policy_memo`
+        policies_to_date_cache (dict): output of `get_policies_to_date_cache`
 
     Returns:
         tuple of (float, float): Tuple representing (intensity, pop-weighted-intensity) of `adm`
             on `date` for `policy`
     """
-    adm_name = f"adm{adm_level}_name"
-
-    adm_levels = sorted(
-        [
-            int(col[3])
-            for col in policies.columns
-            if col.startswith("adm") and col.endswith("name")
-        ]
-    )
-
-    policies_to_date = policies_to_date_cache[adm][policy][str(date)[:10]]
+    policies_to_date = get_policies_to_date(policies_to_date_cache, adm, policy, date)
 
     if len(policies_to_date) == 0:
         return (0, 0, 0, 0)
 
-    # Check if `policies_to_date` result has already been computed for `adm`, use that result if so
-    psave = pickle.dumps(policies_to_date)
-    if adm not in policy_pickle_dict:
-        policy_pickle_dict[adm] = dict()
-    if psave in policy_pickle_dict[adm]:
-        return policy_pickle_dict[adm][psave]
-    else:
-        result = calculate_intensities_adm_day_policy(
-            policies_to_date.copy(), adm_level, policy, method
-        )
-        policy_pickle_dict[adm][psave] = result
-
-    return result
+    return calculate_intensities_memoized(
+        policies_to_date, adm_level, policy, method, policy_memo
+    )
 
 
 def initialize_panel(cases_df, cases_level, policy_list, policy_popwts):
@@ -446,86 +862,701 @@ def initialize_panel(cases_df, cases_level, policy_list, policy_popwts):
         .fillna(0)
     )
 
-    if cases_level == 2:
-        adm2_to_adm1 = (
-            cases_df[["adm1_name", "adm2_name"]]
-            .drop_duplicates()
-            .set_index("adm2_name")["adm1_name"]
+    if cases_level > 1:
+        # Look up the adm-units at each level above each adm-unit of the panel
+        unit_col = f"adm{cases_level}_name"
+        higher_cols = [f"adm{level}_name" for level in range(1, cases_level)]
+        unit_to_higher = (
+            cases_df[higher_cols + [unit_col]].drop_duplicates().set_index(unit_col)
         )
-        adm1s = policy_panel["adm2_name"].apply(lambda x: adm2_to_adm1.loc[x])
-        policy_panel.insert(1, "adm1_name", adm1s)
+        if not unit_to_higher.index.is_unique:
+            raise ValueError(
+                f"Names of adm{cases_level} units are repeated across adm-units at higher "
+                "levels. Merge one adm1 unit at a time with `stream_adm1`"
+            )
+        higher = unit_to_higher.reindex(policy_panel[unit_col])
+        for i, col in enumerate(higher_cols):
+            policy_panel.insert(1 + i, col, higher[col].to_numpy())
 
     return policy_panel
 
 
-def cached_state_group(policies, adm1, policy_group, empty_df, adm_level, adm2, dates):
-    cached_policies = dict()
-
-    mask = (policies["policy"] == policy_group) & (
-        policies["adm1_name"].isin(["All", "all", adm1])
-    )
-    if adm_level == 2:
-        mask = (mask) & (policies[f"adm2_name"].isin(["All", "all", adm2]))
-
-    policies_in_group = policies[mask].reset_index(drop=True)
-
-    policies_in_group["next_day"] = np.roll(policies_in_group["date_start"], -1)
-
-    for i, row in policies_in_group.iterrows():
-        cache = policies_in_group[: i + 1].copy()
-        cached_policies[row["date_str"]] = cache
-        if row["date_start"] != row["next_day"]:
-            # Return a new version to set the current one in stone
-            cache = cache.copy()
-
-    cache = empty_df.copy()
-    for date in dates:
-        if date in cached_policies:
-            cache = cached_policies[date]
-        else:
-            cached_policies[date] = cache
-
-    return cached_policies
-
-
-def get_policies_to_date_cache(policies, policy_panel, adm_level):
-    policies = policies.sort_values("date_start", ascending=True)
-    dates = [
+def get_policy_dates(policy_panel):
+    """List all dates (as strings) on which the set of policies in force may change"""
+    return [
         str(d)[:10]
         for d in pd.date_range(
             start="2020-01-01", end=policy_panel["date"].max().strftime("%Y%m%d")
         ).to_list()
     ]
 
-    if adm_level == 2:
-        adm2_to_adm1 = policy_panel.set_index("adm2_name")["adm1_name"].to_dict()
 
-    adms = policy_panel[f"adm{adm_level}_name"].unique()
-    policy_list = policies["policy"].unique()
+# Code of "All" (or "all") adm-units, which stand for every adm-unit at their level
+wildcard_code = 0
 
-    cached_policies_on_date = dict()
-    for adm in adms:
-        cached_policies_on_date[adm] = dict()
-        for policy in policy_list:
-            cached_policies_on_date[adm][policy] = dict()
 
-    policies["date_str"] = policies["date_start"].astype(str)
+def encode_adm_names(policies, adm_cols):
+    """Code the adm-unit names of `policies` as categoricals, once per table of policies
+    Names are compared as integers from then on, and a policy covers an adm-unit at a level if its
+    code is either the adm-unit's code or `wildcard_code`
 
-    empty_df = pd.DataFrame(columns=policies.columns)
-    for adm in adms:
-        if adm_level == 2:
-            adm1 = adm2_to_adm1[adm]
-            adm2 = adm
-        else:
-            adm1 = adm
-            adm2 = None
+    Args:
+        policies (pandas.DataFrame): table of policies
+        adm_cols (list of str): columns of adm-unit names in `policies`
 
-        for policy_group in policy_list:
-            cached_policies_on_date[adm][policy_group] = cached_state_group(
-                policies, adm1, policy_group, empty_df, adm_level, adm2, dates
+    Returns:
+        dict: categorical (pandas.Categorical) of the names in each of `adm_cols`, keyed on the
+            column of its codes ("adm{N}_code"). "All" and "all" are the first category
+    """
+    codes = dict()
+    for col in adm_cols:
+        policy_names = policies[col].replace("all", "All")
+        level_names = pd.Index(["All"]).append(
+            pd.Index(policy_names.dropna().unique()).drop("All", errors="ignore")
+        )
+        codes[col.replace("_name", "_code")] = pd.Categorical(
+            policy_names, categories=level_names
+        )
+    return codes
+
+
+def get_adm_codes(policies, units, adm_cols):
+    """Get the codes of the adm-unit names of `policies` and `units` at each level
+    Codes are those assigned by `prepare_merge_inputs`, or are assigned here if `policies` weren't
+    prepared
+
+    Args:
+        policies (pandas.DataFrame): table of policies
+        units (pandas.DataFrame): table of adm-units
+        adm_cols (list of str): columns of adm-unit names in both tables
+
+    Returns:
+        tuple of (numpy.ndarray, numpy.ndarray): codes of `policies` [N, L] and `units` [U, L] at
+            each of the L levels of `adm_cols`. Missing names are coded as -1, and names of
+            adm-units that no policy is specified for are coded past all names of `policies`
+    """
+    code_cols = [col.replace("_name", "_code") for col in adm_cols]
+    if all(
+        col in policies.columns and isinstance(policies[col].dtype, pd.CategoricalDtype)
+        for col in code_cols
+    ):
+        categoricals = {col: policies[col].cat for col in code_cols}
+    else:
+        categoricals = {
+            col: pd.Series(cat).cat
+            for col, cat in encode_adm_names(policies, adm_cols).items()
+        }
+
+    policy_codes = np.empty((len(policies), len(adm_cols)), dtype=np.int32)
+    unit_codes = np.empty((len(units), len(adm_cols)), dtype=np.int32)
+    for i, (col, code_col) in enumerate(zip(adm_cols, code_cols)):
+        level_names = categoricals[code_col].categories
+        policy_codes[:, i] = categoricals[code_col].codes
+        unit_codes[:, i] = level_names.get_indexer(units[col])
+        unit_codes[(unit_codes[:, i] == -1) & units[col].notna().to_numpy(), i] = len(
+            level_names
+        )
+
+    return policy_codes, unit_codes
+
+
+def cached_state_group(
+    policy_codes, adm_codes, date_idx, policy_code, unit_codes, n_dates
+):
+    """Find the policies of a category covering an adm-unit, and how many are in force on each date
+
+    Args:
+        policy_codes (numpy.ndarray): code of the category of each policy, sorted by "date_start"
+        adm_codes (numpy.ndarray): codes of the adm-units of each policy, as in `encode_adm_names`
+        date_idx (numpy.ndarray): position of the start date of each policy in the dates on which
+            policies may change, or -1 if it is not one of them
+        policy_code (int): code of the policy category
+        unit_codes (numpy.ndarray): codes of the adm-unit, at the same levels as `adm_codes`
+        n_dates (int): number of dates on which policies may change
+
+    Returns:
+        tuple of (numpy.ndarray, numpy.ndarray): positions of the policies covering the adm-unit,
+            in date order, and the number of them in force on each date
+    """
+    mask = policy_codes == policy_code
+    for level, unit_code in enumerate(unit_codes):
+        mask &= (adm_codes[:, level] == wildcard_code) | (
+            adm_codes[:, level] == unit_code
+        )
+
+    rows = np.flatnonzero(mask)
+
+    # All rows up to the last one starting on a date are in force from that date until the next
+    group_date_idx = date_idx[rows]
+    n_active = np.zeros(n_dates, dtype=int)
+    is_date = group_date_idx >= 0
+    np.maximum.at(
+        n_active, group_date_idx[is_date], np.arange(1, len(rows) + 1)[is_date]
+    )
+    n_active = np.maximum.accumulate(n_active)
+
+    return rows, n_active
+
+
+def get_policies_to_date_cache(policies, policy_panel, adm_level):
+    """Cache the policies in force on each date for each adm-unit and policy category
+    Rather than copying the policies in force, the cache holds one table of policies sorted by date
+    and, for each adm-unit and policy, the positions of its rows in that table and the number of
+    them in force on each date. Use `get_policies_to_date` to get the policies themselves
+
+    Args:
+        policies (pandas.DataFrame): table of policies
+        policy_panel (pandas.DataFrame): panel of dates and adm-units, as in `initialize_panel`
+        adm_level (int): level of admin-unit on which policies are applied
+
+    Returns:
+        dict: cache with the sorted table of "policies" (indexed by row number in `policies`), the
+            "dates" on which policies may change, and for each adm-unit and policy the output of
+            `cached_state_group` in "groups"
+    """
+    policies = policies.reset_index(drop=True).sort_values("date_start", ascending=True)
+    policies["date_str"] = policies["date_start"].astype(str)
+    dates = pd.Index(get_policy_dates(policy_panel))
+    date_idx = dates.get_indexer(policies["date_str"])
+
+    adm_cols = [f"adm{level}_name" for level in range(1, adm_level + 1)]
+    units = policy_panel.drop_duplicates(f"adm{adm_level}_name")
+    adm_codes, unit_codes = get_adm_codes(policies, units, adm_cols)
+    policy_codes, policy_list = pd.factorize(policies["policy"])
+
+    cached_groups = dict()
+    for adm, adm_unit_codes in zip(units[f"adm{adm_level}_name"], unit_codes):
+        cached_groups[adm] = dict()
+        for policy_code, policy_group in enumerate(policy_list):
+            cached_groups[adm][policy_group] = cached_state_group(
+                policy_codes,
+                adm_codes,
+                date_idx,
+                policy_code,
+                adm_unit_codes,
+                len(dates),
+            )
+
+    return {"policies": policies, "dates": dates, "groups": cached_groups}
+
+
+def get_policies_to_date(policies_to_date_cache, adm, policy, date):
+    """Get the policies of category `policy` in force for `adm` on `date` from `policies_to_date_cache`
+
+    Returns:
+        pandas.DataFrame: view of the policies in force, indexed by row number in the original table
+    """
+    rows, n_active = policies_to_date_cache["groups"][adm][policy]
+    n = n_active[policies_to_date_cache["dates"].get_loc(str(date)[:10])]
+    return policies_to_date_cache["policies"].iloc[rows[:n]]
+
+
+def join_policies_to_units(policies, units, adm_level):
+    """Join every policy to each adm-unit that it covers
+    A policy covers an adm-unit if, at each level from adm1 down to `adm_level`, it is specified
+    either for the adm-unit's own name or for "All" adm-units
+
+    Args:
+        policies (pandas.DataFrame): table of policies, indexed by row number
+        units (pandas.DataFrame): table of adm-units in the panel, with columns "adm1_name" through
+            "adm{`adm_level`}_name"
+        adm_level (int): level of admin-unit on which policies are applied
+
+    Returns:
+        pandas.DataFrame: one row per covered (adm-unit, policy row), with columns
+            "adm{`adm_level`}_name", "policy" and "row" (the row number in `policies`), sorted by
+            adm-unit, policy, and row number
+    """
+    adm_cols = [f"adm{level}_name" for level in range(1, adm_level + 1)]
+    unit_col = f"adm{adm_level}_name"
+
+    # Match on integer codes of adm-units, and only look up names for the output
+    units = units[adm_cols].drop_duplicates()
+    adm_codes, unit_codes = get_adm_codes(policies, units, adm_cols)
+    policy_codes = pd.DataFrame(adm_codes, columns=adm_cols)
+    policy_codes["row"] = policies.index
+    unit_codes = pd.DataFrame(unit_codes, columns=adm_cols)
+    unit_codes["unit"] = np.arange(len(units))
+    is_wildcard = adm_codes == wildcard_code
+
+    # Merge each group of policies with the same levels set to "All" on their non-"All" levels
+    joined = []
+    for pattern in itertools.product([False, True], repeat=len(adm_cols)):
+        pattern_policies = policy_codes[(is_wildcard == pattern).all(axis=1)]
+        if len(pattern_policies) == 0:
+            continue
+
+        on = [col for col, wildcard in zip(adm_cols, pattern) if not wildcard]
+        if len(on) == 0:
+            pairs = pd.merge(
+                pattern_policies[["row"]].assign(_key=0),
+                unit_codes[["unit"]].assign(_key=0),
+                on="_key",
+            )
+        else:
+            pairs = pd.merge(pattern_policies[["row"] + on], unit_codes, on=on)
+        joined.append(pairs[["unit", "row"]])
+
+    if len(joined) == 0:
+        return pd.DataFrame(columns=[unit_col, "policy", "row"])
+
+    joined = pd.concat(joined, ignore_index=True)
+    joined = pd.DataFrame(
+        {
+            unit_col: units[unit_col].to_numpy()[joined["unit"]],
+            "policy": policies["policy"].to_numpy()[
+                policies.index.get_indexer(joined["row"])
+            ],
+            "row": joined["row"].to_numpy(),
+        }
+    )
+    return joined.sort_values([unit_col, "policy", "row"]).reset_index(drop=True)
+
+
+def get_unit_classes(joined, units, adm_level):
+    """Group adm-units into classes that are covered by exactly the same rows of the policy table
+    Populations used to weight intensities are attributes of the policy rows, so all adm-units in a
+    class have the same policy variables on every date
+
+    Args:
+        joined (pandas.DataFrame): output of `join_policies_to_units`
+        units (pandas.DataFrame): table of adm-units in the panel, with column "adm{`adm_level`}_name"
+        adm_level (int): level of admin-unit on which policies are applied
+
+    Returns:
+        pandas.Series: the representative adm-unit of each adm-unit's class, indexed by adm-unit
+    """
+    unit_col = f"adm{adm_level}_name"
+
+    signatures = {unit: tuple(rows) for unit, rows in joined.groupby(unit_col)["row"]}
+
+    unit_classes = dict()
+    representatives = dict()
+    for unit in units[unit_col].unique():
+        signature = signatures.get(unit, tuple())
+        unit_classes[unit] = representatives.setdefault(signature, unit)
+
+    return pd.Series(unit_classes, name="representative")
+
+
+def get_policy_timeline(joined, policies, policy_panel, adm_level):
+    """Get the run-length timeline of the policies in force for each adm-unit and policy category
+    The set of policies in force changes only on the dates on which a policy comes into force, so
+    each adm-unit's group of policies is in force in runs that start on those dates and last until
+    the next one. Runs follow the same rules as `get_policies_to_date_cache`, and any runs starting
+    before the first date of `policy_panel` are merged into one run starting on that date
+
+    Args:
+        joined (pandas.DataFrame): output of `join_policies_to_units`
+        policies (pandas.DataFrame): table of policies, sorted by "date_start" and indexed by row number
+        policy_panel (pandas.DataFrame): panel of dates and adm-units, as in `initialize_panel`
+        adm_level (int): level of admin-unit on which policies are applied
+
+    Returns:
+        pandas.DataFrame: one row per run, with columns "adm{`adm_level`}_name", "policy", "date"
+            (the first date of the run) and "n_active" (the number of rows of the adm-unit's group
+            of policies, in the order of `joined`, in force during the run), sorted by adm-unit,
+            policy and date
+    """
+    unit_col = f"adm{adm_level}_name"
+    date_min = policy_panel["date"].min()
+    date_max = policy_panel["date"].max()
+
+    joined = joined.copy()
+    joined["date_str"] = policies["date_start"].astype(str).to_numpy()[joined["row"]]
+    joined["n_active"] = joined.groupby([unit_col, "policy"]).cumcount() + 1
+
+    timeline = joined[joined["date_str"].isin(get_policy_dates(policy_panel))].copy()
+    timeline["date"] = pd.to_datetime(timeline["date_str"]).clip(lower=date_min)
+    timeline = timeline[timeline["date"] <= date_max]
+
+    return (
+        timeline.groupby([unit_col, "policy", "date"])["n_active"]
+        .max()
+        .reset_index()
+        .sort_values([unit_col, "policy", "date"])
+        .reset_index(drop=True)
+    )
+
+
+def expand_policy_timeline(timeline, policy_panel, policy_list, adm_level):
+    """Forward-fill each run of `timeline` across the dates it lasts in `policy_panel`
+
+    Args:
+        timeline (pandas.DataFrame): output of `get_policy_timeline`
+        policy_panel (pandas.DataFrame): panel of dates and adm-units, as in `initialize_panel`
+        policy_list (list of str): policy categories to be applied
+        adm_level (int): level of admin-unit on which policies are applied
+
+    Returns:
+        numpy.ndarray [N, P]: the row of `timeline` in force on each of the N rows of
+            `policy_panel` for each of the P policies in `policy_list`, or -1 where no policies
+            are in force
+    """
+    unit_col = f"adm{adm_level}_name"
+
+    dates = pd.date_range(policy_panel["date"].min(), policy_panel["date"].max())
+    units = pd.Index(policy_panel[unit_col].unique())
+    policies = pd.Index(policy_list)
+
+    # Place each run on a (date, adm-unit, policy) grid on its first date, then carry it forward.
+    # Runs are sorted by adm-unit, policy and date, so later runs always have larger row numbers
+    grid = np.full((len(dates), len(units), len(policies)), -1)
+    grid[
+        dates.get_indexer(timeline["date"]),
+        units.get_indexer(timeline[unit_col]),
+        policies.get_indexer(timeline["policy"]),
+    ] = np.arange(len(timeline))
+    grid = np.maximum.accumulate(grid, axis=0)
+
+    return grid[
+        dates.get_indexer(policy_panel["date"]),
+        units.get_indexer(policy_panel[unit_col]),
+    ]
+
+
+# Read-only inputs of `calculate_policy_runs`, set once in each worker process
+worker_inputs = dict()
+
+
+def init_intensity_worker(policies, adm_level, method):
+    """Store the inputs shared by all tasks of a worker process of `calculate_timeline_intensities`"""
+    worker_inputs.update(
+        policies=policies,
+        adm_level=adm_level,
+        method=method,
+        policy_memo=init_policy_memo(),
+    )
+
+
+def calculate_policy_runs(policy, runs):
+    """Calculate intensities of `policy` for each set of rows of `worker_inputs["policies"]` in `runs`
+
+    Returns:
+        tuple of (list, int, int): results of `calculate_intensities_adm_day_policy` for each of
+            `runs`, and the number of memo hits and misses in calculating them
+    """
+    policy_memo = worker_inputs["policy_memo"]
+    hits, misses = policy_memo["hits"], policy_memo["misses"]
+    results = calculate_runs_memoized(
+        [(policy, rows) for rows in runs],
+        worker_inputs["policies"],
+        worker_inputs["adm_level"],
+        worker_inputs["method"],
+        policy_memo,
+    )
+    return results, policy_memo["hits"] - hits, policy_memo["misses"] - misses
+
+
+def calculate_timeline_intensities(
+    timeline, policies, group_rows, adm_level, method, policy_memo, n_jobs=1
+):
+    """Calculate intensities at the start of each run of `timeline`
+
+    Args:
+        timeline (pandas.DataFrame): output of `get_policy_timeline`
+        policies (pandas.DataFrame): table of policies, sorted by "date_start" and indexed by row number
+        group_rows (dict): rows of `policies` covering each (adm-unit, policy), in date order
+        adm_level (int): level of admin-unit on which policies are applied
+        method (str): method of calculating intensities ("ITA" or "USA")
+        policy_memo (dict): memo of intensities already computed, as in `init_policy_memo`
+        n_jobs (int): number of processes across which policy categories are spread. -1 uses all CPUs
+
+    Returns:
+        numpy.ndarray [R + 1, 4]: results of `calculate_intensities_adm_day_policy` for each of the R
+            runs of `timeline`, with a final row of zeros for when no policies are in force
+    """
+    results = np.empty((len(timeline) + 1, 4), dtype=object)
+    results[-1] = (0, 0, 0, 0)
+
+    runs = [
+        (i, policy, group_rows[(unit, policy)][:n])
+        for i, (unit, policy, date, n) in enumerate(timeline.itertuples(index=False))
+    ]
+
+    if n_jobs == 1:
+        run_results = calculate_runs_memoized(
+            [(policy, rows) for i, policy, rows in runs],
+            policies,
+            adm_level,
+            method,
+            policy_memo,
+        )
+        for i, result in enumerate(run_results):
+            results[i] = result
+        return results
+
+    # Send one task per policy category with runs not already in `policy_memo`. Workers receive
+    # `policies` once when they start, and tasks only carry row numbers
+    tasks = dict()
+    for i, policy, rows in runs:
+        key = get_memo_key(policies, rows, policy, adm_level, method)
+        if key in policy_memo["results"]:
+            policy_memo["hits"] += 1
+            results[i] = policy_memo["results"][key]
+        else:
+            tasks.setdefault(policy, []).append((i, rows))
+
+    if len(tasks) == 0:
+        return results
+
+    n_workers = os.cpu_count() if n_jobs == -1 else n_jobs
+    with ProcessPoolExecutor(
+        max_workers=n_workers,
+        initializer=init_intensity_worker,
+        initargs=(policies, adm_level, method),
+    ) as executor:
+        task_results = executor.map(
+            calculate_policy_runs,
+            list(tasks),
+            [[rows for i, rows in policy_runs] for policy_runs in tasks.values()],
+        )
+
+        # Gather results in the order tasks were sent
+        for (policy, policy_runs), (policy_results, hits, misses) in zip(
+            tasks.items(), task_results
+        ):
+            policy_memo["hits"] += hits
+            policy_memo["misses"] += misses
+            for (i, rows), result in zip(policy_runs, policy_results):
+                key = get_memo_key(policies, rows, policy, adm_level, method)
+                policy_memo["results"][key] = result
+                results[i] = result
+
+    return results
+
+
+def infer_policy_col(values, index):
+    """Convert an object array of policy values to a numeric column, as ``Series.apply`` would"""
+    return pd.Series(values, index=index, dtype=object).infer_objects()
+
+
+def assign_policies_interval(
+    policy_panel,
+    policies,
+    policy_list,
+    cases_level,
+    method,
+    policy_memo,
+    n_jobs=1,
+    profile=None,
+    opt_policies=(),
+):
+    """Assign all policy variables to `policy_panel` by joining policy dates and adm-units in bulk
+    Intensities are calculated once at the start of each run of the policy timeline, then
+    forward-filled across the dates of the panel that each run lasts. Adm-units covered by the
+    same policies share one timeline
+
+    Args:
+        policy_panel (pandas.DataFrame): panel of dates and adm-units, as in `initialize_panel`
+        policies (pandas.DataFrame): table of policies, with populations and "policy_level" assigned
+        policy_list (list of str): policy categories to be applied
+        cases_level (int): level of admin-unit on which policies are applied
+        method (str): method of calculating intensities ("ITA" or "USA")
+        policy_memo (dict): memo of intensities already computed, as in `init_policy_memo`
+        n_jobs (int): number of processes across which policy categories are spread. -1 uses all CPUs
+        profile (dict): profile recording each stage, and building the columns of each policy, as
+            in `src.profiling.init_profile`. Nothing is recorded if not given
+        opt_policies (collection of str): policies to assign optional columns of even if unused
+
+    Returns:
+        pandas.DataFrame: `policy_panel` with all policy variables assigned
+    """
+    unit_col = f"adm{cases_level}_name"
+    policies = policies.sort_values("date_start", ascending=True).reset_index(drop=True)
+
+    units = policy_panel.drop_duplicates(unit_col, keep="last")
+    with cprof.profile_stage(profile, "join_policies_to_units"):
+        joined = join_policies_to_units(policies, units, cases_level)
+
+    # Only calculate policies for one adm-unit of each class of adm-units with the same policies
+    with cprof.profile_stage(profile, "get_unit_classes"):
+        unit_classes = get_unit_classes(joined, units, cases_level)
+        joined = joined[joined[unit_col].isin(unit_classes.unique())]
+        class_panel = policy_panel[["date", unit_col]].copy()
+        class_panel[unit_col] = class_panel[unit_col].map(unit_classes)
+
+    with cprof.profile_stage(profile, "get_policy_timeline"):
+        timeline = get_policy_timeline(joined, policies, class_panel, cases_level)
+
+    # Rows of `policies` in each adm-unit's group of each policy, in date order
+    group_rows = {
+        key: joined["row"].to_numpy()[idx]
+        for key, idx in joined.groupby([unit_col, "policy"]).indices.items()
+    }
+
+    # Calculate intensities only at the start of each run of the timeline
+    with cprof.profile_stage(profile, "calculate_timeline_intensities"):
+        results = calculate_timeline_intensities(
+            timeline, policies, group_rows, cases_level, method, policy_memo, n_jobs
+        )
+
+    with cprof.profile_stage(profile, "expand_policy_timeline"):
+        run_idx = expand_policy_timeline(
+            timeline, class_panel, policy_list, cases_level
+        )
+        values = results[run_idx]
+
+    # Build every policy column at once, in the same order as `assign_policies_reference`
+    policy_cols, popwt_cols, opt_cols = dict(), dict(), dict()
+    for j, policy in enumerate(policy_list):
+        with cprof.profile_stage(profile, policy, group="policies"):
+            mand_popwt, mand, opt_popwt, opt = [
+                infer_policy_col(values[:, j, k], policy_panel.index) for k in range(4)
+            ]
+            policy_cols[policy] = mand
+            use_opt_col = opt.sum() > 0 or policy in opt_policies
+            if use_opt_col:
+                opt_cols[policy + "_opt"] = opt
+            if policy not in exclude_from_popweights:
+                popwt_cols[policy + "_popwt"] = mand_popwt
+                if use_opt_col:
+                    opt_cols[policy + "_opt_popwt"] = opt_popwt
+
+    new_cols = {**policy_cols, **popwt_cols, **opt_cols}
+    with cprof.profile_stage(profile, "build_policy_panel"):
+        return pd.concat(
+            [
+                policy_panel.drop(columns=list(new_cols), errors="ignore"),
+                pd.DataFrame(new_cols),
+            ],
+            axis=1,
+        )
+
+
+def assign_policies_reference(
+    policy_panel,
+    policies,
+    policy_list,
+    cases_level,
+    method,
+    policy_memo,
+    profile=None,
+    opt_policies=(),
+):
+    """Assign all policy variables to `policy_panel` one (date, adm-unit) row at a time
+    Keeps the row-by-row loop of the original implementation as a simple reference for
+    `assign_policies_interval`, but calculates intensities with the same primitives: the memo
+    keyed on row contents, the index of policy areas, the intensity bitmasks of the USA method and
+    the population ratio columns. Both engines are tested against golden panels of the original
+    implementation (see ``tests/golden_panels.py``) rather than only against each other
+
+    Args:
+        policy_panel (pandas.DataFrame): panel of dates and adm-units, as in `initialize_panel`
+        policies (pandas.DataFrame): table of policies, with populations and "policy_level" assigned
+        policy_list (list of str): policy categories to be applied
+        cases_level (int): level of admin-unit on which policies are applied
+        method (str): method of calculating intensities ("ITA" or "USA")
+        policy_memo (dict): memo of intensities already computed, as in `init_policy_memo`
+        profile (dict): profile recording the cache of policies in force and the loop over each
+            policy, as in `src.profiling.init_profile`. Nothing is recorded if not given
+        opt_policies (collection of str): policies to assign optional columns of even if unused
+
+    Returns:
+        pandas.DataFrame: `policy_panel` with all policy variables assigned
+    """
+    with cprof.profile_stage(profile, "get_policies_to_date_cache"):
+        policies_to_date_cache = get_policies_to_date_cache(
+            policies, policy_panel, cases_level
+        )
+
+    # Assign each policy one-by-one to the panel
+    for policy in policy_list:
+        with cprof.profile_stage(profile, policy, group="policies"):
+            # Get Series of 4-tuples for mandatory pop-weighted, mandatory indicator,
+            # optional pop-weighted, optional indicator
+            tmp = policy_panel.apply(
+                lambda row: get_policy_vals(
+                    policies,
+                    policy,
+                    row["date"],
+                    row[f"adm{cases_level}_name"],
+                    row[f"adm1_name"],
+                    cases_level,
+                    policy_memo,
+                    policies_to_date_cache,
+                    method,
+                ),
+                axis=1,
             )
 
-    return cached_policies_on_date
+            # Assign regular policy indicator
+            policy_panel[policy] = tmp.apply(lambda x: x[1])
+
+            # Assign opt-column if there's anything there
+            opt_col = tmp.apply(lambda x: x[3])
+            use_opt_col = opt_col.sum() > 0 or policy in opt_policies
+            if use_opt_col:
+                policy_panel[policy + "_opt"] = tmp.apply(lambda x: x[3])
+
+            # Assign pop-weighted column if it's not excluded from pop-weighting, and opt-pop-weighted if
+            # Optional and pop-weighted are both used
+            if policy not in exclude_from_popweights:
+                policy_panel[policy + "_popwt"] = tmp.apply(lambda x: x[0])
+                if use_opt_col:
+                    policy_panel[policy + "_opt_popwt"] = tmp.apply(lambda x: x[2])
+
+    return policy_panel
+
+
+def hash_frame(df):
+    """Hash the contents, column names and types of `df`"""
+    h = hashlib.sha256()
+    h.update(pd.util.hash_pandas_object(df, index=True).to_numpy().tobytes())
+    h.update(repr(list(df.columns)).encode())
+    h.update(repr(list(df.dtypes.astype(str))).encode())
+    return h.hexdigest()
+
+
+def get_merge_cache_key(cases_df, policies, cases_level, **kwargs):
+    """Hash all inputs of `assign_policies_to_panel` to key its result in an on-disk cache
+    Inputs include the population tables (whichever copy of each is read) and intensity rules read
+    from disk
+
+    Args:
+        cases_df (pandas.DataFrame): as in `assign_policies_to_panel`
+        policies (pandas.DataFrame): as in `assign_policies_to_panel`
+        cases_level (int): as in `assign_policies_to_panel`
+        **kwargs: all other arguments of `assign_policies_to_panel` that affect its result
+
+    Returns:
+        str: hex digest identifying the result
+    """
+    h = hashlib.sha256()
+    h.update(f"merge cache version {merge_cache_version}".encode())
+    h.update(hash_frame(cases_df).encode())
+    h.update(hash_frame(policies).encode())
+    h.update(repr((cases_level, sorted(kwargs.items()))).encode())
+
+    country_code = policies["adm0_name"].unique()[0]
+    max_adm_level = max([cases_level] + chier.get_adm_levels(policies.columns))
+    input_paths = [
+        cpop.get_adm_pop_source_path(adm_level, country_code)
+        for adm_level in range(1, max_adm_level + 1)
+    ] + [path_intensity_coding_rules]
+    for path in input_paths:
+        with open(path, "rb") as f:
+            h.update(f.read())
+
+    return h.hexdigest()
+
+
+def write_cached_panel(merged, cache_path, run_length_cols):
+    """Write a merged panel to `cache_path` in a cache of merged panels
+    The panel is written to a temporary file in the same directory, then moved into place, so an
+    interrupted write or another process writing the same panel never leaves a partial file at
+    `cache_path`
+    """
+    with tempfile.NamedTemporaryFile(
+        dir=cache_path.parent, prefix=cache_path.stem, suffix=".tmp", delete=False
+    ) as f:
+        tmp_path = Path(f.name)
+    try:
+        ccol.write_columnar(merged, tmp_path, run_length_cols=run_length_cols)
+        os.replace(tmp_path, cache_path)
+    finally:
+        if tmp_path.exists():
+            tmp_path.unlink()
 
 
 def assign_policies_to_panel(
@@ -536,6 +1567,13 @@ def assign_policies_to_panel(
     get_latlons=True,
     errors="raise",
     method="ITA",
+    engine="interval",
+    policy_memo=None,
+    n_jobs=1,
+    cache_dir=None,
+    profile=None,
+    stream_adm1=False,
+    sparse=False,
 ):
     """Assign all policy variables from `policies` to `cases_df`
     Args:
@@ -546,11 +1584,175 @@ def assign_policies_to_panel(
             typically the lowest level which pop-weights have been applied to
         aggregate_vars (list of str): list of policy variables where optional version
             should be treated independently of mandatory version
+        engine (str): how policies are assigned to the panel. "interval" (default) joins policy dates
+            and adm-units in bulk, "reference" applies policies one (date, adm-unit) row at a time.
+            Both give the same result
+        policy_memo (dict): memo of intensities already computed, as in `init_policy_memo`. A new
+            memo is used if not given; pass one in to reuse it or inspect its hit and miss counts
+        n_jobs (int): number of processes across which the interval engine spreads policy
+            categories. Defaults to 1 (no parallelism); -1 uses all CPUs
+        cache_dir (str or pathlib.Path): directory of merged panels keyed by a hash of all inputs,
+            including population tables and intensity rules. If given, a stored panel is returned
+            when inputs are unchanged, and a newly merged panel is stored otherwise
+        profile (dict): profile to record the time, calls and peak memory of each stage and
+            policy, and memo hit rates in, as in `src.profiling.init_profile`. Nothing is
+            recorded if not given
+        stream_adm1 (bool): whether to merge the cases of one adm1 unit at a time. This allows
+            the names of adm-units at `cases_level` to repeat across adm1 units (as US counties
+            do). Policies are prepared once, and `policy_memo` is shared by all adm1 units. The
+            whole panel is still returned, so use `stream_policies_to_sink` to bound memory
+        sparse (bool): whether to return policy variables as sparse columns, which only store
+            nonzero values. Use `densify_cols` to convert them back, say before exporting them
 
     Returns:
         pandas.DataFrame: a version of `cases_df` with all policies from `policies` assigned as new columns
     """
+    if cache_dir is not None:
+        cache_path = Path(cache_dir) / (
+            get_merge_cache_key(
+                cases_df,
+                policies,
+                cases_level,
+                aggregate_vars=list(aggregate_vars),
+                get_latlons=get_latlons,
+                errors=errors,
+                method=method,
+            )
+            + ".npz"
+        )
+        if cache_path.exists():
+            with cprof.profile_stage(profile, "read_columnar"):
+                merged = ccol.read_columnar(cache_path)
+            return sparsify_policy_cols(merged, policies) if sparse else merged
+
+        merged = assign_policies_to_panel(
+            cases_df,
+            policies,
+            cases_level,
+            aggregate_vars=aggregate_vars,
+            get_latlons=get_latlons,
+            errors=errors,
+            method=method,
+            engine=engine,
+            policy_memo=policy_memo,
+            n_jobs=n_jobs,
+            profile=profile,
+            stream_adm1=stream_adm1,
+        )
+        cache_path.parent.mkdir(parents=True, exist_ok=True)
+        with cprof.profile_stage(profile, "write_columnar"):
+            write_cached_panel(
+                merged, cache_path, get_merged_policy_cols(merged, policies)
+            )
+        return sparsify_policy_cols(merged, policies) if sparse else merged
+
+    if policy_memo is None:
+        policy_memo = init_policy_memo()
+    memo_hits, memo_misses = policy_memo["hits"], policy_memo["misses"]
+
+    with cprof.profile_stage(profile, "assign_policies_to_panel"):
+        cases_df, policies, policy_list = prepare_merge_inputs(
+            cases_df,
+            policies,
+            cases_level,
+            aggregate_vars=aggregate_vars,
+            get_latlons=get_latlons,
+            errors=errors,
+            method=method,
+            profile=profile,
+        )
+
+        if stream_adm1:
+            merged = merge_prepared_policies_by_adm1(
+                cases_df,
+                policies,
+                policy_list,
+                cases_level,
+                method=method,
+                engine=engine,
+                policy_memo=policy_memo,
+                n_jobs=n_jobs,
+                profile=profile,
+            )
+        else:
+            merged = merge_prepared_policies(
+                cases_df,
+                policies,
+                policy_list,
+                cases_level,
+                method=method,
+                engine=engine,
+                policy_memo=policy_memo,
+                n_jobs=n_jobs,
+                profile=profile,
+            )
+
+    cprof.record_memo(profile, policy_memo, memo_hits, memo_misses)
+    return sparsify_policy_cols(merged, policies) if sparse else merged
+
+
+def get_merged_policy_cols(merged, policies):
+    """List the columns of policy variables that `merged` has for the categories of `policies`"""
+    categories = policies["policy"].unique()
+    policy_cols = get_policy_cols(
+        list(categories) + [p + "_opt" for p in categories], categories
+    )
+    return [col for col in merged.columns if col in policy_cols]
+
+
+def sparsify_policy_cols(merged, policies):
+    """Convert the policy variables of `merged` to sparse columns with a fill value of 0
+
+    Args:
+        merged (pandas.DataFrame): output of `assign_policies_to_panel`
+        policies (pandas.DataFrame): table of policies `merged` was built from
+
+    Returns:
+        pandas.DataFrame: `merged` with sparse policy variables
+    """
+    return merged.astype(
+        {
+            col: pd.SparseDtype(merged[col].dtype, 0)
+            for col in get_merged_policy_cols(merged, policies)
+        }
+    )
+
+
+def densify_cols(df):
+    """Convert all sparse columns of `df` to dense columns of the same type"""
+    return df.assign(
+        **{
+            col: df[col].sparse.to_dense()
+            for col in df.columns
+            if isinstance(df[col].dtype, pd.SparseDtype)
+        }
+    )
+
 
+def prepare_merge_inputs(
+    cases_df,
+    policies,
+    cases_level,
+    aggregate_vars=[],
+    get_latlons=True,
+    errors="raise",
+    method="ITA",
+    profile=None,
+):
+    """Assign populations and policy levels to `policies` and `cases_df` before policies are merged
+    Args:
+        cases_df (pandas.DataFrame): as in `assign_policies_to_panel`
+        policies (pandas.DataFrame): as in `assign_policies_to_panel`
+        cases_level (int): as in `assign_policies_to_panel`
+        aggregate_vars (list of str): as in `assign_policies_to_panel`
+        profile (dict): as in `assign_policies_to_panel`, which records the adm-units missing
+            populations (as in `validate_populations`) under "missing_pops"
+
+    Returns:
+        tuple of (pandas.DataFrame, pandas.DataFrame, list of str): `cases_df` with populations,
+            `policies` with populations, "policy_level" and codes of adm-unit names (as in
+            `encode_adm_names`), and policy categories to be applied
+    """
     # Make sure policies input doesn't change unexpectedly
     policies = policies.copy()
 
@@ -577,19 +1779,24 @@ def assign_policies_to_panel(
     policies["date_end"] = policies["date_end"].fillna(pd.to_datetime("2099-12-31"))
 
     # Assign population columns to `policies` and `cases_df`
-    policies, cases_df = cpop.assign_all_populations(
-        policies, cases_df, cases_level, get_latlons=get_latlons, errors=errors
-    )
+    with cprof.profile_stage(profile, "assign_all_populations"):
+        policies, cases_df, pop_report = cpop.assign_all_populations(
+            policies, cases_df, cases_level, get_latlons=get_latlons, errors=errors
+        )
+    cprof.record_missing_pops(profile, pop_report)
 
     # Assign policy_level to distinguish policies specified at different admin-unit levels
-    policies["policy_level"] = policies.apply(get_policy_level, axis=1)
+    with cprof.profile_stage(profile, "get_policy_level"):
+        policies["policy_level"] = chier.get_policy_levels(policies)
 
     if method == "USA":
-        intensity_cols = [
-            c for c in policies.columns if c.startswith("intensity_group")
-        ]
-        for c in intensity_cols:
-            policies[c] = policies[c].astype(str).str.strip().str.lower()
+        with cprof.profile_stage(profile, "get_intensity_bits"):
+            intensity_cols = [
+                c for c in policies.columns if c.startswith("intensity_group")
+            ]
+            for c in intensity_cols:
+                policies[c] = policies[c].astype(str).str.strip().str.lower()
+            policies["intensity_bits"] = get_intensity_bits(policies)
 
     # Treat policies in `aggregate_vars` as independent policies (just like mandatory policies)
     # Set optional to 0 to avoid applying normal optional logic in `get_policy_vals()`
@@ -600,64 +1807,767 @@ def assign_policies_to_panel(
         policies.loc[policies["optional"] == 1, "optional"] = 0
 
     policy_list = list(policies["policy"].unique())
+
+    # Code adm-unit names once, for the engines to match policies to adm-units on
+    with cprof.profile_stage(profile, "encode_adm_names"):
+        adm_cols = [
+            f"adm{level}_name"
+            for level in chier.get_adm_levels(policies.columns)
+            if level > 0
+        ]
+        for col, codes in encode_adm_names(policies, adm_cols).items():
+            policies[col] = codes
+
+    # Identify rows by their contents in memos of intensities, which may be shared across tables
+    policies["row_hash"] = get_row_hashes(policies)
+
+    return cases_df, policies, policy_list
+
+
+def merge_prepared_policies(
+    cases_df,
+    policies,
+    policy_list,
+    cases_level,
+    method="ITA",
+    engine="interval",
+    policy_memo=None,
+    n_jobs=1,
+    profile=None,
+    opt_policies=(),
+):
+    """Assign all policy variables to `cases_df` from inputs prepared by `prepare_merge_inputs`
+    Optional columns are assigned for policies in `opt_policies`, and any others that are used
+    """
     policy_popwts = [
         p + "_popwt" for p in policy_list if p not in exclude_from_popweights
     ]
+    with cprof.profile_stage(profile, "initialize_panel"):
+        policy_panel = initialize_panel(
+            cases_df, cases_level, policy_list, policy_popwts
+        )
+
+    if policy_memo is None:
+        policy_memo = init_policy_memo()
+
+    if engine == "interval":
+        with cprof.profile_stage(profile, "assign_policies_interval"):
+            policy_panel = assign_policies_interval(
+                policy_panel,
+                policies,
+                policy_list,
+                cases_level,
+                method,
+                policy_memo,
+                n_jobs=n_jobs,
+                profile=profile,
+                opt_policies=opt_policies,
+            )
+    elif engine == "reference":
+        with cprof.profile_stage(profile, "assign_policies_reference"):
+            policy_panel = assign_policies_reference(
+                policy_panel,
+                policies,
+                policy_list,
+                cases_level,
+                method,
+                policy_memo,
+                profile=profile,
+                opt_policies=opt_policies,
+            )
+    else:
+        raise ValueError(f"Unknown engine: {engine}")
 
-    policy_panel = initialize_panel(cases_df, cases_level, policy_list, policy_popwts)
+    with cprof.profile_stage(profile, "count_policies_enacted"):
+        policy_panel = count_policies_enacted(policy_panel, policy_list)
 
-    policies_to_date_cache = get_policies_to_date_cache(
-        policies, policy_panel, cases_level
+    policy_panel = policy_panel.drop(
+        columns=[f"adm{level}_name" for level in range(1, cases_level)]
     )
 
-    # Assign each policy one-by-one to the panel
+    # Merge panel with `cases_df`
+    with cprof.profile_stage(profile, "merge_with_cases"):
+        merged = pd.merge(
+            cases_df,
+            policy_panel,
+            left_on=["date", f"adm{cases_level}_name"],
+            right_on=["date", f"adm{cases_level}_name"],
+        )
+
+    return merged
+
+
+def merge_prepared_policies_by_adm1(
+    cases_df,
+    policies,
+    policy_list,
+    cases_level,
+    policy_memo=None,
+    opt_policies=(),
+    **kwargs,
+):
+    """Run `merge_prepared_policies` on the cases of each adm1 unit, and concatenate the results
+    Rows are returned in the order of `cases_df`, as if all adm1 units were merged at once
+
+    Args:
+        cases_df (pandas.DataFrame): cases with populations, as in `prepare_merge_inputs`
+        policies (pandas.DataFrame): policies, as in `prepare_merge_inputs`
+        policy_list (list of str): policy categories to be applied
+        cases_level (int): level of admin-unit on which policies are applied
+        policy_memo (dict): memo of intensities already computed, as in `init_policy_memo`
+        opt_policies (collection of str): as in `merge_prepared_policies`
+        **kwargs: passed to `merge_prepared_policies`
+
+    Returns:
+        pandas.DataFrame: as in `merge_prepared_policies`
+    """
+    if policy_memo is None:
+        policy_memo = init_policy_memo()
+
+    # Keep optional columns in every adm1 unit, since their pop-weighted values may be used in
+    # adm1 units where the optional indicator is not
+    all_opt_policies = get_opt_policies(policies, policy_list)
+    cases_df = cases_df.assign(_row=np.arange(len(cases_df)))
+    # Group on codes, which keep cases with missing adm1 names as a group of their own
+    adm1_codes = pd.factorize(cases_df["adm1_name"])[0]
+    panels = [
+        merge_prepared_policies(
+            adm1_cases,
+            policies,
+            policy_list,
+            cases_level,
+            policy_memo=policy_memo,
+            opt_policies=all_opt_policies,
+            **kwargs,
+        )
+        for _, adm1_cases in cases_df.groupby(adm1_codes)
+    ]
+
+    merged = drop_unused_opt_cols(
+        concat_merged_panels(panels, policy_list, all_opt_policies),
+        [p for p in policy_list if p not in opt_policies],
+    )
+    return (
+        merged.sort_values("_row", kind="stable")
+        .drop(columns="_row")
+        .reset_index(drop=True)
+    )
+
+
+def get_opt_policies(policies, policy_list):
+    """List the policies in `policy_list` with optional rows in `policies`, which may have
+    optional columns in a merged panel
+    """
+    opt_rows = policies["optional"] == 1
+    return [
+        p
+        for p in policy_list
+        if p + "_opt" not in policy_list
+        and (policies.loc[opt_rows, "policy"] == p).any()
+    ]
+
+
+def drop_unused_opt_cols(merged, policy_list):
+    """Drop optional columns of policies whose optional indicator is 0 in every row of `merged`,
+    as `merge_prepared_policies` does
+    """
+    unused = [
+        p
+        for p in policy_list
+        if p + "_opt" not in policy_list
+        and p + "_opt" in merged.columns
+        and (merged[p + "_opt"] == 0).all()
+    ]
+    return merged.drop(
+        columns=[p + "_opt" for p in unused]
+        + [p + "_opt_popwt" for p in unused if p + "_opt_popwt" in merged.columns]
+    )
+
+
+def get_policy_cols(policy_list, opt_policies):
+    """List the policy variables of a merged panel in the order they are assigned
+
+    Args:
+        policy_list (list of str): policy categories applied
+        opt_policies (collection of str): policy categories with optional columns
+
+    Returns:
+        list of str: columns of policy variables, ending with "policies_enacted"
+    """
+    popwt_cols = [p + "_popwt" for p in policy_list if p not in exclude_from_popweights]
+    opt_cols = []
     for policy in policy_list:
-        policy_pickle_dict = dict()
+        if policy in opt_policies:
+            opt_cols.append(policy + "_opt")
+            if policy not in exclude_from_popweights:
+                opt_cols.append(policy + "_opt_popwt")
 
-        # Get Series of 4-tuples for mandatory pop-weighted, mandatory indicator,
-        # optional pop-weighted, optional indicator
-        tmp = policy_panel.apply(
-            lambda row: get_policy_vals(
-                policies,
-                policy,
-                row["date"],
-                row[f"adm{cases_level}_name"],
-                row[f"adm1_name"],
+    return list(policy_list) + popwt_cols + opt_cols + ["policies_enacted"]
+
+
+def concat_merged_panels(panels, policy_list, opt_policies=None):
+    """Concatenate panels merged with the same policies, with the columns of one merged panel
+    Optional columns are only kept where used, so may be missing from some of `panels`. These are
+    filled with 0
+
+    Args:
+        panels (list of pandas.DataFrame): outputs of `merge_prepared_policies`
+        policy_list (list of str): policy categories applied
+        opt_policies (list of str): policies to keep optional columns of. Defaults to those with
+            optional columns in any of `panels`
+
+    Returns:
+        pandas.DataFrame: rows of all `panels`, with a new RangeIndex
+    """
+    if opt_policies is None:
+        opt_policies = [
+            p
+            for p in policy_list
+            if p + "_opt" not in policy_list
+            and any(p + "_opt" in panel.columns for panel in panels)
+        ]
+    policy_cols = get_policy_cols(policy_list, opt_policies)
+    parts = [
+        panel.assign(**{col: 0 for col in policy_cols if col not in panel.columns})
+        for panel in panels
+    ]
+    case_cols = [c for c in panels[0].columns if c not in policy_cols]
+
+    return pd.concat(parts, ignore_index=True)[case_cols + policy_cols]
+
+
+def append_cases_to_panel(
+    merged,
+    new_cases_df,
+    policies,
+    cases_level,
+    merged_policies_hash=None,
+    aggregate_vars=[],
+    get_latlons=True,
+    errors="raise",
+    method="ITA",
+    engine="interval",
+    policy_memo=None,
+    n_jobs=1,
+):
+    """Extend a panel merged by `assign_policies_to_panel` with case data for new dates
+    Policy variables are only calculated for dates after the last date of `merged`. Policies
+    that came into force before then are carried forward into the first new date as one run of the
+    policy timeline, so the result matches merging all dates at once. If `policies` differ from
+    those `merged` was built from, all dates are merged again
+
+    Args:
+        merged (pandas.DataFrame): output of `assign_policies_to_panel` or `append_cases_to_panel`
+        new_cases_df (pandas.DataFrame): case data with the same columns as the case data of
+            `merged`. Rows on or before the last date of `merged` are ignored
+        policies (pandas.DataFrame): table of policies, listed by date and regions affected
+        cases_level (int): as in `assign_policies_to_panel`
+        merged_policies_hash (str): `hash_frame` of the policies `merged` was built from, as
+            returned by the last call. If not given, all dates are merged again
+        policy_memo (dict): memo of intensities already computed, as in `init_policy_memo`. Pass
+            the same memo to each call to reuse intensities of the policies carried forward
+        All other arguments are as in `assign_policies_to_panel`
+
+    Returns:
+        tuple of (pandas.DataFrame, str): `merged` with rows for the new dates, and the hash of
+            `policies` to pass to the next call
+    """
+    policies_hash = hash_frame(policies)
+    last_date = merged["date"].max()
+    new_cases_df = new_cases_df[new_cases_df["date"] > last_date]
+    merge_kwargs = dict(
+        aggregate_vars=aggregate_vars,
+        get_latlons=get_latlons,
+        errors=errors,
+        method=method,
+    )
+
+    if policies_hash == merged_policies_hash:
+        if len(new_cases_df) == 0:
+            return merged, policies_hash
+
+        prepared_cases, prepared_policies, policy_list = prepare_merge_inputs(
+            new_cases_df, policies, cases_level, **merge_kwargs
+        )
+        merged_opt = [
+            p
+            for p in policy_list
+            if p + "_opt" not in policy_list and p + "_opt" in merged.columns
+        ]
+        appended = merge_prepared_policies(
+            prepared_cases,
+            prepared_policies,
+            policy_list,
+            cases_level,
+            method=method,
+            engine=engine,
+            policy_memo=policy_memo,
+            n_jobs=n_jobs,
+            opt_policies=merged_opt,
+        )
+
+        # Optional pop-weighted values of earlier dates are dropped with unused optional columns,
+        # so optional policies first used on new dates need all dates merged again
+        if all(
+            p in merged_opt
+            for p in policy_list
+            if p + "_opt" not in policy_list and p + "_opt" in appended.columns
+        ):
+            return concat_merged_panels([merged, appended], policy_list), policies_hash
+
+    cases_df = pd.concat(
+        [merged[new_cases_df.columns], new_cases_df], ignore_index=True
+    )
+    rebuilt = assign_policies_to_panel(
+        cases_df,
+        policies,
+        cases_level,
+        engine=engine,
+        policy_memo=policy_memo,
+        n_jobs=n_jobs,
+        **merge_kwargs,
+    )
+    return rebuilt, policies_hash
+
+
+def diff_policies(old_policies, new_policies):
+    """Find the rows of `old_policies` removed and the rows of `new_policies` added by an edit
+    Rows are compared on all columns, and repeated rows are counted, so moving a row changes
+    nothing and duplicating one adds it
+
+    Args:
+        old_policies (pandas.DataFrame): table of policies before the edit
+        new_policies (pandas.DataFrame): table of policies after the edit, with the same columns
+
+    Returns:
+        pandas.DataFrame: removed rows followed by added rows
+    """
+    new_policies = new_policies[old_policies.columns]
+
+    # Compare numeric columns with a common type, so that an edit changing the type of a column
+    # (say, from integers to floats) only changes the edited rows
+    common_types = {
+        col: np.result_type(old_policies[col].dtype, new_policies[col].dtype)
+        for col in old_policies.columns
+        if old_policies[col].dtype != new_policies[col].dtype
+        and old_policies[col].dtype.kind in "biuf"
+        and new_policies[col].dtype.kind in "biuf"
+    }
+    keys = []
+    for df in [old_policies, new_policies]:
+        df = df.astype(common_types)
+        row_hash = pd.Series(get_row_hashes(df))
+        keys.append(
+            pd.MultiIndex.from_arrays([row_hash, row_hash.groupby(row_hash).cumcount()])
+        )
+
+    removed = old_policies[~keys[0].isin(keys[1])]
+    added = new_policies[~keys[1].isin(keys[0])]
+    return pd.concat([removed, added], ignore_index=True)
+
+
+def get_affected_units(changed, cases_df, cases_level):
+    """Find the adm-units of the panel whose policy variables may depend on the `changed` rows
+
+    Args:
+        changed (pandas.DataFrame): rows of policies, as in `diff_policies`
+        cases_df (pandas.DataFrame): as in `assign_policies_to_panel`, or just its adm-units
+        cases_level (int): as in `assign_policies_to_panel`
+
+    Returns:
+        dict: adm-unit names at `cases_level` (list of str) affected in each policy category
+    """
+    adm_cols = [f"adm{level}_name" for level in range(1, cases_level + 1)]
+    units = cases_df[adm_cols].drop_duplicates()
+    joined = join_policies_to_units(changed.reset_index(drop=True), units, cases_level)
+
+    return {
+        policy: sorted(group[adm_cols[-1]].unique())
+        for policy, group in joined.groupby("policy")
+    }
+
+
+def prepare_policy_edits(cases_df, policies, cases_level, **merge_kwargs):
+    """Prepare the inputs of a merged panel once, to update it for several edits of its policies
+
+    Args:
+        cases_df (pandas.DataFrame): as in `assign_policies_to_panel`
+        policies (pandas.DataFrame): table of policies the panel was built from
+        cases_level (int): as in `assign_policies_to_panel`
+        **merge_kwargs: arguments of `prepare_merge_inputs`
+
+    Returns:
+        dict: the "cases_df", "policies" and "policy_list" output by `prepare_merge_inputs`, and
+            the table of adm-units of the panel ("units"), with their names at each level
+    """
+    prepared_cases, prepared_policies, policy_list = prepare_merge_inputs(
+        cases_df, policies, cases_level, **merge_kwargs
+    )
+    adm_cols = [f"adm{level}_name" for level in range(1, cases_level + 1)]
+    return {
+        "cases_df": prepared_cases,
+        "policies": prepared_policies,
+        "policy_list": policy_list,
+        "units": cases_df[adm_cols].drop_duplicates().reset_index(drop=True),
+    }
+
+
+def update_panel_for_policy_edits(
+    merged,
+    cases_df,
+    old_policies,
+    new_policies,
+    cases_level,
+    aggregate_vars=[],
+    get_latlons=True,
+    errors="raise",
+    method="ITA",
+    engine="interval",
+    n_jobs=1,
+    policy_memo=None,
+    prepared=None,
+):
+    """Update a panel merged by `assign_policies_to_panel` for edits to its table of policies
+    Only the policy variables of the (adm-unit, policy category) pairs covered by the rows that
+    were edited are calculated again, since policy variables depend only on the policies of their
+    own category that cover their adm-unit. All other variables are kept from `merged`. Rows are
+    compared as prepared by `prepare_merge_inputs`, so under the categories they are merged under.
+    If the columns or those categories of the tables differ, all policy variables are merged again
+
+    Args:
+        merged (pandas.DataFrame): output of `assign_policies_to_panel` for `cases_df` and
+            `old_policies`
+        cases_df (pandas.DataFrame): table `merged` was built from
+        old_policies (pandas.DataFrame): table of policies `merged` was built from
+        new_policies (pandas.DataFrame): edited table of policies
+        policy_memo (dict): memo of intensities already computed, as in `init_policy_memo`. Pass
+            the memo `merged` was built with to reuse intensities of unchanged policies
+        prepared (dict): inputs of `merged`, as in `prepare_policy_edits`, to reuse across edits
+            of the same policies. Prepared from `cases_df` and `old_policies` if not given
+        All other arguments are as in `assign_policies_to_panel`
+
+    Returns:
+        pandas.DataFrame: `merged` with the policy variables of `new_policies`, of the types a
+            full merge would give them
+    """
+    merge_kwargs = dict(
+        aggregate_vars=aggregate_vars,
+        get_latlons=get_latlons,
+        errors=errors,
+        method=method,
+    )
+    if set(old_policies.columns) != set(new_policies.columns):
+        return assign_policies_to_panel(
+            cases_df,
+            new_policies,
+            cases_level,
+            engine=engine,
+            n_jobs=n_jobs,
+            policy_memo=policy_memo,
+            **merge_kwargs,
+        )
+
+    # Compare the categories policies are merged under, which separate optional rows of policies
+    # in `aggregate_vars` from their mandatory rows
+    if prepared is None:
+        prepared = prepare_policy_edits(
+            cases_df, old_policies, cases_level, **merge_kwargs
+        )
+    prepared_cases, policies, policy_list = prepare_merge_inputs(
+        cases_df, new_policies, cases_level, **merge_kwargs
+    )
+    if set(prepared["policy_list"]) != set(policy_list):
+        return assign_policies_to_panel(
+            cases_df,
+            new_policies,
+            cases_level,
+            engine=engine,
+            n_jobs=n_jobs,
+            policy_memo=policy_memo,
+            **merge_kwargs,
+        )
+
+    unit_col = f"adm{cases_level}_name"
+    changed = diff_policies(prepared["policies"], policies)
+    affected_units = get_affected_units(changed, prepared["units"], cases_level)
+    if len(affected_units) == 0:
+        return merged.copy()
+
+    # Group policy categories affecting the same adm-units, to merge them together
+    unit_groups = dict()
+    for policy, units in affected_units.items():
+        unit_groups.setdefault(tuple(units), []).append(policy)
+
+    # Recomputed columns take the types a full merge would give them, which depend on the
+    # intensities of all adm-units
+    if policy_memo is None:
+        policy_memo = init_policy_memo()
+    dtypes, _ = get_policy_col_dtypes(
+        prepared_cases,
+        policies[policies["policy"].isin(affected_units)],
+        policy_list,
+        cases_level,
+        method,
+        policy_memo,
+        n_jobs,
+    )
+
+    merged = merged.copy()
+    merged_keys = pd.MultiIndex.from_frame(merged[["date", unit_col]])
+    for units, changed_policies in unit_groups.items():
+        group_list = [p for p in policy_list if p in changed_policies]
+        group_policies = policies[policies["policy"].isin(group_list)]
+        updated = merge_prepared_policies(
+            prepared_cases[prepared_cases[unit_col].isin(units)],
+            group_policies,
+            group_list,
+            cases_level,
+            method=method,
+            engine=engine,
+            n_jobs=n_jobs,
+            policy_memo=policy_memo,
+            opt_policies=get_opt_policies(group_policies, group_list),
+        )
+
+        # Optional pop-weighted values of other adm-units are dropped with unused optional
+        # columns, so optional policies that come into use need all adm-units merged again
+        if any(
+            p + "_opt" not in merged.columns and (updated[p + "_opt"] != 0).any()
+            for p in group_list
+            if p + "_opt" in updated.columns and p + "_opt" not in group_list
+        ):
+            return assign_policies_to_panel(
+                cases_df,
+                new_policies,
                 cases_level,
-                policy_pickle_dict,
-                policies_to_date_cache,
-                method,
-            ),
-            axis=1,
+                engine=engine,
+                n_jobs=n_jobs,
+                policy_memo=policy_memo,
+                **merge_kwargs,
+            )
+
+        rows = merged_keys.get_indexer(
+            pd.MultiIndex.from_frame(updated[["date", unit_col]])
         )
+        # Optional rows of policies in `aggregate_vars` are patched with their own category
+        group_opt = [p for p in group_list if p + "_opt" not in policy_list]
+        for col in get_policy_cols(group_list, group_opt)[:-1]:
+            if col not in merged.columns:
+                continue
+            if col in updated.columns:
+                new_values = updated[col].to_numpy()
+            else:
+                new_values = np.zeros(len(updated), dtype=int)
+            values = merged[col].to_numpy()
+            values = values.astype(np.result_type(values.dtype, new_values.dtype))
+            values[rows] = new_values
+            merged[col] = values.astype(dtypes[col])
+
+    merged = count_policies_enacted(
+        drop_unused_opt_cols(merged, policy_list), policy_list
+    )
+    opt_policies = [
+        p
+        for p in policy_list
+        if p + "_opt" not in policy_list and p + "_opt" in merged.columns
+    ]
+    return concat_merged_panels([merged], policy_list, opt_policies)
 
-        # Assign regular policy indicator
-        policy_panel[policy] = tmp.apply(lambda x: x[1])
 
-        # Assign opt-column if there's anything there
-        opt_col = tmp.apply(lambda x: x[3])
-        use_opt_col = opt_col.sum() > 0
-        if use_opt_col:
-            policy_panel[policy + "_opt"] = tmp.apply(lambda x: x[3])
+def csv_sink(path):
+    """Make a sink for `stream_policies_to_sink` that writes chunks to one CSV file at `path`"""
+    n_chunks = [0]
 
-        # Assign pop-weighted column if it's not excluded from pop-weighting, and opt-pop-weighted if
-        # Optional and pop-weighted are both used
-        if policy not in exclude_from_popweights:
-            policy_panel[policy + "_popwt"] = tmp.apply(lambda x: x[0])
-            if use_opt_col:
-                policy_panel[policy + "_opt_popwt"] = tmp.apply(lambda x: x[2])
+    def write_chunk(chunk):
+        first = n_chunks[0] == 0
+        chunk.to_csv(path, mode="w" if first else "a", header=first, index=False)
+        n_chunks[0] += 1
 
-    policy_panel = count_policies_enacted(policy_panel, policy_list)
+    return write_chunk
 
-    if cases_level == 2:
-        policy_panel = policy_panel.drop(columns=["adm1_name"])
 
-    # Merge panel with `cases_df`
-    merged = pd.merge(
-        cases_df,
-        policy_panel,
-        left_on=["date", f"adm{cases_level}_name"],
-        right_on=["date", f"adm{cases_level}_name"],
+def columnar_sink(directory):
+    """Make a sink for `stream_policies_to_sink` that writes each chunk to a columnar file
+    Chunks are written to "part-00000.npz", "part-00001.npz", ... in `directory`, and can be read
+    back with `src.columnar.read_columnar`
+    """
+    directory = Path(directory)
+    directory.mkdir(parents=True, exist_ok=True)
+    n_chunks = [0]
+
+    def write_chunk(chunk):
+        ccol.write_columnar(chunk, directory / f"part-{n_chunks[0]:05d}.npz")
+        n_chunks[0] += 1
+
+    return write_chunk
+
+
+def get_policy_col_dtypes(
+    cases_df, policies, policy_list, cases_level, method, policy_memo, n_jobs=1
+):
+    """Find the types of the policy variables that `merge_prepared_policies` assigns to
+    `cases_df`, and which optional columns it keeps, without building the panel
+    Intensities are calculated at the start of each run of the policy timeline over all dates of
+    `cases_df`, as in `assign_policies_interval`, and are kept in `policy_memo` for the merge
+
+    Args:
+        cases_df (pandas.DataFrame): cases with populations, as in `prepare_merge_inputs`
+        policies (pandas.DataFrame): policies, as in `prepare_merge_inputs`
+        policy_list (list of str): policy categories to be applied
+        cases_level (int): level of admin-unit on which policies are applied
+        method (str): method of calculating intensities ("ITA" or "USA")
+        policy_memo (dict): memo of intensities already computed, as in `init_policy_memo`
+        n_jobs (int): as in `assign_policies_interval`
+
+    Returns:
+        tuple of (dict, list of str): type (numpy.dtype) of each policy variable but
+            "policies_enacted", keyed on column, and the policies whose optional columns are kept
+    """
+    unit_col = f"adm{cases_level}_name"
+    adm_cols = [f"adm{level}_name" for level in range(1, cases_level + 1)]
+    policies = policies.sort_values("date_start", ascending=True).reset_index(drop=True)
+
+    units = cases_df[adm_cols].drop_duplicates(unit_col, keep="last")
+    joined = join_policies_to_units(policies, units, cases_level)
+    unit_classes = get_unit_classes(joined, units, cases_level)
+    joined = joined[joined[unit_col].isin(unit_classes.unique())]
+
+    # Runs of the timeline only depend on the first and last dates of the panel
+    date_range = pd.DataFrame(
+        {"date": [cases_df["date"].min(), cases_df["date"].max()]}
+    )
+    timeline = get_policy_timeline(joined, policies, date_range, cases_level)
+    group_rows = {
+        key: joined["row"].to_numpy()[idx]
+        for key, idx in joined.groupby([unit_col, "policy"]).indices.items()
+    }
+    results = calculate_timeline_intensities(
+        timeline, policies, group_rows, cases_level, method, policy_memo, n_jobs
     )
 
-    return merged
+    # Each column holds the values of its runs, and 0 wherever no policies are in force
+    dtypes, opt_policies = dict(), []
+    for policy in policy_list:
+        is_policy = np.append(timeline["policy"].to_numpy() == policy, True)
+        mand_popwt, mand, opt_popwt, opt = [
+            infer_policy_col(results[is_policy, k], None) for k in range(4)
+        ]
+        dtypes[policy] = mand.dtype
+        if policy not in exclude_from_popweights:
+            dtypes[policy + "_popwt"] = mand_popwt.dtype
+
+        # Policies in `aggregate_vars` have their optional rows as a category of their own
+        if policy + "_opt" in policy_list:
+            continue
+        dtypes[policy + "_opt"] = opt.dtype
+        if policy not in exclude_from_popweights:
+            dtypes[policy + "_opt_popwt"] = opt_popwt.dtype
+        if opt.sum() > 0:
+            opt_policies.append(policy)
+
+    return dtypes, opt_policies
+
+
+def stream_policies_to_sink(
+    cases_df,
+    policies,
+    cases_level,
+    sink,
+    chunk_days=30,
+    aggregate_vars=[],
+    get_latlons=True,
+    errors="raise",
+    method="ITA",
+    engine="interval",
+    policy_memo=None,
+    n_jobs=1,
+    profile=None,
+    stream_adm1=False,
+):
+    """Assign all policy variables from `policies` to `cases_df` in windows of dates, passing
+    each merged window to `sink` instead of returning one panel
+    Only one window of the policy panel is held in memory at a time. Policies in force before a
+    window are carried into its first date as one run of the policy timeline, and `policy_memo` is
+    shared by all windows, so intensities calculated in one window are reused in the next. Each
+    window has the rows of `cases_df` in its dates, in their original order, and has the columns
+    and types of a panel from `assign_policies_to_panel`, found by `get_policy_col_dtypes` before
+    the first window is merged
+
+    Args:
+        sink (callable): called with each merged window (pandas.DataFrame), in date order, as
+            made by `csv_sink` or `columnar_sink`
+        chunk_days (int): number of days in each window
+        stream_adm1 (bool): whether to also merge each window one adm1 unit at a time
+        All other arguments are as in `assign_policies_to_panel`
+
+    Returns:
+        int: number of rows passed to `sink`
+    """
+    if policy_memo is None:
+        policy_memo = init_policy_memo()
+    memo_hits, memo_misses = policy_memo["hits"], policy_memo["misses"]
+
+    with cprof.profile_stage(profile, "stream_policies_to_sink"):
+        cases_df, policies, policy_list = prepare_merge_inputs(
+            cases_df,
+            policies,
+            cases_level,
+            aggregate_vars=aggregate_vars,
+            get_latlons=get_latlons,
+            errors=errors,
+            method=method,
+            profile=profile,
+        )
+        # Find the columns and types of the whole panel, merging adm1 units apart if they are
+        with cprof.profile_stage(profile, "get_policy_col_dtypes"):
+            groups = (
+                pd.factorize(cases_df["adm1_name"])[0]
+                if stream_adm1
+                else np.zeros(len(cases_df), dtype=int)
+            )
+            dtypes, opt_policies = dict(), set()
+            for _, group_cases in cases_df.groupby(groups):
+                group_dtypes, group_opt_policies = get_policy_col_dtypes(
+                    group_cases,
+                    policies,
+                    policy_list,
+                    cases_level,
+                    method,
+                    policy_memo,
+                    n_jobs=n_jobs,
+                )
+                for col, dtype in group_dtypes.items():
+                    dtypes[col] = np.result_type(dtypes.get(col, dtype), dtype)
+                opt_policies.update(group_opt_policies)
+            opt_policies = [p for p in policy_list if p in opt_policies]
+        merge = (
+            merge_prepared_policies_by_adm1 if stream_adm1 else merge_prepared_policies
+        )
+
+        window = (cases_df["date"] - cases_df["date"].min()).dt.days // chunk_days
+        n_rows = 0
+        for _, window_cases in cases_df.groupby(window, sort=True):
+            merged = merge(
+                window_cases,
+                policies,
+                policy_list,
+                cases_level,
+                method=method,
+                engine=engine,
+                policy_memo=policy_memo,
+                n_jobs=n_jobs,
+                profile=profile,
+                opt_policies=opt_policies,
+            )
+            with cprof.profile_stage(profile, "write_chunk"):
+                # Optional columns unused in this window are filled with 0
+                merged = concat_merged_panels([merged], policy_list, opt_policies)
+                merged = merged.astype(
+                    {col: dtypes[col] for col in merged.columns if col in dtypes}
+                )
+                merged = count_policies_enacted(merged, policy_list)
+                sink(merged)
+            n_rows += len(merged)
+
+    cprof.record_memo(profile, policy_memo, memo_hits, memo_misses)
+    return n_rows
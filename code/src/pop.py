@@ -1,11 +1,52 @@
+import os
 import warnings
 
 import numpy as np
 import pandas as pd
 
+import src.columnar as ccol
+import src.hierarchy as chier
 import src.utils as cutil
 
 
+# Tables of populations loaded in this process, keyed by path, as in `load_adm_pop_table`
+adm_pop_store = dict()
+
+# Ratios of populations of adm-units to their ancestors, keyed by adm-level and country, as in
+# `get_adm_pop_ratios`
+adm_pop_ratio_store = dict()
+
+
+def handle_missing_pops(message, errors="raise"):
+    """Warn of, raise, or ignore a message about missing populations, depending on `errors`"""
+    if errors == "warn":
+        warnings.warn(message)
+    elif errors == "raise":
+        raise ValueError(message)
+    elif errors != "ignore":
+        raise ValueError("Choice of value for ``errors'' is not valid.")
+
+
+def get_units_without_pop(df, adm_col, pop_col, skip_all=True):
+    """Get the adm-units in `df` that are missing populations
+    Only the names of rows with missing populations are compared against "All", so the names of
+    all rows are not scanned
+
+    Args:
+        df (pandas.DataFrame): DataFrame containing population column and adm-unit column
+        adm_col (str): Name of adm-unit column in `df`
+        pop_col (str): Name of population column in `df`
+        skip_all (bool): Whether to leave out rows for all adm-units ("All" or "all")
+
+    Returns:
+        list: adm-units missing populations, sorted
+    """
+    names = df[adm_col].to_numpy()[df[pop_col].isnull().to_numpy()]
+    if skip_all:
+        names = names[pd.Series(names, dtype=object).astype(str).str.lower() != "all"]
+    return sorted(set(names), key=str)
+
+
 def check_population_col_is_filled(df, adm_col, pop_col, errors="raise"):
     """Check if population column is filled
 
@@ -21,18 +62,13 @@ def check_population_col_is_filled(df, adm_col, pop_col, errors="raise"):
             `null_adm`: List of adm-units missing populations
 
     """
-    df_without_pop = df.loc[(df[adm_col].str.lower() != "all") & (df[pop_col].isnull())]
-    col_is_valid = len(df_without_pop) == 0
+    null_adm = get_units_without_pop(df, adm_col, pop_col)
+    col_is_valid = len(null_adm) == 0
+
+    if not col_is_valid:
+        handle_missing_pops(f"Population not found for {adm_col}: {null_adm}", errors)
 
-    if not (col_is_valid or errors == "ignore"):
-        null_adm = sorted(set(df_without_pop[adm_col]))
-        message = f"Population not found for {adm_col}: {null_adm}"
-        if errors == "warn":
-            warnings.warn(message)
-        elif errors == "raise":
-            raise ValueError(message)
-        else:
-            raise ValueError("Choice of value for ``errors'' is not valid.")
+    return col_is_valid, null_adm
 
 
 def get_adm_fields(adm_level, field_name="name"):
@@ -40,6 +76,119 @@ def get_adm_fields(adm_level, field_name="name"):
     return [f"adm{i}_" + field_name for i in range(1, adm_level + 1)]
 
 
+def get_adm_pop_path(adm_level, country_code):
+    """Get path to the table of populations at an adm-level within a country"""
+    # hard code in for US adm3 data
+    if (country_code == "USA") and (adm_level == 3):
+        return cutil.DATA_RAW / "usa" / "adm3_pop.csv"
+    return cutil.DATA_INTERIM / "adm" / f"adm{adm_level}" / f"adm{adm_level}.csv"
+
+
+def get_adm_pop_columnar_path(adm_level, country_code):
+    """Get path to the columnar copy of the table of populations at an adm-level"""
+    return get_adm_pop_path(adm_level, country_code).with_suffix(".npz")
+
+
+def write_adm_pop_columnar(adm_df, path):
+    """Write a table of adm-units in the columnar format of `src.columnar`, with categorical
+    names, and integer populations where all are whole numbers
+    The type populations have when read from the CSV is stored with the table, so that tables read
+    from either file match
+
+    Args:
+        adm_df (pandas.DataFrame): table of adm-units, as written to ``adm{N}.csv``
+        path (str or pathlib.Path): output path, which should end in ".npz"
+    """
+    pops = pd.to_numeric(adm_df["population"])
+    csv_dtype = "int64" if pops.dtype.kind in "iu" and not pops.hasnans else "float64"
+
+    adm_df = adm_df.astype(
+        {col: "category" for col in adm_df.columns if col.endswith("_name")}
+    )
+    if (pops.dropna() % 1 == 0).all():
+        adm_df["population"] = pops.round().astype("Int64")
+    else:
+        adm_df["population"] = pops.astype(float)
+    ccol.write_columnar(adm_df, path, attrs={"population_dtype": csv_dtype})
+
+
+def read_adm_pop_columnar(path, adm_level, country_code):
+    """Read the populations (and latitudes and longitudes, where given) of one country from a table
+    written by `write_adm_pop_columnar`, in the format of `load_adm_pop_table`
+    """
+    indices = get_adm_fields(adm_level)
+    meta = ccol.read_columnar_meta(path)
+    cols = [c for c in ["population", "latitude", "longitude"] if c in meta["columns"]]
+    adm_df = ccol.read_columnar(
+        path, columns=indices + cols, filters={"adm0_name": [country_code]}
+    )
+    adm_df = adm_df.astype({col: object for col in indices}).astype(
+        {"population": meta["attrs"]["population_dtype"]}
+    )
+    return adm_df.set_index(indices).sort_index()
+
+
+def get_adm_pop_source_path(adm_level, country_code):
+    """Get the path of the table of populations at an adm-level that `load_adm_pop_table` reads:
+    its columnar copy if that is at least as new as the CSV, or the CSV otherwise
+    """
+    csv_path = get_adm_pop_path(adm_level, country_code)
+    columnar_path = get_adm_pop_columnar_path(adm_level, country_code)
+    use_columnar = columnar_path.exists() and (
+        not csv_path.exists()
+        or os.stat(columnar_path).st_mtime_ns >= os.stat(csv_path).st_mtime_ns
+    )
+    return columnar_path if use_columnar else csv_path
+
+
+def load_adm_pop_table(adm_level, country_code):
+    """Load the populations at an adm-level within a country, reading them from disk only if they
+    are not in `adm_pop_store` or their table has changed since it was read
+    A columnar copy of the table (as in `get_adm_pop_columnar_path`) is read instead of the CSV if
+    it is at least as new, and only the rows and columns needed are decoded from it
+
+    Args:
+        adm_level (int): Adm-level of requested populations.
+        country_code (str): Three-letter country code of requested populations
+
+    Returns:
+        pandas.DataFrame: populations (and latitudes and longitudes, where given), indexed by all
+            levels from "adm1" up to "adm{`adm_level`}"
+    """
+    path = get_adm_pop_source_path(adm_level, country_code)
+    use_columnar = path.suffix == ".npz"
+    stat = os.stat(path)
+    version = (stat.st_mtime_ns, stat.st_size)
+
+    entry = adm_pop_store.get(path)
+    if entry is None or entry["version"] != version:
+        entry = {"version": version, "tables": dict()}
+        adm_pop_store[path] = entry
+        if not use_columnar:
+            # Split the whole table by country, since it has been parsed anyway
+            adm_df = pd.read_csv(path)
+            cols = [c for c in ["population", "latitude", "longitude"] if c in adm_df]
+            indices = get_adm_fields(adm_level)
+            entry["empty"] = adm_df.iloc[:0].set_index(indices)[cols]
+            entry["tables"] = {
+                country: country_df.set_index(indices)[cols].sort_index()
+                for country, country_df in adm_df.groupby("adm0_name", sort=False)
+            }
+
+    if use_columnar and country_code not in entry["tables"]:
+        entry["tables"][country_code] = read_adm_pop_columnar(
+            path, adm_level, country_code
+        )
+
+    return entry["tables"].get(country_code, entry.get("empty"))
+
+
+def clear_adm_pop_store():
+    """Remove all tables of populations loaded in this process"""
+    adm_pop_store.clear()
+    adm_pop_ratio_store.clear()
+
+
 def get_adm_pops(adm_level, country_code, latlons=False):
     """Get all populations at an adm-level within a country
 
@@ -52,37 +201,91 @@ def get_adm_pops(adm_level, country_code, latlons=False):
             Indexed by all levels from "adm1" (first level) up to "adm{`adm_level`}"" (last level)
 
     """
-
-    # hard code in for US adm3 data
-    if (country_code == "USA") and (adm_level == 3):
-        path_adm = cutil.DATA_RAW / "usa" / "adm3_pop.csv"
-        adm_df = pd.read_csv(path_adm)
-    else:
-        path_adm = (
-            cutil.DATA_INTERIM / "adm" / f"adm{adm_level}" / f"adm{adm_level}.csv"
-        )
-        adm_df = pd.read_csv(path_adm)
+    adm_df = load_adm_pop_table(adm_level, country_code)
 
     get_cols = ["population"]
     if latlons:
         get_cols += ["latitude", "longitude"]
 
-    indices = get_adm_fields(adm_level)
-    return (
-        adm_df.loc[adm_df["adm0_name"] == country_code]
-        .set_index(indices)[get_cols]
-        .rename(
-            columns={
-                "population": f"adm{adm_level}_pop",
-                "latitude": "lat",
-                "longitude": "lon",
-            }
-        )
+    return adm_df[get_cols].rename(
+        columns={
+            "population": f"adm{adm_level}_pop",
+            "latitude": "lat",
+            "longitude": "lon",
+        }
     )
 
 
+def get_pop_ratio_col(adm_level, ancestor_level):
+    """Get the name of the column of ratios of populations at `adm_level` to `ancestor_level`"""
+    return f"adm{adm_level}_adm{ancestor_level}_pop_ratio"
+
+
+def get_adm_pop_ratios(adm_level, country_code):
+    """Get the ratio of the population of each adm-unit at an adm-level within a country to the
+    population of the unit containing it at each level from adm1. Ratios are computed once for the
+    tables of populations in `adm_pop_store`, and again only if those tables are reloaded
+
+    Args:
+        adm_level (int): Adm-level of adm-units
+        country_code (str): Three-letter country code of adm-units
+
+    Returns:
+        dict: "index" of adm-units (as in `get_adm_pops`) and "ratios" (numpy.ndarray) with one row
+            per adm-unit, and one column per level from adm1 up to "adm{`adm_level` - 1}". Ratios
+            are nan where either population is missing
+    """
+    tables = [
+        load_adm_pop_table(level, country_code) for level in range(1, adm_level + 1)
+    ]
+    key = (adm_level, country_code)
+    entry = adm_pop_ratio_store.get(key)
+    if entry is not None and all(a is b for a, b in zip(entry["tables"], tables)):
+        return entry
+
+    units = tables[-1].index
+    unit_pops = tables[-1]["population"].to_numpy(dtype=float)
+    ratios = np.full((len(units), adm_level - 1), np.nan)
+    for level, table in enumerate(tables[:-1], 1):
+        ancestors = units.droplevel(list(range(level, adm_level)))
+        ancestor_idx = table.index.get_indexer(ancestors)
+        ancestor_pops = np.append(table["population"].to_numpy(dtype=float), np.nan)
+        ratios[:, level - 1] = unit_pops / ancestor_pops[ancestor_idx]
+
+    entry = {"tables": tables, "index": units, "ratios": ratios}
+    adm_pop_ratio_store[key] = entry
+    return entry
+
+
+def assign_pop_ratios(policies, country_code, max_adm_level):
+    """Assign the ratio of the population of the adm-unit of each policy at each adm-level to the
+    population of the unit containing it at each lower adm-level, gathered from `get_adm_pop_ratios`
+
+    Args:
+        policies (pandas.DataFrame): List of policies with "adm{N}_name" columns
+        country_code (str): Three-letter country code of `policies`
+        max_adm_level (int): Adm-level up to which ratios should be assigned
+
+    Returns:
+        pandas.DataFrame: `policies` with a column of ratios named by `get_pop_ratio_col` for each
+            pair of levels, which is nan where the policy has no adm-unit at either level
+    """
+    for adm_level in range(2, max_adm_level + 1):
+        entry = get_adm_pop_ratios(adm_level, country_code)
+        unit_idx = entry["index"].get_indexer(
+            pd.MultiIndex.from_frame(policies[get_adm_fields(adm_level)])
+        )
+        ratios = np.vstack([entry["ratios"], np.full((1, adm_level - 1), np.nan)])[
+            unit_idx
+        ]
+        for level in range(1, adm_level):
+            policies[get_pop_ratio_col(adm_level, level)] = ratios[:, level - 1]
+
+    return policies
+
+
 def merge_policies_with_population_on_level(
-    policies, adm_level, country_code, errors="raise"
+    policies, adm_level, country_code, errors="raise", check=True
 ):
     """Assign all populations at an adm-level to DataFrame of policies
 
@@ -92,6 +295,8 @@ def merge_policies_with_population_on_level(
         country_code (str): Three-letter country code of requested populations
     Kwargs:
        errors (str): Error-handling behavior. Options are "raise" (default), "ignore", and "warn"
+       check (bool): Whether to check that populations are assigned, which may be left to
+           `validate_populations` once all are assigned
 
     Returns:
         pandas.DataFrame: `policies` with a new column, "adm_{`adm_level`}_pop"
@@ -107,15 +312,16 @@ def merge_policies_with_population_on_level(
     )
 
     # Check that all non-"All" populations are assigned
-    check_population_col_is_filled(
-        policies, f"adm{adm_level}_name", f"adm{adm_level}_pop", errors
-    )
+    if check:
+        check_population_col_is_filled(
+            policies, f"adm{adm_level}_name", f"adm{adm_level}_pop", errors
+        )
 
     return policies
 
 
 def merge_policies_with_population(
-    policies, country_code, max_adm_level, errors="raise"
+    policies, country_code, max_adm_level, errors="raise", check=True
 ):
     """Assign all populations at all adm-levels to DataFrame of policies
 
@@ -126,6 +332,7 @@ def merge_policies_with_population(
             e.g. `max_adm_level` == 3 would assign populations at adm-levels 1, 2, and 3
     Kwargs:
        errors (str): Error-handling behavior. Options are "raise" (default), "ignore", and "warn"
+       check (bool): as in `merge_policies_with_population_on_level`
 
     Returns:
         pandas.DataFrame: `policies` with new columns, "adm_{`adm_level`}_pop" for each `adm_level` from 1 to `max_adm_level`
@@ -133,14 +340,14 @@ def merge_policies_with_population(
     """
     for adm_level in range(1, max_adm_level + 1):
         policies = merge_policies_with_population_on_level(
-            policies, adm_level, country_code, errors
+            policies, adm_level, country_code, errors, check=check
         )
 
     return policies
 
 
 def merge_cases_with_population_on_level(
-    epi_df, adm_level, country_code, get_latlons=True, errors="raise"
+    epi_df, adm_level, country_code, get_latlons=True, errors="raise", check=True
 ):
     """Assign all populations at a given adm-level to DataFrame of epidemiological (cases) data
 
@@ -150,6 +357,7 @@ def merge_cases_with_population_on_level(
         country_code (str): Three-letter country code of requested populations
     Kwargs:
        errors (str): Error-handling behavior. Options are "raise" (default), "ignore", and "warn".
+       check (bool): as in `merge_policies_with_population_on_level`
 
     Returns:
         pandas.DataFrame: `epi_df` with a new column, "population"
@@ -165,57 +373,101 @@ def merge_cases_with_population_on_level(
     ).rename(columns={f"adm{adm_level}_pop": "population"})
 
     # Check that all non-"All" populations are assigned
-    check_population_col_is_filled(result, f"adm{adm_level}_name", "population", errors)
+    if check:
+        check_population_col_is_filled(
+            result, f"adm{adm_level}_name", "population", errors
+        )
 
     return result
 
 
-def check_pops_in_policies(policies, max_level, errors="raise"):
-    # Check that population weights are all there
-    if errors == "raise":
-        assert len(policies[policies["adm3_pop"].isnull()]["adm3_name"].unique()) == 1
-        assert len(policies[policies["adm2_pop"].isnull()]["adm2_name"].unique()) == 1
-        assert len(policies[policies["adm1_pop"].isnull()]["adm1_name"].unique()) == 1
-    elif errors == "warn":
-        if len(policies[policies["adm3_pop"].isnull()]["adm3_name"].unique()) != 1:
-            warnings.warn("adm3 pop is null for some adm3 level")
-        if len(policies[policies["adm2_pop"].isnull()]["adm2_name"].unique()) != 1:
-            warnings.warn("adm2 pop is null for some adm2 level")
-        if len(policies[policies["adm1_pop"].isnull()]["adm1_name"].unique()) > 1:
-            warnings.warn("adm1 pop is null for some adm1 level")
+def validate_populations(policies, cases_df, cases_level, errors="raise"):
+    """Check that every adm-unit of `policies` and `cases_df` has been assigned a population, at
+    every adm-level, and report all adm-units missing populations at once
+
+    Args:
+        policies (pandas.DataFrame): policies with "adm{N}_pop" columns, as assigned by
+            `merge_policies_with_population`. Policies for all adm-units ("All") need no population
+        cases_df (pandas.DataFrame): cases with a "population" column, as assigned by
+            `merge_cases_with_population_on_level`
+        cases_level (int): Adm-level of `cases_df`
+        errors (str): Error-handling behavior if any populations are missing. Options are "raise"
+            (default), "ignore", and "warn"
+
+    Returns:
+        dict: adm-units missing populations (list), keyed by adm-level, for "policies" and "cases".
+            Levels with no adm-units missing populations are left out
+    """
+    if errors not in ["raise", "warn", "ignore"]:
+        raise ValueError("Choice of value for ``errors'' is not valid.")
+
+    report = {"policies": dict(), "cases": dict()}
+
+    # Find missing populations of all levels in one scan, then only look at names where missing
+    levels = [
+        level
+        for level in chier.get_adm_levels(policies.columns)
+        if f"adm{level}_pop" in policies.columns
+    ]
+    is_null = policies[[f"adm{level}_pop" for level in levels]].isnull().to_numpy()
+    has_null = is_null.any(axis=0)
+    for i, level in enumerate(levels):
+        if has_null[i]:
+            units = get_units_without_pop(
+                policies.loc[is_null[:, i]], f"adm{level}_name", f"adm{level}_pop"
+            )
+            if len(units) > 0:
+                report["policies"][level] = units
+
+    units = get_units_without_pop(
+        cases_df, f"adm{cases_level}_name", "population", skip_all=False
+    )
+    if len(units) > 0:
+        report["cases"][cases_level] = units
 
+    missing = [
+        f"adm{level}_name in {table}: {units}"
+        for table, table_report in report.items()
+        for level, units in table_report.items()
+    ]
+    if len(missing) > 0:
+        handle_missing_pops("Population not found for " + "; ".join(missing), errors)
 
-def check_pops_in_cases(cases_df, errors="raise"):
-    if errors == "raise":
-        assert cases_df["population"].isnull().sum() == 0
-    elif errors == "warn":
-        if cases_df["population"].isnull().sum() != 0:
-            print("there where some entries with Null population values")
+    return report
 
 
 def assign_all_populations(
     policies, cases_df, cases_level, get_latlons=True, errors="raise"
 ):
+    """Assign populations at all adm-levels to `policies`, and at `cases_level` to `cases_df`
+
+    Args:
+        policies (pandas.DataFrame): policies of one country
+        cases_df (pandas.DataFrame): cases of the same country
+        cases_level (int): Adm-level of `cases_df`
+        get_latlons (bool): whether to assign latitudes and longitudes to `cases_df`
+        errors (str): as in `validate_populations`
+
+    Returns:
+        tuple of (pandas.DataFrame, pandas.DataFrame, dict): `policies` with populations and
+            population ratios, `cases_df` with populations, and the adm-units missing
+            populations, as reported by `validate_populations`
+    """
     all_adm0 = policies["adm0_name"].unique()
     assert len(all_adm0) == 1
     country_code = all_adm0[0]
 
-    max_adm_level = max(
-        [
-            int(col[3])
-            for col in policies.columns
-            if col.startswith("adm") and col.endswith("name")
-        ]
-    )
+    max_adm_level = max(chier.get_adm_levels(policies.columns))
 
+    # Populations are checked once all are assigned, by `validate_populations`
     cases_df = merge_cases_with_population_on_level(
-        cases_df, cases_level, country_code, get_latlons=get_latlons, errors=errors
+        cases_df, cases_level, country_code, get_latlons=get_latlons, check=False
     )
     policies = merge_policies_with_population(
-        policies, country_code, max_adm_level, errors=errors
+        policies, country_code, max_adm_level, check=False
     )
+    report = validate_populations(policies, cases_df, cases_level, errors=errors)
 
-    check_pops_in_policies(policies, max_adm_level, errors=errors)
-    check_pops_in_cases(cases_df, errors=errors)
+    policies = assign_pop_ratios(policies, country_code, max_adm_level)
 
-    return policies, cases_df
+    return policies, cases_df, report
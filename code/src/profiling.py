@@ -0,0 +1,112 @@
+import contextlib
+import json
+import time
+import tracemalloc
+
+# Peaks of traced memory can only be reset from Python 3.9
+can_reset_peak = hasattr(tracemalloc, "reset_peak")
+
+
+def init_profile(trace_memory=False):
+    """Initialize a profile of the stages of a policy merge
+
+    Args:
+        trace_memory (bool): whether to measure the peak memory allocated in each stage with
+            ``tracemalloc``, which slows the merge down. Before Python 3.9, a stage whose peak is
+            below that of an earlier stage records the memory it holds at its end instead
+
+    Returns:
+        dict: profile with records of "stages" and "policies", each keyed on name, with the
+            "seconds", number of "calls" and (if `trace_memory`) "peak_mb" of each
+    """
+    return {
+        "trace_memory": trace_memory,
+        "stages": dict(),
+        "policies": dict(),
+        "peaks": [],
+    }
+
+
+@contextlib.contextmanager
+def profile_stage(profile, name, group="stages"):
+    """Record the time and peak memory of the code run in this context in `profile`
+    Does nothing if `profile` is None. Stages may be nested, and repeated stages add up
+
+    Args:
+        profile (dict): profile, as in `init_profile`, or None
+        name (str): name of stage
+        group (str): group of records in `profile` ("stages" or "policies")
+    """
+    if profile is None:
+        yield
+        return
+
+    trace_memory = profile["trace_memory"]
+    started_tracing = trace_memory and not tracemalloc.is_tracing()
+    if started_tracing:
+        tracemalloc.start()
+    if trace_memory:
+        current, peak = tracemalloc.get_traced_memory()
+        if can_reset_peak:
+            # Carry the peak of an enclosing stage over before measuring this one from scratch
+            if len(profile["peaks"]) > 0:
+                profile["peaks"][-1] = max(profile["peaks"][-1], peak)
+            profile["peaks"].append(0)
+            tracemalloc.reset_peak()
+        else:
+            profile["peaks"].append(peak)
+
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        record = profile[group].setdefault(name, {"seconds": 0.0, "calls": 0})
+        record["seconds"] += time.perf_counter() - start
+        record["calls"] += 1
+
+        if trace_memory:
+            end_current, end_peak = tracemalloc.get_traced_memory()
+            if can_reset_peak:
+                peak = max(profile["peaks"].pop(), end_peak)
+                if len(profile["peaks"]) > 0:
+                    profile["peaks"][-1] = max(profile["peaks"][-1], peak)
+            else:
+                # Without resetting the peak, one reached in this stage is only seen if it is
+                # above the peak at its start. Otherwise, count the memory this stage still holds
+                start_peak = profile["peaks"].pop()
+                peak = end_peak if end_peak > start_peak else end_current
+            record["peak_mb"] = max(
+                record.get("peak_mb", 0), (peak - current) / 2 ** 20
+            )
+        if started_tracing:
+            tracemalloc.stop()
+
+
+def record_memo(profile, policy_memo, hits=0, misses=0):
+    """Record hits and misses of `policy_memo` since it had `hits` and `misses` in `profile`"""
+    if profile is None:
+        return
+
+    hits = policy_memo["hits"] - hits
+    misses = policy_memo["misses"] - misses
+    profile["memo"] = {
+        "hits": hits,
+        "misses": misses,
+        "hit_rate": hits / (hits + misses) if hits + misses > 0 else None,
+    }
+
+
+def record_missing_pops(profile, report):
+    """Record the adm-units missing populations in `report`, as in `validate_populations`, in
+    `profile`
+    """
+    if profile is None:
+        return
+
+    profile["missing_pops"] = report
+
+
+def write_profile(profile, path):
+    """Write the records of `profile` to `path` as JSON"""
+    with open(path, "w") as f:
+        json.dump({k: v for k, v in profile.items() if k != "peaks"}, f, indent=2)
@@ -0,0 +1,212 @@
+import pandas as pd
+
+import src.merge as cmerge
+
+# Edits of a table of policies that a scenario can make, and the keys each edit requires
+scenario_edits = {
+    "drop": [],
+    "shift": ["days"],
+    "set_intensity": ["policy_intensity"],
+    "add": ["rows"],
+}
+
+
+def match_policies(policies, edit):
+    """Find the rows of `policies` an edit applies to
+    Rows match if they have the "policy" and each "adm{N}_name" given in `edit`. Edits that give
+    none of these apply to every row
+
+    Args:
+        policies (pandas.DataFrame): table of policies, listed by date and regions affected
+        edit (dict): scenario edit, as in `apply_scenario`
+
+    Returns:
+        pandas.Series: boolean indicator of the rows matched
+    """
+    match = pd.Series(True, index=policies.index)
+    for col, value in edit.items():
+        if col == "policy" or (col.startswith("adm") and col.endswith("_name")):
+            match &= policies[col] == value
+    return match
+
+
+def apply_scenario(policies, edits):
+    """Apply the edits of a counterfactual scenario to a table of policies
+
+    Args:
+        policies (pandas.DataFrame): table of policies, listed by date and regions affected
+        edits (list of dict): edits applied in order, each with an "edit" (one of
+            `scenario_edits`), the keys that edit requires, and optionally a "policy" and any
+            "adm{N}_name" to match rows on. "drop" removes the rows matched, "shift" moves their
+            dates by a number of "days", "set_intensity" sets their "policy_intensity", and "add"
+            appends "rows" (pandas.DataFrame) with the columns of `policies`
+
+    Returns:
+        pandas.DataFrame: edited copy of `policies`
+    """
+    policies = policies.copy()
+    for edit in edits:
+        kind = edit.get("edit")
+        if kind not in scenario_edits:
+            raise ValueError(f"Unknown scenario edit: {kind}")
+        missing = [key for key in scenario_edits[kind] if key not in edit]
+        if len(missing) > 0:
+            raise ValueError(f"Scenario edit {kind} requires {missing}")
+
+        if kind == "add":
+            policies = pd.concat([policies, edit["rows"][policies.columns]])
+            continue
+
+        match = match_policies(policies, edit)
+        if not match.any():
+            raise ValueError(f"Scenario edit matches no policies: {edit}")
+
+        if kind == "drop":
+            policies = policies[~match]
+        elif kind == "shift":
+            shift = pd.Timedelta(days=edit["days"])
+            for col in ["date_start", "date_end"]:
+                policies.loc[match, col] = policies.loc[match, col] + shift
+        elif kind == "set_intensity":
+            policies.loc[match, "policy_intensity"] = edit["policy_intensity"]
+
+    return policies
+
+
+def prepare_scenario_context(cases_df, policies, cases_level, **merge_kwargs):
+    """Merge the baseline panel that scenarios are built from, and keep its prepared inputs
+    Scenarios share the prepared baseline and one memo of intensities, so intensities of the
+    policies a scenario leaves unchanged are not calculated again
+
+    Args:
+        cases_df (pandas.DataFrame): as in `src.merge.assign_policies_to_panel`
+        policies (pandas.DataFrame): baseline table of policies
+        cases_level (int): as in `src.merge.assign_policies_to_panel`
+        **merge_kwargs: other arguments of `src.merge.update_panel_for_policy_edits`, passed to
+            each merge
+
+    Returns:
+        dict: context with the "cases_df", "policies", "cases_level" and "merge_kwargs" of the
+            baseline, its inputs as prepared by `src.merge.prepare_policy_edits` ("prepared"), the
+            "policy_memo" shared by all merges, and the baseline's "merged" panel
+    """
+    policy_memo = cmerge.init_policy_memo()
+    prepare_kwargs = {
+        k: v for k, v in merge_kwargs.items() if k not in ["engine", "n_jobs"]
+    }
+    prepared = cmerge.prepare_policy_edits(
+        cases_df, policies, cases_level, **prepare_kwargs
+    )
+    merged = cmerge.merge_prepared_policies(
+        prepared["cases_df"],
+        prepared["policies"],
+        prepared["policy_list"],
+        cases_level,
+        method=merge_kwargs.get("method", "ITA"),
+        engine=merge_kwargs.get("engine", "interval"),
+        policy_memo=policy_memo,
+        n_jobs=merge_kwargs.get("n_jobs", 1),
+    )
+    return {
+        "cases_df": cases_df,
+        "policies": policies,
+        "cases_level": cases_level,
+        "merge_kwargs": merge_kwargs,
+        "prepared": prepared,
+        "policy_memo": policy_memo,
+        "merged": merged,
+    }
+
+
+def get_dropped_cols(dropped, merge_kwargs, counted=False):
+    """List the columns a merged panel may have for the policy categories in `dropped`
+
+    Args:
+        dropped (collection of str): policy categories
+        merge_kwargs (dict): arguments of the merge, as in `prepare_scenario_context`
+        counted (bool): whether to only list columns counted in "policies_enacted"
+
+    Returns:
+        list of str: column names
+    """
+    # Optional policies are merged as categories of their own if `aggregate_vars` are given
+    opt_counted = len(merge_kwargs.get("aggregate_vars", [])) > 0
+    cols = []
+    for policy in dropped:
+        cols.append(policy)
+        if opt_counted:
+            cols.append(policy + "_opt")
+        if not counted:
+            cols += [policy + "_popwt", policy + "_opt", policy + "_opt_popwt"]
+    return list(dict.fromkeys(cols))
+
+
+def run_scenario(context, edits):
+    """Build the panel of a counterfactual scenario, merging again only the policy variables the
+    edits of the scenario affect
+
+    Args:
+        context (dict): output of `prepare_scenario_context`
+        edits (list of dict): edits of the baseline policies, as in `apply_scenario`
+
+    Returns:
+        pandas.DataFrame: panel of the scenario, with every column of the baseline panel. Policy
+            categories dropped entirely are 0
+    """
+    baseline = context["policies"]
+    policies = apply_scenario(baseline, edits)
+
+    # Compare against the baseline without categories the scenario drops, whose columns are
+    # zeroed, so the merge is not run again for a change of categories
+    dropped = set(baseline["policy"]) - set(policies["policy"])
+    merged = context["merged"].copy()
+    counted_cols = get_dropped_cols(dropped, context["merge_kwargs"], counted=True)
+    for col in get_dropped_cols(dropped, context["merge_kwargs"]):
+        if col in merged.columns:
+            if col in counted_cols:
+                merged["policies_enacted"] -= merged[col]
+            merged[col] = 0
+
+    # Prepared categories of dropped policies include their optional rows in `aggregate_vars`
+    prepared = context["prepared"]
+    prepared_dropped = get_dropped_cols(dropped, context["merge_kwargs"], counted=True)
+    kept = ~prepared["policies"]["policy"].isin(prepared_dropped)
+    prepared = {
+        **prepared,
+        "policies": prepared["policies"][kept],
+        "policy_list": [
+            p for p in prepared["policy_list"] if p not in prepared_dropped
+        ],
+    }
+
+    panel = cmerge.update_panel_for_policy_edits(
+        merged,
+        context["cases_df"],
+        baseline[~baseline["policy"].isin(dropped)],
+        policies,
+        context["cases_level"],
+        policy_memo=context["policy_memo"],
+        prepared=prepared,
+        **context["merge_kwargs"],
+    )
+
+    # Keep the columns of the baseline, and add any optional columns the scenario uses
+    baseline_cols = list(context["merged"].columns)
+    panel = panel.reindex(
+        columns=baseline_cols + [c for c in panel.columns if c not in baseline_cols],
+        fill_value=0,
+    )
+    return panel
+
+
+def run_scenarios(context, scenarios):
+    """Build the panels of a batch of counterfactual scenarios from the same baseline
+
+    Args:
+        context (dict): output of `prepare_scenario_context`
+        scenarios (dict): edits of each scenario (list of dict), keyed on name
+
+    Returns:
+        dict: panel of each scenario, keyed on name
+    """
+    return {name: run_scenario(context, edits) for name, edits in scenarios.items()}
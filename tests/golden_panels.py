@@ -0,0 +1,122 @@
+"""Inputs of the merge tests, and golden panels merged from them by the original implementation
+The golden panels were written by running this script against the baseline commit of the merge
+(before the interval engine), so the tests compare every engine with the original code rather
+than with the reference mode of the current code. Run it from the root of the repository with
+that version of `src` on the path to write them again
+"""
+from pathlib import Path
+
+import pandas as pd
+
+import src.merge as cmerge
+import src.utils as cutil
+
+DIR_GOLDEN = Path(__file__).parent / "data" / "golden"
+
+# Names in the Italy policy dataset that differ from the health data and population tables
+ITA_NAME_FIXES = {
+    "Lombardy": "Lombardia",
+    "Piedmont": "Piemonte",
+    "Emilia-Romagna": "Emilia Romagna",
+    "Padua": "Padova",
+    "Venice": "Venezia",
+    "Pesaro and Urbino": "Pesaro e Urbino",
+    "Apulia": "Puglia",
+    "Vo'Eugane": "Vò",
+}
+
+
+def read_ita_policies():
+    policies = pd.read_csv(cutil.DATA_INTERIM / "italy" / "ITA_policy_data_sources.csv")
+    for level in range(1, 4):
+        policies[f"adm{level}_name"] = (
+            policies[f"adm{level}_name"].replace(ITA_NAME_FIXES).fillna("All")
+        )
+    policies["date_start"] = pd.to_datetime(policies["date_start"])
+    policies["date_end"] = pd.to_datetime(policies["date_end"])
+    policies["policy"] = policies["policy"].str.strip()
+    return policies[
+        [
+            "adm3_name",
+            "adm2_name",
+            "adm1_name",
+            "adm0_name",
+            "date_start",
+            "date_end",
+            "policy",
+            "policy_intensity",
+            "optional",
+        ]
+    ].drop_duplicates()
+
+
+def read_ita_adm1_cases():
+    cases = pd.read_csv(
+        cutil.DATA_INTERIM / "italy" / "italy-cases-by-region.csv", parse_dates=["date"]
+    )
+    return cases[cases["adm1_name"].isin(["Lombardia", "Veneto", "Lazio"])]
+
+
+def read_ita_adm2_cases():
+    cases = pd.read_csv(
+        cutil.DATA_INTERIM / "italy" / "italy-cases-by-province.csv",
+        parse_dates=["date"],
+    )
+    return cases[
+        cases["adm2_name"].isin(["Lodi", "Milano", "Padova", "Venezia", "Roma"])
+    ]
+
+
+def read_usa_inputs():
+    cases = pd.read_csv(
+        cutil.DATA_INTERIM / "usa" / "usa_usafacts_state.csv", parse_dates=["date"]
+    )
+    cases = cases[cases["adm1_name"].isin(["New York", "Washington", "Texas"])]
+    policies = pd.read_csv(
+        cutil.DATA_INTERIM / "usa" / "USA_policy_data_sources.csv", encoding="latin"
+    ).dropna(how="all", axis=0)
+    policies = policies.rename(columns={"Optional": "optional", "date": "date_start"})
+    policies["date_start"] = pd.to_datetime(policies["date_start"])
+    policies["date_end"] = pd.to_datetime("2099-12-31")
+    return cases, policies
+
+
+def get_golden_inputs():
+    """Get the arguments of `assign_policies_to_panel` for each golden panel, keyed on name"""
+    ita_policies = read_ita_policies()
+    usa_cases, usa_policies = read_usa_inputs()
+    return {
+        "ita_adm1": (
+            (read_ita_adm1_cases(), ita_policies, 1),
+            dict(get_latlons=False),
+        ),
+        "ita_adm2": (
+            (read_ita_adm2_cases(), ita_policies, 2),
+            dict(get_latlons=False),
+        ),
+        "usa_adm1": ((usa_cases, usa_policies, 1), dict(method="USA")),
+    }
+
+
+def read_golden_panel(name):
+    """Read the golden panel `name`, with the types it was merged with"""
+    path = DIR_GOLDEN / f"{name}.csv"
+    dtypes = pd.read_csv(DIR_GOLDEN / f"{name}_dtypes.csv", index_col=0)["dtype"]
+    panel = pd.read_csv(path, float_precision="round_trip")
+    return panel.astype(
+        {col: dtype for col, dtype in dtypes.items() if dtype != "datetime64[ns]"}
+    ).assign(date=lambda df: pd.to_datetime(df["date"]))
+
+
+def write_golden_panels():
+    DIR_GOLDEN.mkdir(parents=True, exist_ok=True)
+    for name, (args, kwargs) in get_golden_inputs().items():
+        panel = cmerge.assign_policies_to_panel(*args, **kwargs)
+        panel.to_csv(DIR_GOLDEN / f"{name}.csv", index=False)
+        panel.dtypes.astype(str).rename("dtype").to_csv(
+            DIR_GOLDEN / f"{name}_dtypes.csv", index_label="column"
+        )
+
+
+if __name__ == "__main__":
+    write_golden_panels()
@@ -0,0 +1,66 @@
+import json
+
+import pandas as pd
+import pytest
+
+import src.benchmark as cbench
+import src.merge as cmerge
+import src.utils as cutil
+
+TINY = {"n_adm1": 2, "n_adm2": 2, "n_adm3": 2, "n_days": 20}
+
+
+@pytest.mark.parametrize("method", ["ITA", "USA"])
+def test_synthetic_country_engines_match(method):
+    country = cbench.make_synthetic_country(**TINY, seed=1)
+    data_interim = cutil.DATA_INTERIM
+
+    with cbench.synthetic_data_interim(country["adm_tables"]):
+        for cases_level, cases_df in country["cases"].items():
+            expected = cmerge.assign_policies_to_panel(
+                cases_df,
+                country["policies"],
+                cases_level,
+                get_latlons=False,
+                method=method,
+                engine="reference",
+            )
+            result = cmerge.assign_policies_to_panel(
+                cases_df,
+                country["policies"],
+                cases_level,
+                get_latlons=False,
+                method=method,
+            )
+            pd.testing.assert_frame_equal(
+                result, expected, check_exact=False, rtol=1e-12
+            )
+
+    assert cutil.DATA_INTERIM == data_interim
+
+
+def test_run_benchmarks(tmp_path):
+    benchmarks = cbench.run_benchmarks(
+        scales={"tiny": TINY},
+        methods=["USA"],
+        cases_levels=[1],
+        series_lengths=[100],
+        repeat=1,
+    )
+    with open(tmp_path / "benchmark.json", "w") as f:
+        json.dump(benchmarks, f)
+
+    assert [r["function"] for r in benchmarks["results"]] == [
+        "assign_policies_to_panel",
+        "apply_get_policy_level",
+        "get_policy_levels",
+        "get_policies_to_date_cache",
+        "calculate_intensities_usa",
+    ]
+    assert [r["function"] for r in benchmarks["impute_results"]] == [
+        "convert_non_monotonic_to_nan",
+        "convert_non_monotonic_to_nan_iterative",
+    ]
+    for record in benchmarks["results"] + benchmarks["impute_results"]:
+        assert record["seconds"] > 0
+        assert record["peak_mb"] > 0
@@ -0,0 +1,77 @@
+import numpy as np
+import pandas as pd
+
+import src.columnar as ccol
+
+
+def test_columnar_roundtrip(tmp_path):
+    df = pd.DataFrame(
+        {
+            "date": pd.date_range("2020-03-01", periods=4),
+            "adm1_name": ["Lombardia", np.nan, "Veneto", "Lombardia"],
+            "adm2_name": pd.Categorical(["Lodi", "Padova", "Lodi", "Vò"]),
+            "empty": np.array([np.nan] * 4, dtype=object),
+            "cases": [0, 1, 2, 3],
+            "school_closure_popwt": [0.0, 0.25, np.nan, 1.0],
+            "flag": [True, False, True, True],
+        }
+    )
+    path = tmp_path / "df.npz"
+    ccol.write_columnar(df, path)
+
+    pd.testing.assert_frame_equal(ccol.read_columnar(path), df)
+    pd.testing.assert_frame_equal(
+        ccol.read_columnar(path, columns=["cases", "adm1_name"]),
+        df[["cases", "adm1_name"]],
+    )
+
+
+def test_columnar_run_length_and_sparse(tmp_path):
+    steps = np.repeat([0.0, 0.5, 1.0, np.nan, 1.0], [50, 3, 40, 2, 5])
+    df = pd.DataFrame(
+        {
+            "step": steps,
+            "count": np.repeat([0, 2, 1], [10, 80, 10]),
+            "sparse": pd.arrays.SparseArray(
+                np.repeat([0.0, 0.25], [90, 10]), fill_value=0.0
+            ),
+            "adm1_name": "Lombardia",
+        }
+    )
+    path = tmp_path / "df.npz"
+    ccol.write_columnar(df, path, run_length_cols=["step", "count", "adm1_name"])
+
+    pd.testing.assert_frame_equal(ccol.read_columnar(path), df)
+
+    starts, values = ccol.run_length_encode(df["count"].to_numpy())
+    np.testing.assert_array_equal(starts, [0, 10, 90])
+    np.testing.assert_array_equal(values, [0, 2, 1])
+    assert len(ccol.run_length_encode(np.zeros(0))[0]) == 0
+
+
+def test_columnar_filters_and_nullable_ints(tmp_path):
+    df = pd.DataFrame(
+        {
+            "adm0_name": pd.Categorical(["ITA", "USA", "ITA", "FRA"]),
+            "adm1_name": ["Lombardia", "Texas", "Veneto", "Corse"],
+            "population": pd.array([10, None, 30, 40], dtype="Int64"),
+        }
+    )
+    path = tmp_path / "df.npz"
+    ccol.write_columnar(df, path, attrs={"source": "adm1.csv"})
+
+    pd.testing.assert_frame_equal(ccol.read_columnar(path), df)
+    meta = ccol.read_columnar_meta(path)
+    assert meta["kinds"] == ["category", "string", "masked"]
+    assert meta["attrs"] == {"source": "adm1.csv"}
+    pd.testing.assert_frame_equal(
+        ccol.read_columnar(
+            path, columns=["adm1_name", "population"], filters={"adm0_name": ["ITA"]}
+        ),
+        df.loc[[0, 2], ["adm1_name", "population"]].reset_index(drop=True),
+    )
+    filtered = ccol.read_columnar(
+        path, filters={"adm0_name": ["ITA", "USA"], "population": [30, 40]}
+    )
+    assert list(filtered["adm1_name"]) == ["Veneto"]
+    assert len(ccol.read_columnar(path, filters={"adm0_name": ["CHN"]})) == 0
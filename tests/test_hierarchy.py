@@ -0,0 +1,30 @@
+import numpy as np
+import pandas as pd
+
+import src.benchmark as cbench
+import src.hierarchy as chier
+
+
+def test_get_adm_levels():
+    columns = ["adm2_name", "policy", "adm0_name", "adm1_pop", "adm1_name"]
+    assert chier.get_adm_levels(columns) == [0, 1, 2]
+
+
+def test_get_policy_levels():
+    policies = pd.DataFrame(
+        {
+            "adm0_name": "ITA",
+            "adm1_name": ["All", "A", "all", "A", "B"],
+            "adm2_name": ["All", "all", "All", "a1", "b1"],
+            "adm3_name": ["All", "All", "All", "All", "b1x"],
+        }
+    )
+    np.testing.assert_array_equal(chier.get_policy_levels(policies), [0, 1, 0, 2, 3])
+
+
+def test_get_policy_levels_matches_reference():
+    policies = cbench.make_synthetic_country(4, 4, 3, 30)["policies"]
+    np.testing.assert_array_equal(
+        chier.get_policy_levels(policies),
+        policies.apply(chier.get_policy_level, axis=1).to_numpy(),
+    )
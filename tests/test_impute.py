@@ -0,0 +1,35 @@
+import numpy as np
+import pytest
+
+import src.impute as cimpute
+
+
+def test_convert_non_monotonic_to_nan():
+    result = cimpute.convert_non_monotonic_to_nan(
+        np.array([0, 0, 5, 3, 4, 6, 3, 7, 6, 7, 8])
+    )
+    expected = [0, 0, np.nan, 3, np.nan, np.nan, 3, np.nan, 6, 7, 8]
+    np.testing.assert_array_equal(result, expected)
+    assert len(cimpute.convert_non_monotonic_to_nan(np.array([]))) == 0
+
+
+@pytest.mark.parametrize("seed", range(5))
+def test_convert_non_monotonic_to_nan_matches_iterative(seed):
+    rng = np.random.default_rng(seed)
+    for _ in range(1000):
+        n = rng.integers(1, 40)
+        arrays = [
+            rng.integers(0, 6, n),
+            rng.normal(size=n),
+            np.cumsum(rng.integers(-3, 6, n)),
+            np.append(np.arange(n - 1), rng.integers(-1, n)),
+        ]
+        with_nans = rng.integers(0, 6, n).astype(float)
+        with_nans[rng.random(n) < 0.2] = np.nan
+        arrays.append(with_nans)
+
+        for array in arrays:
+            np.testing.assert_array_equal(
+                cimpute.convert_non_monotonic_to_nan(array),
+                cimpute.convert_non_monotonic_to_nan_iterative(array),
+            )
@@ -0,0 +1,839 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+import src.benchmark as cbench
+import src.columnar as ccol
+import src.merge as cmerge
+import src.pop as cpop
+import src.profiling as cprof
+
+import golden_panels as golden
+
+
+@pytest.fixture(scope="module")
+def ita_policies():
+    return golden.read_ita_policies()
+
+
+@pytest.fixture(scope="module")
+def ita_adm1_cases():
+    return golden.read_ita_adm1_cases()
+
+
+@pytest.fixture(scope="module")
+def ita_adm2_cases():
+    return golden.read_ita_adm2_cases()
+
+
+@pytest.fixture(scope="module")
+def usa_inputs():
+    return golden.read_usa_inputs()
+
+
+@pytest.fixture(scope="module")
+def golden_inputs():
+    return golden.get_golden_inputs()
+
+
+@pytest.mark.parametrize("engine", ["interval", "reference"])
+@pytest.mark.parametrize("name", ["ita_adm1", "ita_adm2", "usa_adm1"])
+def test_engines_match_golden_panels(golden_inputs, name, engine):
+    # Golden panels were merged by the original implementation, as in `golden_panels`
+    args, kwargs = golden_inputs[name]
+    result = cmerge.assign_policies_to_panel(*args, engine=engine, **kwargs)
+    pd.testing.assert_frame_equal(
+        result, golden.read_golden_panel(name), check_exact=False, rtol=1e-12
+    )
+
+
+def test_join_policies_to_units():
+    policies = pd.DataFrame(
+        {
+            "adm1_name": ["All", "A", "A", "B"],
+            "adm2_name": ["All", "all", "a2", "b1"],
+            "policy": ["p", "p", "q", "p"],
+        }
+    )
+    units = pd.DataFrame(
+        {"adm1_name": ["A", "A", "B"], "adm2_name": ["a1", "a2", "b1"]}
+    )
+    joined = cmerge.join_policies_to_units(policies, units, 2)
+
+    assert joined.to_dict("list") == {
+        "adm2_name": ["a1", "a1", "a2", "a2", "a2", "b1", "b1"],
+        "policy": ["p", "p", "p", "p", "q", "p", "p"],
+        "row": [0, 1, 0, 1, 2, 0, 3],
+    }
+
+
+def test_encode_adm_names():
+    policies = pd.DataFrame(
+        {
+            "adm1_name": ["All", "all", "B", "A"],
+            "adm2_name": ["All", "b1", np.nan, "a1"],
+        }
+    )
+    units = pd.DataFrame({"adm1_name": ["A", "C"], "adm2_name": ["a1", "c1"]})
+    codes = cmerge.encode_adm_names(policies, ["adm1_name", "adm2_name"])
+    assert list(codes) == ["adm1_code", "adm2_code"]
+    assert list(codes["adm1_code"].categories) == ["All", "B", "A"]
+
+    # "All" and "all" share the wildcard code, missing names are coded as -1, and adm-units no
+    # policy is specified for get codes of their own
+    for prepared in [policies, policies.assign(**codes)]:
+        policy_codes, unit_codes = cmerge.get_adm_codes(
+            prepared, units, ["adm1_name", "adm2_name"]
+        )
+        np.testing.assert_array_equal(policy_codes, [[0, 0], [0, 1], [1, -1], [2, 2]])
+        np.testing.assert_array_equal(unit_codes, [[2, 2], [3, 3]])
+
+
+def test_prepared_adm_codes_are_reused(ita_policies, ita_adm2_cases, monkeypatch):
+    prepared_cases, prepared_policies, policy_list = cmerge.prepare_merge_inputs(
+        ita_adm2_cases, ita_policies, 2, get_latlons=False
+    )
+    expected = cmerge.merge_prepared_policies(
+        prepared_cases, prepared_policies, policy_list, 2
+    )
+
+    def fail(*args, **kwargs):
+        raise AssertionError("encoded again")
+
+    monkeypatch.setattr(cmerge, "encode_adm_names", fail)
+    for engine_policies in [prepared_policies, prepared_policies.iloc[::-1]]:
+        result = cmerge.merge_prepared_policies(
+            prepared_cases, engine_policies, policy_list, 2
+        )
+        pd.testing.assert_frame_equal(result, expected)
+
+
+def test_policy_timeline():
+    policies = pd.DataFrame(
+        {
+            "date_start": pd.to_datetime(
+                ["2019-12-01", "2020-02-20", "2020-03-02", "2020-03-02", "2020-03-05"]
+            )
+        }
+    )
+    joined = pd.DataFrame(
+        {"adm1_name": "A", "policy": ["p"] * 5, "row": [0, 1, 2, 3, 4]}
+    )
+    policy_panel = pd.DataFrame(
+        {"date": pd.date_range("2020-03-01", "2020-03-04"), "adm1_name": "A"}
+    )
+    timeline = cmerge.get_policy_timeline(joined, policies, policy_panel, 1)
+
+    # Runs starting before the panel are merged into its first date, runs after it are dropped
+    assert timeline.to_dict("list") == {
+        "adm1_name": ["A", "A"],
+        "policy": ["p", "p"],
+        "date": list(pd.to_datetime(["2020-03-01", "2020-03-02"])),
+        "n_active": [2, 4],
+    }
+
+    run_idx = cmerge.expand_policy_timeline(timeline, policy_panel, ["p", "q"], 1)
+    np.testing.assert_array_equal(run_idx, [[0, -1], [1, -1], [1, -1], [1, -1]])
+
+
+def test_policy_memo_is_shared_across_units(ita_policies, ita_adm2_cases):
+    policy_memo = cmerge.init_policy_memo()
+    cmerge.assign_policies_to_panel(
+        ita_adm2_cases, ita_policies, 2, get_latlons=False, policy_memo=policy_memo
+    )
+
+    # Provinces without their own policies share the national and regional policies in force
+    assert policy_memo["hits"] > 0
+    assert policy_memo["misses"] == len(policy_memo["results"])
+
+
+def test_policy_memo_is_shared_across_engines_and_tables(ita_policies, ita_adm2_cases):
+    # Tables of policies with the same rows in other positions, and with other intensities in the
+    # same positions
+    reordered = ita_policies.iloc[::-1]
+    halved = ita_policies.assign(policy_intensity=ita_policies["policy_intensity"] / 2)
+    expected = {
+        name: cmerge.assign_policies_to_panel(
+            ita_adm2_cases, policies, 2, get_latlons=False
+        )
+        for name, policies in [("reordered", reordered), ("halved", halved)]
+    }
+
+    policy_memo = cmerge.init_policy_memo()
+    for engine in ["reference", "interval"]:
+        for name, policies in [("reordered", reordered), ("halved", halved)]:
+            result = cmerge.assign_policies_to_panel(
+                ita_adm2_cases,
+                policies,
+                2,
+                get_latlons=False,
+                engine=engine,
+                policy_memo=policy_memo,
+            )
+            pd.testing.assert_frame_equal(
+                result, expected[name], check_exact=False, rtol=1e-12
+            )
+
+    assert policy_memo["hits"] > 0
+    assert policy_memo["misses"] == len(policy_memo["results"])
+
+
+def test_get_unit_classes():
+    joined = pd.DataFrame(
+        {
+            "adm2_name": ["a1", "a1", "a2", "a2", "b1", "b2"],
+            "policy": ["p", "q", "p", "q", "p", "p"],
+            "row": [0, 1, 0, 1, 0, 2],
+        }
+    )
+    units = pd.DataFrame({"adm2_name": ["a1", "a2", "b1", "b2", "c1", "c2"]})
+    unit_classes = cmerge.get_unit_classes(joined, units, 2)
+
+    assert unit_classes.to_dict() == {
+        "a1": "a1",
+        "a2": "a1",
+        "b1": "b1",
+        "b2": "b2",
+        "c1": "c1",
+        "c2": "c1",
+    }
+
+
+def test_parallel_matches_serial(usa_inputs):
+    cases, policies = usa_inputs
+    expected = cmerge.assign_policies_to_panel(cases, policies, 1, method="USA")
+
+    policy_memo = cmerge.init_policy_memo()
+    result = cmerge.assign_policies_to_panel(
+        cases, policies, 1, method="USA", policy_memo=policy_memo, n_jobs=2
+    )
+
+    pd.testing.assert_frame_equal(result, expected, check_exact=False, rtol=1e-12)
+    assert policy_memo["misses"] == len(policy_memo["results"])
+
+
+def test_get_covering_intensity():
+    other = pd.DataFrame(
+        {
+            "adm0_name": "ITA",
+            "adm1_name": ["All", "A", "A", "B"],
+            "adm2_name": ["All", "all", "a1", "b1"],
+            "policy_intensity": [0.25, 0.5, 1.0, 0.75],
+        }
+    )
+    policies = pd.DataFrame(
+        {
+            "adm0_name": "ITA",
+            "adm1_name": ["A", "A", "B", "All", "C"],
+            "adm2_name": ["a1", "a2", "b2", "All", "All"],
+        }
+    )
+    adm_levels = [0, 1, 2]
+
+    area_index = cmerge.build_area_index(other, adm_levels)
+    np.testing.assert_array_equal(
+        cmerge.get_covering_intensity(policies, area_index, adm_levels),
+        [1.0, 0.5, 0.25, 0.25, 0.25],
+    )
+
+    area_index = cmerge.build_area_index(other.iloc[2:], adm_levels)
+    np.testing.assert_array_equal(
+        cmerge.get_covering_intensity(policies, area_index, adm_levels),
+        [1.0, 0, 0, 0, 0],
+    )
+
+
+def test_intensity_bits_match_intensity_sets():
+    rng = np.random.default_rng(0)
+    for policy, rules in cmerge.us_intensity_rules.items():
+        compiled = cmerge.us_intensity_bitmasks[policy]
+        groups = compiled["groups"][:-1]
+        for _ in range(20):
+            chosen = set(rng.choice(groups, rng.integers(0, len(groups) + 1), False))
+            bits = np.array([sum(compiled["bits"][g] for g in chosen)], dtype=np.int64)
+
+            expected_groups = cmerge.preduce(set(chosen), rules["replaces"])
+            reduced = cmerge.reduce_intensity_bits(bits, compiled)
+            assert reduced[0] == sum(compiled["bits"][g] for g in expected_groups)
+
+            if expected_groups <= set(rules["weights"]):
+                intensity, is_int = cmerge.sum_intensity_bits(reduced, compiled)
+                expected = cmerge.pintensity(expected_groups, rules["weights"])
+                assert intensity[0] == pytest.approx(expected)
+                assert is_int[0] == isinstance(expected, int)
+            else:
+                with pytest.raises(ValueError, match="Missing intensity group"):
+                    cmerge.sum_intensity_bits(reduced, compiled)
+
+
+def test_unknown_intensity_group_is_named():
+    policies_to_date = pd.DataFrame(
+        {
+            "adm2_name": "All",
+            "adm3_name": "All",
+            "policy_level": [1, 1],
+            "adm1_pop": 1e6,
+            "adm2_pop": np.nan,
+            "adm3_pop": np.nan,
+            "policy": "school_closure",
+            "intensity_group": ["school closure", "school closure - partial"],
+        }
+    )
+    with pytest.raises(ValueError, match="school closure - partial"):
+        cmerge.calculate_intensities_usa(policies_to_date, 1, "school_closure")
+
+
+def test_policies_to_date_cache():
+    policies = pd.DataFrame(
+        {
+            "adm1_name": ["A", "All", "B", "A", "A"],
+            "policy": ["p", "p", "p", "q", "p"],
+            "date_start": pd.to_datetime(
+                ["2020-01-03", "2019-12-01", "2020-01-02", "2020-01-02", "2020-01-02"]
+            ),
+        }
+    )
+    policy_panel = pd.DataFrame(
+        {"date": pd.date_range("2020-01-01", "2020-01-04"), "adm1_name": "A"}
+    )
+    cache = cmerge.get_policies_to_date_cache(policies, policy_panel, 1)
+
+    # The policy starting before the first cached date only comes into force with the next one
+    rows, n_active = cache["groups"]["A"]["p"]
+    assert list(cache["policies"].index[rows]) == [1, 4, 0]
+    np.testing.assert_array_equal(n_active[-4:], [0, 2, 3, 3])
+
+    policies_to_date = cmerge.get_policies_to_date(cache, "A", "p", "2020-01-02")
+    assert list(policies_to_date.index) == [1, 4]
+    assert len(cmerge.get_policies_to_date(cache, "A", "q", "2020-01-01")) == 0
+
+
+def test_merge_cache(ita_policies, ita_adm1_cases, tmp_path, monkeypatch):
+    expected = cmerge.assign_policies_to_panel(
+        ita_adm1_cases, ita_policies, 1, get_latlons=False, cache_dir=tmp_path
+    )
+    assert len(list(tmp_path.glob("*.npz"))) == 1
+
+    # A second run with the same inputs reads the stored panel without merging
+    def fail(*args, **kwargs):
+        raise AssertionError("merged again")
+
+    with monkeypatch.context() as m:
+        m.setattr(cmerge, "assign_policies_interval", fail)
+        result = cmerge.assign_policies_to_panel(
+            ita_adm1_cases, ita_policies, 1, get_latlons=False, cache_dir=tmp_path
+        )
+    pd.testing.assert_frame_equal(result, expected)
+
+    # Changing any input stores a new panel
+    cmerge.assign_policies_to_panel(
+        ita_adm1_cases, ita_policies.iloc[1:], 1, get_latlons=False, cache_dir=tmp_path
+    )
+    assert len(list(tmp_path.glob("*.npz"))) == 2
+
+
+def test_merge_cache_write_is_atomic(
+    ita_policies, ita_adm1_cases, tmp_path, monkeypatch
+):
+    # A write that fails partway leaves neither a panel nor a temporary file in the cache
+    def write_partial(df, path, run_length_cols=()):
+        with open(path, "wb") as f:
+            f.write(b"partial")
+        raise OSError("disk full")
+
+    with monkeypatch.context() as m:
+        m.setattr(ccol, "write_columnar", write_partial)
+        with pytest.raises(OSError):
+            cmerge.assign_policies_to_panel(
+                ita_adm1_cases, ita_policies, 1, get_latlons=False, cache_dir=tmp_path
+            )
+    assert list(tmp_path.iterdir()) == []
+
+    cmerge.assign_policies_to_panel(
+        ita_adm1_cases, ita_policies, 1, get_latlons=False, cache_dir=tmp_path
+    )
+    assert [p.suffix for p in tmp_path.iterdir()] == [".npz"]
+
+
+def test_merge_cache_key_hashes_read_pop_table(
+    ita_policies, ita_adm1_cases, tmp_path, monkeypatch
+):
+    key = cmerge.get_merge_cache_key(ita_adm1_cases, ita_policies, 1)
+
+    # Once a columnar copy of the populations is the table read, the key follows it
+    columnar_path = tmp_path / "adm1.npz"
+    cpop.write_adm_pop_columnar(
+        pd.read_csv(cpop.get_adm_pop_path(1, "ITA")), columnar_path
+    )
+    monkeypatch.setattr(
+        cpop, "get_adm_pop_columnar_path", lambda adm_level, country_code: columnar_path
+    )
+    assert cpop.get_adm_pop_source_path(1, "ITA") == columnar_path
+    assert cmerge.get_merge_cache_key(ita_adm1_cases, ita_policies, 1) != key
+
+
+@pytest.mark.parametrize("split_date", ["2020-03-01", "2020-03-10"])
+def test_append_cases_matches_full_merge(ita_policies, ita_adm2_cases, split_date):
+    expected = cmerge.assign_policies_to_panel(
+        ita_adm2_cases, ita_policies, 2, get_latlons=False
+    )
+
+    old_cases = ita_adm2_cases[ita_adm2_cases["date"] < split_date]
+    merged = cmerge.assign_policies_to_panel(
+        old_cases, ita_policies, 2, get_latlons=False
+    )
+    result, policies_hash = cmerge.append_cases_to_panel(
+        merged,
+        ita_adm2_cases,
+        ita_policies,
+        2,
+        merged_policies_hash=cmerge.hash_frame(ita_policies),
+        get_latlons=False,
+    )
+
+    pd.testing.assert_frame_equal(result, expected)
+    assert policies_hash == cmerge.hash_frame(ita_policies)
+
+
+def test_append_cases_rebuilds_when_policies_change(usa_inputs):
+    cases, policies = usa_inputs
+    cases = cases.sort_values(["date", "adm1_name"]).reset_index(drop=True)
+    old_cases = cases[cases["date"] < "2020-03-15"]
+    new_cases = cases[cases["date"] >= "2020-03-15"]
+    merged = cmerge.assign_policies_to_panel(old_cases, policies, 1, method="USA")
+    policies_hash = cmerge.hash_frame(policies)
+
+    # Unchanged policies are only applied to the new dates
+    policy_memo = cmerge.init_policy_memo()
+    result, _ = cmerge.append_cases_to_panel(
+        merged,
+        new_cases,
+        policies,
+        1,
+        merged_policies_hash=policies_hash,
+        method="USA",
+        policy_memo=policy_memo,
+    )
+    expected = cmerge.assign_policies_to_panel(cases, policies, 1, method="USA")
+    pd.testing.assert_frame_equal(result, expected, check_exact=False, rtol=1e-12)
+
+    # Changed policies are applied to all dates again
+    changed = policies.iloc[1:]
+    result, changed_hash = cmerge.append_cases_to_panel(
+        merged, new_cases, changed, 1, merged_policies_hash=policies_hash, method="USA"
+    )
+    expected = cmerge.assign_policies_to_panel(cases, changed, 1, method="USA")
+    pd.testing.assert_frame_equal(result, expected, check_exact=False, rtol=1e-12)
+    assert changed_hash != policies_hash
+
+
+@pytest.fixture(scope="module")
+def opt_popwt_inputs():
+    """Synthetic country with optional policies whose pop-weighted values are used where their
+    optional indicator is not: in A0 once a mandatory policy covers part of it, and in A1 on every
+    date"""
+    country = cbench.make_synthetic_country(2, 2, 1, 20, seed=0)
+    policies = pd.DataFrame(
+        {
+            "adm0_name": "SYN",
+            "adm1_name": ["A0", "A0", "A1", "A1", "All"],
+            "adm2_name": ["All", "A0B0", "All", "A1B1", "All"],
+            "adm3_name": "All",
+            "date_start": pd.to_datetime(
+                ["2020-01-03", "2020-01-05", "2020-01-05", "2020-01-05", "2020-01-10"]
+            ),
+            "date_end": pd.NaT,
+            "policy": ["p", "p", "p", "p", "q"],
+            "policy_intensity": 1.0,
+            "optional": ["Y", "N", "Y", "N", "N"],
+        }
+    )
+    return country, policies
+
+
+@pytest.mark.parametrize("split_date", ["2020-01-04", "2020-01-08"])
+def test_append_cases_keeps_opt_popwt(opt_popwt_inputs, split_date):
+    country, policies = opt_popwt_inputs
+    cases = country["cases"][1]
+    with cbench.synthetic_data_interim(country["adm_tables"]):
+        expected = cmerge.assign_policies_to_panel(
+            cases, policies, 1, get_latlons=False
+        )
+        merged = cmerge.assign_policies_to_panel(
+            cases[cases["date"] < split_date], policies, 1, get_latlons=False
+        )
+        result, _ = cmerge.append_cases_to_panel(
+            merged,
+            cases,
+            policies,
+            1,
+            merged_policies_hash=cmerge.hash_frame(policies),
+            get_latlons=False,
+        )
+
+    # The optional indicator is 0 on every new date, but its pop-weighted value is not
+    assert (expected["p_opt_popwt"] > 0).any()
+    assert (expected.loc[expected["date"] >= "2020-01-05", "p_opt"] == 0).all()
+    pd.testing.assert_frame_equal(
+        result.sort_values(["adm1_name", "date"], ignore_index=True), expected
+    )
+
+
+@pytest.mark.parametrize("adm_level", [1, 2])
+def test_get_intensities_batched_matches_get_intensities(adm_level):
+    rng = np.random.default_rng(0)
+    tables = []
+    for n in rng.integers(0, 20, 40):
+        policy_level = rng.integers(0, 4, n)
+        table = pd.DataFrame(
+            {
+                "adm1_name": np.where(policy_level >= 1, "A", "All"),
+                "adm2_name": np.where(
+                    policy_level >= 2, rng.choice(["a1", "a2"], n), "All"
+                ),
+                "adm3_name": np.where(policy_level == 3, "x", "All"),
+                "policy_level": policy_level,
+                "policy_intensity": rng.choice([0.25, 0.5, 0.75, 1.0], n)
+                * np.where(policy_level <= 1, 0.5, 1),
+                "adm1_pop": 1e7,
+                "adm2_pop": rng.uniform(1e5, 5e5, n),
+                "adm3_pop": rng.uniform(1e2, 1e3, n),
+            }
+        )
+        if rng.random() < 0.3:
+            table["policy_intensity"] = (table["policy_intensity"] >= 0.5).astype(int)
+        tables.append(table)
+
+    stacked = pd.concat(tables, ignore_index=True)
+    stacked["group"] = np.repeat(np.arange(len(tables)), [len(t) for t in tables])
+    for level, ancestor in [(2, 1), (3, 1), (3, 2)]:
+        stacked[cpop.get_pop_ratio_col(level, ancestor)] = (
+            stacked[f"adm{level}_pop"] / stacked[f"adm{ancestor}_pop"]
+        )
+    is_int = np.array([t["policy_intensity"].dtype == int for t in tables])
+    result = cmerge.get_intensities_batched(stacked, len(tables), is_int, adm_level)
+
+    for table, (total, max_intensity) in zip(tables, result):
+        expected_total, expected_max = cmerge.get_intensities(table, adm_level)
+        assert total == expected_total
+        assert max_intensity == expected_max or np.isnan(expected_max)
+        assert isinstance(max_intensity, int) == isinstance(
+            expected_max, (int, np.integer)
+        )
+
+
+def test_merge_profile(ita_policies, ita_adm1_cases):
+    profile = cprof.init_profile()
+    cmerge.assign_policies_to_panel(
+        ita_adm1_cases, ita_policies, 1, get_latlons=False, profile=profile
+    )
+
+    stages = profile["stages"]
+    assert {
+        "assign_all_populations",
+        "get_policy_level",
+        "calculate_timeline_intensities",
+        "merge_with_cases",
+    } <= set(stages)
+    assert (
+        stages["assign_policies_to_panel"]["seconds"]
+        >= stages["assign_policies_interval"]["seconds"]
+    )
+    assert set(profile["policies"]) == set(ita_policies["policy"])
+    assert profile["missing_pops"] == {"policies": dict(), "cases": dict()}
+    assert profile["memo"]["misses"] > 0
+    assert 0 <= profile["memo"]["hit_rate"] <= 1
+
+
+def test_stream_adm1_matches_full_merge(ita_policies, ita_adm2_cases, usa_inputs):
+    for cases, policies, cases_level, kwargs in [
+        (ita_adm2_cases, ita_policies, 2, dict(get_latlons=False)),
+        (*usa_inputs, 1, dict(method="USA")),
+    ]:
+        expected = cmerge.assign_policies_to_panel(
+            cases, policies, cases_level, **kwargs
+        )
+        result = cmerge.assign_policies_to_panel(
+            cases, policies, cases_level, stream_adm1=True, **kwargs
+        )
+        pd.testing.assert_frame_equal(result, expected, check_exact=False, rtol=1e-12)
+
+
+def test_stream_adm1_with_repeated_names():
+    country = cbench.make_synthetic_country(3, 3, 2, 30, seed=2)
+
+    # Name adm-units below adm1 the same way in every adm1 unit, as US counties often are
+    def strip_adm1(df):
+        return df.assign(
+            **{
+                col: df[col].str.replace(r"^A\d+", "", regex=True)
+                for col in ["adm2_name", "adm3_name"]
+                if col in df.columns
+            }
+        )
+
+    with cbench.synthetic_data_interim(country["adm_tables"]):
+        expected = cmerge.assign_policies_to_panel(
+            country["cases"][3], country["policies"], 3, get_latlons=False
+        )
+
+    adm_tables = {level: strip_adm1(t) for level, t in country["adm_tables"].items()}
+    cases = strip_adm1(country["cases"][3])
+    policies = strip_adm1(country["policies"])
+    with cbench.synthetic_data_interim(adm_tables):
+        with pytest.raises(ValueError, match="stream_adm1"):
+            cmerge.assign_policies_to_panel(
+                cases, policies, 3, get_latlons=False, engine="reference"
+            )
+        result = cmerge.assign_policies_to_panel(
+            cases, policies, 3, get_latlons=False, stream_adm1=True
+        )
+
+    pd.testing.assert_frame_equal(result, strip_adm1(expected))
+
+
+def test_stream_adm1_keeps_opt_popwt(opt_popwt_inputs):
+    country, policies = opt_popwt_inputs
+    cases = country["cases"][1]
+    with cbench.synthetic_data_interim(country["adm_tables"]):
+        expected = cmerge.assign_policies_to_panel(
+            cases, policies, 1, get_latlons=False
+        )
+        result = cmerge.assign_policies_to_panel(
+            cases, policies, 1, get_latlons=False, stream_adm1=True
+        )
+
+    # Merged on its own, A1 has no optional indicator, but has optional pop-weighted values
+    a1 = expected[expected["adm1_name"] == "A1"]
+    assert (a1["p_opt"] == 0).all() and (a1["p_opt_popwt"] > 0).any()
+    pd.testing.assert_frame_equal(result, expected)
+
+
+def assert_stream_matches(chunks, expected):
+    # Windows hold the rows of their dates in their original order, with the columns and types of
+    # the whole panel
+    assert all(chunk.dtypes.equals(expected.dtypes) for chunk in chunks)
+    keys = ["date"] + [c for c in expected.columns if c.endswith("_name")]
+    result = pd.concat(chunks).sort_values(keys).reset_index(drop=True)
+    expected = expected.sort_values(keys).reset_index(drop=True)
+    pd.testing.assert_frame_equal(result, expected)
+
+
+@pytest.mark.parametrize("chunk_days", [1, 10, 1000])
+def test_stream_policies_to_sink(ita_policies, ita_adm2_cases, chunk_days):
+    expected = cmerge.assign_policies_to_panel(
+        ita_adm2_cases, ita_policies, 2, get_latlons=False
+    )
+
+    chunks = []
+    policy_memo = cmerge.init_policy_memo()
+    n_rows = cmerge.stream_policies_to_sink(
+        ita_adm2_cases,
+        ita_policies,
+        2,
+        chunks.append,
+        chunk_days=chunk_days,
+        get_latlons=False,
+        policy_memo=policy_memo,
+    )
+
+    assert n_rows == len(expected)
+    assert_stream_matches(chunks, expected)
+    if chunk_days == 1:
+        # Intensities in force across windows are calculated once
+        assert policy_memo["hits"] > 0
+
+
+@pytest.mark.parametrize("stream_adm1", [False, True])
+def test_stream_policies_keeps_merged_types(opt_popwt_inputs, stream_adm1):
+    country, policies = opt_popwt_inputs
+    cases = country["cases"][2]
+    # Intensities are integers up to the date the pop-weighted values of p start being fractions
+    policies = policies.assign(
+        policy_intensity=[1.0, 1.0, 1.0, 0.5, 1.0], optional=["Y", "N", "Y", "N", "N"]
+    )
+    with cbench.synthetic_data_interim(country["adm_tables"]):
+        expected = cmerge.assign_policies_to_panel(
+            cases, policies, 2, get_latlons=False, stream_adm1=stream_adm1
+        )
+        chunks = []
+        cmerge.stream_policies_to_sink(
+            cases,
+            policies,
+            2,
+            chunks.append,
+            chunk_days=3,
+            get_latlons=False,
+            stream_adm1=stream_adm1,
+        )
+
+    assert len(chunks) > 1
+    assert_stream_matches(chunks, expected)
+
+
+def test_stream_policies_to_files(usa_inputs, tmp_path):
+    cases, policies = usa_inputs
+    expected = cmerge.assign_policies_to_panel(cases, policies, 1, method="USA")
+
+    cmerge.stream_policies_to_sink(
+        cases,
+        policies,
+        1,
+        cmerge.columnar_sink(tmp_path / "parts"),
+        chunk_days=20,
+        method="USA",
+    )
+    parts = sorted((tmp_path / "parts").glob("part-*.npz"))
+    assert len(parts) > 1
+    assert_stream_matches([ccol.read_columnar(p) for p in parts], expected)
+
+    cmerge.stream_policies_to_sink(
+        cases,
+        policies,
+        1,
+        cmerge.csv_sink(tmp_path / "panel.csv"),
+        chunk_days=20,
+        method="USA",
+        stream_adm1=True,
+    )
+    result = pd.read_csv(tmp_path / "panel.csv", parse_dates=["date"])
+    assert_stream_matches([result], expected)
+
+
+def test_diff_policies():
+    old = pd.DataFrame(
+        {"policy": ["p", "q", "q", "r"], "policy_intensity": [1, 1, 1, 1]}
+    )
+    new = pd.DataFrame(
+        {"policy": ["r", "q", "p", "s"], "policy_intensity": [1, 1, 0.5, 1]}
+    )
+    changed = cmerge.diff_policies(old, new)
+
+    # Moving a row changes nothing, but removing one of two repeated rows does
+    assert changed.to_dict("list") == {
+        "policy": ["p", "q", "p", "s"],
+        "policy_intensity": [1, 1, 0.5, 1],
+    }
+
+
+def test_get_affected_units():
+    changed = pd.DataFrame(
+        {
+            "adm1_name": ["A", "B", "All"],
+            "adm2_name": ["a1", "all", "All"],
+            "adm3_name": ["a1x", "All", "All"],
+            "policy": ["p", "p", "q"],
+        }
+    )
+    cases = pd.DataFrame(
+        {"adm1_name": ["A", "A", "B", "C"], "adm2_name": ["a1", "a2", "b1", "c1"]}
+    )
+
+    # Policies below the level of the panel affect the adm-units they are in
+    assert cmerge.get_affected_units(changed, cases, 2) == {
+        "p": ["a1", "b1"],
+        "q": ["a1", "a2", "b1", "c1"],
+    }
+
+
+def test_update_panel_for_policy_edits(ita_policies, ita_adm2_cases, usa_inputs):
+    ita_edited = ita_policies.copy()
+    ita_edited.loc[ita_edited["adm2_name"] == "Padova", "policy_intensity"] = 0.5
+    ita_edited = ita_edited.drop(index=ita_edited.index[5])
+    moved = ita_edited.iloc[[40]].assign(
+        date_start=ita_edited["date_start"].iloc[40] - pd.Timedelta(days=7)
+    )
+    ita_edited = pd.concat([ita_edited, moved])
+
+    usa_cases, usa_policies = usa_inputs
+    usa_edited = usa_policies.copy()
+    usa_edited.loc[usa_edited["adm1_name"] == "Texas", "date_start"] += pd.Timedelta(
+        days=3
+    )
+    usa_halved = usa_policies.copy()
+    usa_halved.loc[
+        (usa_halved["adm1_name"] == "Texas")
+        & (usa_halved["policy"] == "school_closure"),
+        "intensity_group",
+    ] = "school closure - optional"
+
+    for cases, old_policies, new_policies, cases_level, kwargs in [
+        (ita_adm2_cases, ita_policies, ita_edited, 2, dict(get_latlons=False)),
+        (usa_cases, usa_policies, usa_edited, 1, dict(method="USA")),
+        # Intensities of all adm-units being integers again gives an integer column
+        (usa_cases, usa_halved, usa_policies, 1, dict(method="USA")),
+    ]:
+        merged = cmerge.assign_policies_to_panel(
+            cases, old_policies, cases_level, **kwargs
+        )
+        expected = cmerge.assign_policies_to_panel(
+            cases, new_policies, cases_level, **kwargs
+        )
+        result = cmerge.update_panel_for_policy_edits(
+            merged, cases, old_policies, new_policies, cases_level, **kwargs
+        )
+        pd.testing.assert_frame_equal(result, expected, check_exact=False, rtol=1e-12)
+
+
+def test_update_panel_for_new_policy_category(ita_policies, ita_adm1_cases):
+    edited = pd.concat(
+        [ita_policies, ita_policies.iloc[[0]].assign(policy="new_policy")]
+    )
+    merged = cmerge.assign_policies_to_panel(
+        ita_adm1_cases, ita_policies, 1, get_latlons=False
+    )
+    result = cmerge.update_panel_for_policy_edits(
+        merged, ita_adm1_cases, ita_policies, edited, 1, get_latlons=False
+    )
+
+    assert "new_policy" in result.columns
+    pd.testing.assert_frame_equal(
+        result,
+        cmerge.assign_policies_to_panel(ita_adm1_cases, edited, 1, get_latlons=False),
+    )
+
+
+@pytest.mark.parametrize(
+    "policy,optional,edit",
+    [
+        # Edits to optional rows only change the variables of their own category
+        ("work_from_home", "Y", dict(policy_intensity=0.25)),
+        # Edits making the only optional rows mandatory, or the reverse, change categories
+        ("social_distance", "Y", dict(optional="N")),
+        ("business_closure", "N", dict(optional="Y")),
+    ],
+)
+def test_update_panel_for_optional_edits(
+    ita_policies, ita_adm1_cases, policy, optional, edit
+):
+    kwargs = dict(aggregate_vars=["work_from_home"], get_latlons=False)
+    edited = ita_policies.copy()
+    rows = (edited["policy"] == policy) & (edited["optional"] == optional)
+    for col, value in edit.items():
+        edited.loc[rows, col] = value
+
+    merged = cmerge.assign_policies_to_panel(ita_adm1_cases, ita_policies, 1, **kwargs)
+    expected = cmerge.assign_policies_to_panel(ita_adm1_cases, edited, 1, **kwargs)
+    result = cmerge.update_panel_for_policy_edits(
+        merged, ita_adm1_cases, ita_policies, edited, 1, **kwargs
+    )
+    pd.testing.assert_frame_equal(result, expected, check_exact=False, rtol=1e-12)
+
+
+def test_sparse_policy_cols(usa_inputs, tmp_path):
+    cases, policies = usa_inputs
+    expected = cmerge.assign_policies_to_panel(cases, policies, 1, method="USA")
+    result = cmerge.assign_policies_to_panel(
+        cases, policies, 1, method="USA", sparse=True, cache_dir=tmp_path
+    )
+
+    policy_cols = cmerge.get_merged_policy_cols(expected, policies)
+    assert "policies_enacted" in policy_cols
+    assert all(isinstance(result[col].dtype, pd.SparseDtype) for col in policy_cols)
+    pd.testing.assert_frame_equal(cmerge.densify_cols(result), expected)
+
+    # Policy variables are stored as runs in the cache, and read back as sparse columns
+    cached = cmerge.assign_policies_to_panel(
+        cases, policies, 1, method="USA", sparse=True, cache_dir=tmp_path
+    )
+    pd.testing.assert_frame_equal(cached, result)
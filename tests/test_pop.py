@@ -0,0 +1,170 @@
+import os
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import src.benchmark as cbench
+import src.columnar as ccol
+import src.pop as cpop
+
+
+def test_adm_pop_store_reloads_changed_tables(monkeypatch):
+    country = cbench.make_synthetic_country(2, 2, 1, 10)
+    reads = []
+    read_csv = pd.read_csv
+    monkeypatch.setattr(
+        pd, "read_csv", lambda *a, **k: reads.append(a) or read_csv(*a, **k)
+    )
+
+    with cbench.synthetic_data_interim(country["adm_tables"]) as data_interim:
+        pops = cpop.get_adm_pops(2, cbench.SYNTHETIC_ISO, latlons=True)
+        assert list(pops.index.names) == ["adm1_name", "adm2_name"]
+        assert list(pops.columns) == ["adm2_pop", "lat", "lon"]
+        pd.testing.assert_frame_equal(
+            cpop.get_adm_pops(2, cbench.SYNTHETIC_ISO, latlons=True), pops
+        )
+        assert cpop.get_adm_pops(2, "ITA").empty
+        assert len(reads) == 1
+
+        # Tables are read again once changed on disk
+        path = data_interim / "adm" / "adm2" / "adm2.csv"
+        adm2 = country["adm_tables"][2].assign(population=1)
+        adm2.to_csv(path, index=False)
+        stat = os.stat(path)
+        os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10 ** 9))
+        assert (cpop.get_adm_pops(2, cbench.SYNTHETIC_ISO)["adm2_pop"] == 1).all()
+        assert len(reads) == 2
+
+    cpop.clear_adm_pop_store()
+    assert len(cpop.adm_pop_store) == 0
+
+
+def test_adm_pop_columnar_tables(monkeypatch):
+    country = cbench.make_synthetic_country(2, 2, 1, 10)
+    with cbench.synthetic_data_interim(country["adm_tables"]) as data_interim:
+        pops = cpop.get_adm_pops(2, cbench.SYNTHETIC_ISO, latlons=True)
+        cpop.clear_adm_pop_store()
+
+        # The columnar copy is read in place of the CSV while at least as new
+        csv_path = data_interim / "adm" / "adm2" / "adm2.csv"
+        columnar_path = cpop.get_adm_pop_columnar_path(2, cbench.SYNTHETIC_ISO)
+        cpop.write_adm_pop_columnar(pd.read_csv(csv_path), columnar_path)
+        monkeypatch.setattr(pd, "read_csv", None)
+        pd.testing.assert_frame_equal(
+            cpop.get_adm_pops(2, cbench.SYNTHETIC_ISO, latlons=True), pops
+        )
+        assert cpop.get_adm_pops(2, "ITA").empty
+        assert list(cpop.adm_pop_store) == [columnar_path]
+        monkeypatch.undo()
+
+        stat = os.stat(columnar_path)
+        os.utime(csv_path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10 ** 9))
+        pd.testing.assert_frame_equal(
+            cpop.get_adm_pops(2, cbench.SYNTHETIC_ISO, latlons=True), pops
+        )
+        assert csv_path in cpop.adm_pop_store
+
+    cpop.clear_adm_pop_store()
+
+
+def test_adm_pop_columnar_types(monkeypatch):
+    country = cbench.make_synthetic_country(2, 2, 1, 10)
+    adm2 = country["adm_tables"][2]
+
+    # Populations read from the CSV are floats if any, even of another country, are missing
+    other = adm2.iloc[[0]].assign(adm0_name="OTH", population=np.nan)
+    adm_tables = {**country["adm_tables"], 2: pd.concat([adm2, other])}
+    with cbench.synthetic_data_interim(adm_tables):
+        pops = cpop.get_adm_pops(2, cbench.SYNTHETIC_ISO)
+        assert pops["adm2_pop"].dtype == float
+        cpop.clear_adm_pop_store()
+
+        # The columnar copy is written from the table in memory, and only its rows of the
+        # country are decoded
+        columnar_path = cpop.get_adm_pop_columnar_path(2, cbench.SYNTHETIC_ISO)
+        cpop.write_adm_pop_columnar(adm_tables[2], columnar_path)
+        read_columnar = ccol.read_columnar
+
+        def read_filtered(path, columns=None, filters=None):
+            assert filters is not None
+            return read_columnar(path, columns=columns, filters=filters)
+
+        monkeypatch.setattr(ccol, "read_columnar", read_filtered)
+        pd.testing.assert_frame_equal(cpop.get_adm_pops(2, cbench.SYNTHETIC_ISO), pops)
+        assert list(cpop.adm_pop_store) == [columnar_path]
+
+    cpop.clear_adm_pop_store()
+
+
+def test_assign_pop_ratios():
+    country = cbench.make_synthetic_country(2, 2, 2, 10)
+    with cbench.synthetic_data_interim(country["adm_tables"]):
+        policies = cpop.merge_policies_with_population(
+            country["policies"], cbench.SYNTHETIC_ISO, 3, errors="ignore"
+        )
+        policies = cpop.assign_pop_ratios(policies, cbench.SYNTHETIC_ISO, 3)
+        for level, ancestor in [(2, 1), (3, 1), (3, 2)]:
+            ratio = policies[f"adm{level}_pop"] / policies[f"adm{ancestor}_pop"]
+            np.testing.assert_array_equal(
+                policies[cpop.get_pop_ratio_col(level, ancestor)], ratio
+            )
+
+        # Ratios are computed once while the tables of populations are unchanged
+        entry = cpop.get_adm_pop_ratios(3, cbench.SYNTHETIC_ISO)
+        assert cpop.get_adm_pop_ratios(3, cbench.SYNTHETIC_ISO) is entry
+        assert entry["ratios"].shape == (len(entry["index"]), 2)
+
+    cpop.clear_adm_pop_store()
+    assert len(cpop.adm_pop_ratio_store) == 0
+
+
+def test_validate_populations():
+    country = cbench.make_synthetic_country(2, 2, 2, 10)
+    adm_tables = dict(country["adm_tables"])
+    adm_tables[2] = adm_tables[2][adm_tables[2]["adm2_name"] != "A1B1"]
+    cases = country["cases"][2]
+    with cbench.synthetic_data_interim(adm_tables):
+        policies = cpop.merge_policies_with_population(
+            country["policies"], cbench.SYNTHETIC_ISO, 3, errors="ignore"
+        )
+        cases = cpop.merge_cases_with_population_on_level(
+            cases, 2, cbench.SYNTHETIC_ISO, errors="ignore"
+        )
+    cpop.clear_adm_pop_store()
+
+    report = cpop.validate_populations(policies, cases, 2, errors="ignore")
+    assert report == {"policies": {2: ["A1B1"]}, "cases": {2: ["A1B1"]}}
+    with pytest.warns(UserWarning, match="adm2_name in cases"):
+        cpop.validate_populations(policies, cases, 2, errors="warn")
+    with pytest.raises(ValueError, match="A1B1"):
+        cpop.validate_populations(policies, cases, 2)
+
+    filled = policies[policies["adm2_name"] != "A1B1"]
+    report = cpop.validate_populations(filled, cases.dropna(subset=["population"]), 2)
+    assert report == {"policies": dict(), "cases": dict()}
+
+
+def test_assign_all_populations_validates_once(monkeypatch):
+    country = cbench.make_synthetic_country(2, 2, 2, 10)
+    adm_tables = dict(country["adm_tables"])
+    adm_tables[2] = adm_tables[2][adm_tables[2]["adm2_name"] != "A1B1"]
+    checks = []
+    monkeypatch.setattr(
+        cpop, "check_population_col_is_filled", lambda *a, **k: checks.append(a)
+    )
+
+    with cbench.synthetic_data_interim(adm_tables):
+        policies, cases, report = cpop.assign_all_populations(
+            country["policies"],
+            country["cases"][2],
+            2,
+            get_latlons=False,
+            errors="ignore",
+        )
+    cpop.clear_adm_pop_store()
+
+    # Missing populations are reported by `validate_populations` alone
+    assert checks == []
+    assert report == {"policies": {2: ["A1B1"]}, "cases": {2: ["A1B1"]}}
+    assert cases["population"].isnull().any()
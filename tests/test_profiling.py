@@ -0,0 +1,44 @@
+import json
+
+import numpy as np
+import pytest
+
+import src.profiling as cprof
+
+
+@pytest.mark.parametrize("can_reset_peak", [True, False])
+def test_profile_stage_records_nested_stages(tmp_path, monkeypatch, can_reset_peak):
+    # Python 3.7 and 3.8 can't reset the peak of traced memory
+    monkeypatch.setattr(
+        cprof, "can_reset_peak", can_reset_peak and cprof.can_reset_peak
+    )
+    profile = cprof.init_profile(trace_memory=True)
+    for _ in range(2):
+        with cprof.profile_stage(profile, "outer"):
+            with cprof.profile_stage(profile, "inner"):
+                big = np.ones(2 ** 20)
+            del big
+            with cprof.profile_stage(profile, "p", group="policies"):
+                pass
+
+    assert profile["stages"]["outer"]["calls"] == 2
+    assert profile["stages"]["inner"]["calls"] == 2
+    assert profile["policies"]["p"]["calls"] == 2
+    assert (
+        profile["stages"]["outer"]["seconds"] >= profile["stages"]["inner"]["seconds"]
+    )
+
+    # The 8 MB allocated by the inner stage also counts towards the outer stage's peak
+    assert profile["stages"]["inner"]["peak_mb"] >= 8
+    assert profile["stages"]["outer"]["peak_mb"] >= 8
+    assert profile["policies"]["p"]["peak_mb"] < 1
+
+    cprof.write_profile(profile, tmp_path / "profile.json")
+    with open(tmp_path / "profile.json") as f:
+        assert json.load(f)["stages"].keys() == {"outer", "inner"}
+
+
+def test_profile_stage_does_nothing_without_profile():
+    with cprof.profile_stage(None, "stage"):
+        pass
+    cprof.record_memo(None, {"hits": 1, "misses": 1})
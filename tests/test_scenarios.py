@@ -0,0 +1,94 @@
+import pandas as pd
+import pytest
+
+import src.benchmark as cbench
+import src.merge as cmerge
+import src.scenarios as cscen
+
+
+@pytest.fixture(scope="module")
+def country():
+    return cbench.make_synthetic_country(3, 3, 2, 60, seed=1)
+
+
+def test_apply_scenario(country):
+    policies = country["policies"]
+    category = policies["policy"].iloc[0]
+    edited = cscen.apply_scenario(
+        policies,
+        [
+            {"edit": "drop", "policy": category},
+            {"edit": "shift", "adm1_name": "A0", "days": -7},
+            {"edit": "add", "rows": policies.iloc[[0]]},
+        ],
+    )
+
+    assert (edited["policy"] == category).sum() == 1
+    shifted = policies[
+        (policies["policy"] != category) & (policies["adm1_name"] == "A0")
+    ]
+    assert (
+        edited.loc[shifted.index, "date_start"]
+        == shifted["date_start"] - pd.Timedelta(days=7)
+    ).all()
+
+    with pytest.raises(ValueError, match="matches no policies"):
+        cscen.apply_scenario(policies, [{"edit": "drop", "adm1_name": "Z"}])
+    with pytest.raises(ValueError, match="Unknown scenario edit"):
+        cscen.apply_scenario(policies, [{"edit": "scale"}])
+
+
+@pytest.mark.parametrize("aggregate_vars", [[], ["work_from_home"]])
+def test_run_scenarios_match_full_merge(country, monkeypatch, aggregate_vars):
+    policies = country["policies"]
+    categories = policies["policy"].value_counts().index
+    scenarios = {
+        "no_first_category": [{"edit": "drop", "policy": categories[0]}],
+        "A1_earlier": [{"edit": "shift", "adm1_name": "A1", "days": -7}],
+        "weaker": [
+            {"edit": "set_intensity", "policy": categories[2], "policy_intensity": 0.1}
+        ],
+    }
+
+    with cbench.synthetic_data_interim(country["adm_tables"]):
+        context = cscen.prepare_scenario_context(
+            country["cases"][2],
+            policies,
+            2,
+            get_latlons=False,
+            aggregate_vars=aggregate_vars,
+        )
+
+        # Scenarios reuse the prepared baseline, and only prepare their own policies
+        prepare_merge_inputs = cmerge.prepare_merge_inputs
+        n_prepared = []
+
+        def count_prepared(*args, **kwargs):
+            n_prepared.append(1)
+            return prepare_merge_inputs(*args, **kwargs)
+
+        hits = context["policy_memo"]["hits"]
+        with monkeypatch.context() as m:
+            m.setattr(cmerge, "prepare_merge_inputs", count_prepared)
+            panels = cscen.run_scenarios(context, scenarios)
+        assert len(n_prepared) == len(scenarios)
+        assert context["policy_memo"]["hits"] > hits
+
+        for name, edits in scenarios.items():
+            expected = cmerge.assign_policies_to_panel(
+                country["cases"][2],
+                cscen.apply_scenario(policies, edits),
+                2,
+                get_latlons=False,
+                aggregate_vars=aggregate_vars,
+            )
+            result = panels[name]
+
+            # Scenario panels keep the columns of the baseline
+            assert list(result.columns[: context["merged"].shape[1]]) == list(
+                context["merged"].columns
+            )
+            assert (result.drop(columns=expected.columns) == 0).all().all()
+            pd.testing.assert_frame_equal(
+                result[expected.columns], expected, check_exact=False, rtol=1e-12
+            )